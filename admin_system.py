@@ -8,7 +8,7 @@ import asyncio
 from db import (
     get_all_user_ids, get_user_name, get_hearts, get_points, get_level,
     get_streak_days, get_total_messages, is_banned, ban_user, unset_ban,
-    get_user_trial_status, set_user_trial_status, grant_access
+    get_user_trial_status, set_user_trial_status, grant_access, has_access
 )
 from logger import bot_logger
 from config import config
@@ -72,8 +72,7 @@ class AdminSystem:
             for user_id in all_users:
                 try:
                     # Проверяем премиум доступ
-                    access_info = await grant_access(user_id, 0)
-                    if access_info and access_info.get('has_access', False):
+                    if await has_access(user_id):
                         premium_users += 1
                     
                     # Проверяем пробный день
@@ -158,8 +157,7 @@ class AdminSystem:
             trial_status = await get_user_trial_status(user_id)
             
             # Проверяем премиум доступ
-            access_info = await grant_access(user_id, 0)
-            has_premium = access_info and access_info.get('has_access', False)
+            has_premium = await has_access(user_id)
             
             user_text = f"""
 👤 ИНФОРМАЦИЯ О ПОЛЬЗОВАТЕЛЕ
@@ -220,7 +218,7 @@ class AdminSystem:
     async def grant_access_command(self, user_id: int, days: int) -> str:
         """Предоставляет доступ пользователю"""
         try:
-            await grant_access(user_id, days)
+            await grant_access(user_id, days, access_type="paid")
             bot_logger.log_admin_action("grant_access", {"user_id": user_id, "days": days})
             
             return f"✅ Пользователю {user_id} предоставлен доступ на {days} дней"
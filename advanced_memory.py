@@ -5,14 +5,18 @@
 
 import re
 import json
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Any
 from dataclasses import dataclass, asdict
 
+from config import config
 from db import (
     get_memory, save_message, get_user_name, get_relationship_level,
-    get_total_messages, get_days_active
+    get_total_messages, get_days_active, get_user_messages_after, UserContext,
+    get_user_facts as load_user_facts, save_user_facts as store_user_facts
 )
+from memory_retrieval import format_snippets, retrieve_relevant
 
 @dataclass
 class UserFact:
@@ -33,65 +37,135 @@ class ConversationTopic:
     discussion_count: int
     sentiment: str  # "positive", "negative", "neutral"
 
+def _compile_literals(words) -> "re.Pattern":
+    """Одно выражение, находящее любое из слов (длинные раньше коротких)."""
+    ordered = sorted(set(words), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(word) for word in ordered))
+
+
+class FactExtractor:
+    """Скомпилированный набор паттернов фактов с префильтром по триггерам.
+
+    Все слова-триггеры ищутся одним выражением; паттерны, чьих триггеров
+    в сообщении нет, не запускаются, а сообщение без триггеров вообще не
+    проверяется регулярными выражениями. findall по триггерам не находит
+    триггеры, перекрытые другим совпадением, поэтому к найденным
+    добавляются все триггеры, которые могли быть ими перекрыты (это
+    вычисляется заранее) — префильтр не теряет фактов.
+    """
+
+    def __init__(self, fact_patterns: Dict[str, List[Tuple[str, str]]]):
+        self._rules: List[Tuple[str, str, "re.Pattern"]] = [
+            (trigger, fact_type, re.compile(pattern, re.IGNORECASE))
+            for fact_type, patterns in fact_patterns.items()
+            for trigger, pattern in patterns
+        ]
+        triggers = {trigger for trigger, _, _ in self._rules}
+        self._trigger_regex = _compile_literals(triggers)
+        self._shadowed = {trigger: self._shadowed_by(trigger, triggers) for trigger in triggers}
+
+    @staticmethod
+    def _shadowed_by(found: str, triggers) -> set:
+        """Триггеры, которые могли остаться незамеченными из-за совпадения found."""
+        shadowed = {found}
+        for other in triggers:
+            if other in found or any(other.startswith(found[i:]) for i in range(1, len(found))):
+                shadowed.add(other)
+        return shadowed
+
+    def extract(self, message: str) -> List[Tuple[str, str]]:
+        """Пары (тип факта, содержание) в порядке паттернов, без повторов."""
+        message_lower = message.lower()
+        found = self._trigger_regex.findall(message_lower)
+        if not found:
+            return []
+
+        active = set()
+        for trigger in set(found):
+            active |= self._shadowed[trigger]
+
+        results = []
+        seen = set()
+        for trigger, fact_type, regex in self._rules:
+            if trigger not in active:
+                continue
+            for match in regex.findall(message_lower):
+                content = match.strip()
+                if len(content) > 2 and (fact_type, content) not in seen:  # Игнорируем слишком короткие совпадения
+                    seen.add((fact_type, content))
+                    results.append((fact_type, content))
+        return results
+
+
+def _parse_timestamp(value: Optional[str]) -> datetime:
+    """Дата из SQLite (CURRENT_TIMESTAMP) -> datetime."""
+    try:
+        return datetime.fromisoformat(value) if value else datetime.now()
+    except ValueError:
+        return datetime.now()
+
+
 class AdvancedMemorySystem:
     def __init__(self):
-        # Паттерны для извлечения фактов
+        # Паттерны для извлечения фактов: (слово-триггер, паттерн). Триггер —
+        # подстрока, без которой паттерн не может совпасть (сообщение
+        # переводится в нижний регистр)
         self.fact_patterns = {
             "job": [
-                r"работаю\s+(?:как\s+)?([^,\.!?]+)",
-                r"я\s+([^,\.!?]*программист[^,\.!?]*)",
-                r"моя\s+работа\s+([^,\.!?]+)",
-                r"занимаюсь\s+([^,\.!?]+)",
-                r"по\s+профессии\s+([^,\.!?]+)"
+                ("работаю", r"работаю\s+(?:как\s+)?([^,\.!?]+)"),
+                ("программист", r"я\s+([^,\.!?]*программист[^,\.!?]*)"),
+                ("работа", r"моя\s+работа\s+([^,\.!?]+)"),
+                ("занимаюсь", r"занимаюсь\s+([^,\.!?]+)"),
+                ("профессии", r"по\s+профессии\s+([^,\.!?]+)")
             ],
             "pet": [
-                r"у\s+меня\s+(?:есть\s+)?([^,\.!?]*собак[аиы]?[^,\.!?]*)",
-                r"моя\s+([^,\.!?]*собак[аиы]?[^,\.!?]*)",
-                r"у\s+меня\s+(?:есть\s+)?([^,\.!?]*кот[аиы]?[^,\.!?]*)",
-                r"моя\s+([^,\.!?]*кот[аиы]?[^,\.!?]*)",
-                r"животное\s+([^,\.!?]+)",
-                r"питомец\s+([^,\.!?]+)"
+                ("собак", r"у\s+меня\s+(?:есть\s+)?([^,\.!?]*собак[аиы]?[^,\.!?]*)"),
+                ("собак", r"моя\s+([^,\.!?]*собак[аиы]?[^,\.!?]*)"),
+                ("кот", r"у\s+меня\s+(?:есть\s+)?([^,\.!?]*кот[аиы]?[^,\.!?]*)"),
+                ("кот", r"моя\s+([^,\.!?]*кот[аиы]?[^,\.!?]*)"),
+                ("животное", r"животное\s+([^,\.!?]+)"),
+                ("питомец", r"питомец\s+([^,\.!?]+)")
             ],
             "hobby": [
-                r"увлекаюсь\s+([^,\.!?]+)",
-                r"мое\s+хобби\s+([^,\.!?]+)",
-                r"люблю\s+([^,\.!?]+)",
-                r"занимаюсь\s+([^,\.!?]+)",
-                r"в\s+свободное\s+время\s+([^,\.!?]+)"
+                ("увлекаюсь", r"увлекаюсь\s+([^,\.!?]+)"),
+                ("хобби", r"мое\s+хобби\s+([^,\.!?]+)"),
+                ("люблю", r"люблю\s+([^,\.!?]+)"),
+                ("занимаюсь", r"занимаюсь\s+([^,\.!?]+)"),
+                ("свободное", r"в\s+свободное\s+время\s+([^,\.!?]+)")
             ],
             "location": [
-                r"живу\s+в\s+([^,\.!?]+)",
-                r"из\s+([^,\.!?]+)",
-                r"нахожусь\s+в\s+([^,\.!?]+)",
-                r"город\s+([^,\.!?]+)",
-                r"страна\s+([^,\.!?]+)"
+                ("живу", r"живу\s+в\s+([^,\.!?]+)"),
+                ("из", r"из\s+([^,\.!?]+)"),
+                ("нахожусь", r"нахожусь\s+в\s+([^,\.!?]+)"),
+                ("город", r"город\s+([^,\.!?]+)"),
+                ("страна", r"страна\s+([^,\.!?]+)")
             ],
             "family": [
-                r"у\s+меня\s+(?:есть\s+)?([^,\.!?]*семья[^,\.!?]*)",
-                r"моя\s+([^,\.!?]*семья[^,\.!?]*)",
-                r"родители\s+([^,\.!?]+)",
-                r"мама\s+([^,\.!?]+)",
-                r"папа\s+([^,\.!?]+)",
-                r"брат\s+([^,\.!?]+)",
-                r"сестра\s+([^,\.!?]+)"
+                ("семья", r"у\s+меня\s+(?:есть\s+)?([^,\.!?]*семья[^,\.!?]*)"),
+                ("семья", r"моя\s+([^,\.!?]*семья[^,\.!?]*)"),
+                ("родители", r"родители\s+([^,\.!?]+)"),
+                ("мама", r"мама\s+([^,\.!?]+)"),
+                ("папа", r"папа\s+([^,\.!?]+)"),
+                ("брат", r"брат\s+([^,\.!?]+)"),
+                ("сестра", r"сестра\s+([^,\.!?]+)")
             ],
             "goal": [
-                r"хочу\s+([^,\.!?]+)",
-                r"мечтаю\s+([^,\.!?]+)",
-                r"планирую\s+([^,\.!?]+)",
-                r"цель\s+([^,\.!?]+)",
-                r"стремлюсь\s+([^,\.!?]+)"
+                ("хочу", r"хочу\s+([^,\.!?]+)"),
+                ("мечтаю", r"мечтаю\s+([^,\.!?]+)"),
+                ("планирую", r"планирую\s+([^,\.!?]+)"),
+                ("цель", r"цель\s+([^,\.!?]+)"),
+                ("стремлюсь", r"стремлюсь\s+([^,\.!?]+)")
             ],
             "fear": [
-                r"боюсь\s+([^,\.!?]+)",
-                r"страх\s+([^,\.!?]+)",
-                r"переживаю\s+([^,\.!?]+)",
-                r"волнуюсь\s+([^,\.!?]+)"
+                ("боюсь", r"боюсь\s+([^,\.!?]+)"),
+                ("страх", r"страх\s+([^,\.!?]+)"),
+                ("переживаю", r"переживаю\s+([^,\.!?]+)"),
+                ("волнуюсь", r"волнуюсь\s+([^,\.!?]+)")
             ],
             "dream": [
-                r"мечта\s+([^,\.!?]+)",
-                r"хотел\s+бы\s+([^,\.!?]+)",
-                r"представляю\s+([^,\.!?]+)"
+                ("мечта", r"мечта\s+([^,\.!?]+)"),
+                ("хотел", r"хотел\s+бы\s+([^,\.!?]+)"),
+                ("представляю", r"представляю\s+([^,\.!?]+)")
             ]
         }
         
@@ -107,38 +181,124 @@ class AdvancedMemorySystem:
             "планы": ["план", "будущее", "цель", "мечта", "хочу", "собираюсь", "надеюсь"]
         }
 
+        self.fact_extractor = FactExtractor(self.fact_patterns)
+        # Ключевые слова тем в порядке приоритета и одно выражение для них
+        self._topic_index = [
+            (keyword, topic) for topic, keywords in self.topic_keywords.items() for keyword in keywords
+        ]
+        self._topic_regex = _compile_literals(keyword for keyword, _ in self._topic_index)
+
+        # Кэш фактов {user_id: {тип: факты}} для самых активных пользователей.
+        # Новые факты дописываются в него одновременно с постановкой в очередь
+        # записи, поэтому после первой загрузки БД для чтения фактов не нужна
+        self.facts_cache_size = config.facts_cache_size
+        self._facts_cache: "OrderedDict[int, Dict[str, List[UserFact]]]" = OrderedDict()
+        # Пользователи, чьи факты сейчас читаются из БД: True — за время
+        # чтения появились новые факты и прочитанное уже неполно
+        self._facts_loading: Dict[int, bool] = {}
+
+    def _make_facts(self, pairs: List[Tuple[str, str]]) -> List[UserFact]:
+        now = datetime.now()
+        return [
+            UserFact(
+                fact_type=fact_type,
+                fact_content=content,
+                confidence=0.8,  # Базовая уверенность
+                first_mentioned=now,
+                last_mentioned=now,
+                mention_count=1
+            )
+            for fact_type, content in pairs
+        ]
+
     async def extract_facts(self, user_id: int, message: str) -> List[UserFact]:
         """Извлечь факты из сообщения пользователя"""
-        facts = []
-        message_lower = message.lower()
-        
-        for fact_type, patterns in self.fact_patterns.items():
-            for pattern in patterns:
-                matches = re.findall(pattern, message_lower, re.IGNORECASE)
-                for match in matches:
-                    if len(match.strip()) > 2:  # Игнорируем слишком короткие совпадения
-                        fact = UserFact(
-                            fact_type=fact_type,
-                            fact_content=match.strip(),
-                            confidence=0.8,  # Базовая уверенность
-                            first_mentioned=datetime.now(),
-                            last_mentioned=datetime.now(),
-                            mention_count=1
-                        )
-                        facts.append(fact)
-        
+        return self._make_facts(self.fact_extractor.extract(message))
+
+    def extract_facts_batch(self, messages: List[Tuple[int, str]]) -> Dict[int, List[UserFact]]:
+        """Извлечь факты из пачки сообщений [(user_id, текст)] -> {user_id: факты}"""
+        facts: Dict[int, List[UserFact]] = {}
+        extract = self.fact_extractor.extract
+        for user_id, message in messages:
+            pairs = extract(message)
+            if pairs:
+                facts.setdefault(user_id, []).extend(self._make_facts(pairs))
         return facts
 
+    async def backfill_facts(self, after_id: int = 0, batch_size: int = 1000) -> int:
+        """Извлечь факты из уже сохранённых сообщений пользователей.
+
+        Читает таблицу memory пачками по batch_size начиная с id > after_id
+        и сохраняет найденные факты. Возвращает число сохранённых фактов.
+        """
+        saved = 0
+        while True:
+            rows = await get_user_messages_after(after_id, batch_size)
+            if not rows:
+                return saved
+            after_id = rows[-1][0]
+            facts = self.extract_facts_batch([(user_id, message) for _, user_id, message in rows])
+            for user_id, user_facts in facts.items():
+                await self.save_user_facts(user_id, user_facts)
+                saved += len(user_facts)
+
     async def get_user_facts(self, user_id: int) -> Dict[str, List[UserFact]]:
-        """Получить все факты о пользователе"""
-        # В реальной реализации здесь был бы запрос к БД
-        # Пока возвращаем пустой словарь
-        return {}
+        """Получить все факты о пользователе {тип: факты}, частые первыми"""
+        cached = self._facts_cache.get(user_id)
+        if cached is not None:
+            self._facts_cache.move_to_end(user_id)
+            return cached
+
+        self._facts_loading[user_id] = False
+        try:
+            rows = await load_user_facts(user_id)
+        finally:
+            stale = self._facts_loading.pop(user_id, True)
+
+        facts: Dict[str, List[UserFact]] = {}
+        for fact_type, content, confidence, first_mentioned, last_mentioned, mention_count in rows:
+            facts.setdefault(fact_type, []).append(UserFact(
+                fact_type=fact_type,
+                fact_content=content,
+                confidence=confidence or 0.0,
+                first_mentioned=_parse_timestamp(first_mentioned),
+                last_mentioned=_parse_timestamp(last_mentioned),
+                mention_count=mention_count or 1
+            ))
+
+        if not stale and self.facts_cache_size > 0:
+            self._facts_cache[user_id] = facts
+            while len(self._facts_cache) > self.facts_cache_size:
+                self._facts_cache.popitem(last=False)
+        return facts
 
     async def save_user_fact(self, user_id: int, fact: UserFact) -> None:
         """Сохранить факт о пользователе"""
-        # В реальной реализации здесь был бы запрос к БД
-        pass
+        await self.save_user_facts(user_id, [fact])
+
+    async def save_user_facts(self, user_id: int, facts: List[UserFact]) -> None:
+        """Сохранить факты о пользователе одной транзакцией и обновить кэш"""
+        if not facts:
+            return
+        await store_user_facts(user_id, [(fact.fact_type, fact.fact_content, fact.confidence) for fact in facts])
+
+        cached = self._facts_cache.get(user_id)
+        if cached is None:
+            if user_id in self._facts_loading:
+                self._facts_loading[user_id] = True
+            return
+
+        for fact in facts:
+            fact_list = cached.setdefault(fact.fact_type, [])
+            known = next((item for item in fact_list if item.fact_content == fact.fact_content), None)
+            if known is None:
+                fact_list.append(fact)
+            else:
+                known.mention_count += 1
+                known.last_mentioned = fact.last_mentioned
+                known.confidence = max(known.confidence, fact.confidence)
+            # Тот же порядок, что и у выборки из БД
+            fact_list.sort(key=lambda item: (item.mention_count, item.confidence), reverse=True)
 
     async def get_conversation_topics(self, user_id: int) -> List[ConversationTopic]:
         """Получить темы разговоров с пользователем"""
@@ -148,42 +308,79 @@ class AdvancedMemorySystem:
     async def identify_topic(self, message: str) -> Optional[str]:
         """Определить тему разговора"""
         message_lower = message.lower()
-        
-        for topic, keywords in self.topic_keywords.items():
-            for keyword in keywords:
-                if keyword in message_lower:
-                    return topic
+
+        # Большинство сообщений не содержит ни одного ключевого слова —
+        # это проверяется одним поиском
+        if self._topic_regex.search(message_lower) is None:
+            return None
+
+        for keyword, topic in self._topic_index:
+            if keyword in message_lower:
+                return topic
         
         return None
 
-    async def get_memory_context(self, user_id: int, limit: int = 10) -> str:
-        """Получить контекст памяти для разговора"""
-        # Получаем последние сообщения
-        memory_pairs = await get_memory(user_id, limit)
+    async def get_memory_context(self, user_id: int, limit: int = 10, context: Optional[UserContext] = None,
+                                 include_recent: bool = True, query: Optional[str] = None) -> str:
+        """Получить контекст памяти для разговора
+
+        Если передан context (снимок из load_user_context), данные берутся из него
+        без повторных запросов к БД. include_recent=False не добавляет последние
+        сообщения — когда история уходит в LLM отдельными репликами. query —
+        текущее сообщение пользователя (уже сохранённое): по нему из более
+        старой истории и фактов подбираются относящиеся к делу фрагменты.
+        """
+        if context is not None:
+            memory_pairs = context.memory[-limit:]
+            user_name = context.user_name
+            relationship_level = context.relationship_level
+            total_messages = context.total_messages
+            days_active = context.days_active
+        else:
+            memory_pairs = await get_memory(user_id, limit)
+            user_name = await get_user_name(user_id)
+            relationship_level = await get_relationship_level(user_id)
+            total_messages = await get_total_messages(user_id)
+            days_active = await get_days_active(user_id)
+        
         context_parts = []
         
         # Добавляем базовую информацию о пользователе
-        user_name = await get_user_name(user_id)
         if user_name:
             context_parts.append(f"Пользователя зовут {user_name}")
         
         # Добавляем информацию об отношениях
-        relationship_level = await get_relationship_level(user_id)
         if relationship_level > 1:
             context_parts.append(f"Уровень отношений: {relationship_level}/5")
         
         # Добавляем статистику
-        total_messages = await get_total_messages(user_id)
-        days_active = await get_days_active(user_id)
         context_parts.append(f"Пользователь написал {total_messages} сообщений за {days_active} дней")
         
+        # Добавляем известные факты о пользователе
+        facts = await self.get_user_facts(user_id)
+        facts_block = self.format_facts_for_prompt(facts, config.facts_prompt_limit)
+        if facts_block and config.facts_prompt_limit > 0:
+            context_parts.append(facts_block)
+        
         # Добавляем последние сообщения
-        if memory_pairs:
+        if include_recent and memory_pairs:
             context_parts.append("Последние сообщения:")
             for message, role in memory_pairs[-5:]:  # Последние 5 сообщений
                 role_name = "Пользователь" if role == "user" else "Подруга"
                 context_parts.append(f"{role_name}: {message[:100]}...")
         
+        # Добавляем старые реплики и факты, относящиеся к сообщению
+        if query:
+            # Последние limit реплик и само сообщение уже есть в промпте
+            snippets = await retrieve_relevant(user_id, query, skip_recent=limit + 1)
+            # Факты, уже перечисленные выше, не повторяем
+            shown = {
+                fact.fact_content for fact_list in facts.values() for fact in fact_list[:config.facts_prompt_limit]
+            }
+            snippets = [s for s in snippets if not (s.source == "fact" and s.text in shown)]
+            if snippets:
+                context_parts.append(format_snippets(snippets))
+        
         return "\n".join(context_parts)
 
     async def get_personalized_greeting(self, user_id: int) -> str:
@@ -243,8 +440,7 @@ class AdvancedMemorySystem:
         """Обновить контекст памяти после разговора"""
         # Извлекаем факты из сообщения пользователя
         facts = await self.extract_facts(user_id, user_message)
-        for fact in facts:
-            await self.save_user_fact(user_id, fact)
+        await self.save_user_facts(user_id, facts)
         
         # Определяем тему разговора
         topic = await self.identify_topic(user_message)
@@ -252,9 +448,9 @@ class AdvancedMemorySystem:
             # В реальной реализации здесь было бы сохранение темы
             pass
 
-    def format_facts_for_prompt(self, facts: Dict[str, List[UserFact]]) -> str:
-        """Форматировать факты для системного промпта"""
-        if not facts:
+    def format_facts_for_prompt(self, facts: Dict[str, List[UserFact]], limit: Optional[int] = None) -> str:
+        """Форматировать факты для системного промпта (не больше limit каждого типа)"""
+        if not any(facts.values()):
             return ""
         
         context_parts = ["Известные факты о пользователе:"]
@@ -275,7 +471,7 @@ class AdvancedMemorySystem:
                 type_name = type_names.get(fact_type, fact_type)
                 context_parts.append(f"{type_name}:")
                 
-                for fact in fact_list:
+                for fact in fact_list[:limit]:
                     context_parts.append(f"- {fact.fact_content}")
         
         return "\n".join(context_parts)
@@ -0,0 +1,156 @@
+"""
+Бенчмарк: извлечение фактов и определение темы в AdvancedMemorySystem.
+
+Сравнивает прежнюю реализацию (re.findall по каждому из ~40 паттернов
+и вложенный перебор ключевых слов) со скомпилированным FactExtractor и
+префильтром по словам-триггерам на корпусе сообщений в чате, в том
+числе на пакетной обработке (extract_facts_batch), которой заполняются
+факты по истории сообщений. Заодно сверяет, что найденные факты и темы
+совпадают.
+
+Запуск:
+    python benchmarks/bench_fact_extraction.py
+    python benchmarks/bench_fact_extraction.py --messages 200000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Бенчмарку не нужны настоящие ключи — только чтобы конфиг загрузился
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0000000000:bench")
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://127.0.0.1:1")
+
+from advanced_memory import AdvancedMemorySystem  # noqa: E402
+
+# Обычные реплики без фактов
+SMALL_TALK = [
+    "привет", "как дела?", "что делаешь", "доброе утро!", "спокойной ночи",
+    "расскажи что-нибудь интересное", "мне сегодня грустно", "ахахах", "😊",
+    "спасибо тебе", "ну и погода сегодня", "обними меня", "ок", "ну да",
+    "так устал, что нет сил", "можно задать личный вопрос?", "хм", "ты милая",
+    "сегодня было тяжело", "посмотрим", "а ты что думаешь?", "согласен",
+]
+
+# Реплики, из которых извлекаются факты или темы
+WITH_FACTS = [
+    "я работаю программистом в банке", "у меня есть собака по кличке рекс",
+    "живу в москве уже пять лет", "боюсь высоты с детства",
+    "мечтаю поехать в японию", "в свободное время играю на гитаре",
+    "моя сестра поступила в университет", "люблю кататься на велосипеде",
+    "на работе опять завал", "завтра экзамен, волнуюсь",
+    "мама передаёт привет", "хочу в отпуск",
+]
+
+
+class LegacyMemory:
+    """Прежние extract_facts и identify_topic (только нужное для замера)."""
+
+    def __init__(self, memory: AdvancedMemorySystem):
+        self.fact_patterns = {
+            fact_type: [pattern for _, pattern in patterns]
+            for fact_type, patterns in memory.fact_patterns.items()
+        }
+        self.topic_keywords = memory.topic_keywords
+
+    def extract(self, message: str) -> List[Tuple[str, str]]:
+        facts = []
+        message_lower = message.lower()
+        for fact_type, patterns in self.fact_patterns.items():
+            for pattern in patterns:
+                for match in re.findall(pattern, message_lower, re.IGNORECASE):
+                    if len(match.strip()) > 2:
+                        facts.append((fact_type, match.strip()))
+        return facts
+
+    def identify_topic(self, message: str) -> Optional[str]:
+        message_lower = message.lower()
+        for topic, keywords in self.topic_keywords.items():
+            for keyword in keywords:
+                if keyword in message_lower:
+                    return topic
+        return None
+
+
+def build_corpus(count: int, fact_share: float, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        words = rng.choices(SMALL_TALK, k=rng.choice((1, 1, 2, 3, 5)))
+        if rng.random() < fact_share:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(WITH_FACTS))
+        corpus.append(", ".join(words).capitalize())
+    return corpus
+
+
+def measure(check: Callable[[str], object], corpus: List[str], rounds: int) -> float:
+    """Среднее время на сообщение в микросекундах (лучший из rounds прогонов)."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text in corpus:
+            check(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus) * 1e6
+
+
+def topic_sync(memory: AdvancedMemorySystem) -> Callable[[str], Optional[str]]:
+    """identify_topic без накладных расходов корутины."""
+    def identify(message: str) -> Optional[str]:
+        message_lower = message.lower()
+        if memory._topic_regex.search(message_lower) is None:
+            return None
+        for keyword, topic in memory._topic_index:
+            if keyword in message_lower:
+                return topic
+        return None
+    return identify
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--fact-share", type=float, default=0.1, help="доля сообщений с фактами")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    memory = AdvancedMemorySystem()
+    legacy = LegacyMemory(memory)
+    extractor = memory.fact_extractor
+    identify = topic_sync(memory)
+    corpus = build_corpus(args.messages, args.fact_share)
+
+    # Результаты должны совпадать (прежняя версия могла повторять один факт)
+    for text in corpus + WITH_FACTS:
+        expected = list(dict.fromkeys(legacy.extract(text)))
+        if extractor.extract(text) != expected:
+            raise SystemExit(f"Расхождение фактов на {text!r}")
+        if identify(text) != legacy.identify_topic(text):
+            raise SystemExit(f"Расхождение темы на {text!r}")
+
+    with_facts = sum(1 for text in corpus if extractor.extract(text))
+    print(f"{len(corpus):,} сообщений, факты найдены в {with_facts:,}\n")
+    print(f"{'':<30}{'факты':>10}{'тема':>12}")
+    print(f"{'старая (findall x40, циклы)':<30}{measure(legacy.extract, corpus, args.rounds):6.2f} мкс"
+          f"{measure(legacy.identify_topic, corpus, args.rounds):8.2f} мкс")
+    print(f"{'FactExtractor + префильтр':<30}{measure(extractor.extract, corpus, args.rounds):6.2f} мкс"
+          f"{measure(identify, corpus, args.rounds):8.2f} мкс")
+
+    batch = [(i % 1000, text) for i, text in enumerate(corpus)]
+    start = time.perf_counter()
+    facts = memory.extract_facts_batch(batch)
+    elapsed = time.perf_counter() - start
+    total = sum(len(user_facts) for user_facts in facts.values())
+    print(f"\nextract_facts_batch: {len(batch):,} сообщений за {elapsed * 1000:.0f} мс "
+          f"({len(batch) / elapsed:,.0f} сообщ./с), фактов: {total:,}")
+
+
+if __name__ == "__main__":
+    main()
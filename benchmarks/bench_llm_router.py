@@ -0,0 +1,132 @@
+"""
+Бенчмарк: маршрутизация запросов между провайдерами LLM (llm_router).
+
+Поднимает в процессе три локальных OpenAI-совместимых сервера
+(fake_openai_server) с разной задержкой и гоняет через ask_llm три фазы:
+все провайдеры здоровы, самый быстрый "упал", самый быстрый восстановился.
+Для сравнения вторая фаза повторяется с единственным провайдером.
+Показывает распределение запросов по провайдерам, p50/p95 и долю
+ответов-заглушек.
+
+Запуск:
+    python benchmarks/bench_llm_router.py
+    python benchmarks/bench_llm_router.py --requests 500 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Бенчмарку не нужны настоящие ключи — только чтобы конфиг загрузился
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0000000000:bench")
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://127.0.0.1:1")
+os.environ.setdefault("DEEPSEEK_MODEL", "fake-chat")
+
+from aiohttp import web  # noqa: E402
+
+import llm  # noqa: E402
+from config import ProviderConfig  # noqa: E402
+from fake_openai_server import create_app  # noqa: E402
+from llm_router import LLMRouter  # noqa: E402
+
+PROVIDERS = [
+    # имя, задержка, разброс, доля ошибок
+    ("fast", 0.10, 0.05, 0.02),
+    ("medium", 0.25, 0.05, 0.02),
+    ("slow", 0.60, 0.10, 0.02),
+]
+BASE_PORT = 18401
+BREAKER_OPEN_SECONDS = 2.0
+
+
+async def start_servers():
+    servers = {}
+    for i, (name, latency, jitter, error_rate) in enumerate(PROVIDERS):
+        app = create_app(latency=latency, jitter=jitter, error_rate=error_rate)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", BASE_PORT + i).start()
+        servers[name] = (app, runner)
+    return servers
+
+
+def make_router(names) -> LLMRouter:
+    configs = [
+        ProviderConfig(name=name, base_url=f"http://127.0.0.1:{BASE_PORT + i}", api_key="bench", model="fake-chat")
+        for i, (name, *_) in enumerate(PROVIDERS) if name in names
+    ]
+    router = LLMRouter(configs)
+    for provider in router.providers:
+        provider.breaker.open_seconds = BREAKER_OPEN_SECONDS
+    return router
+
+
+async def run_phase(title: str, servers, requests: int, concurrency: int) -> None:
+    before = {name: app["stats"]["requests"] for name, (app, _) in servers.items()}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    canned = 0
+
+    async def one():
+        nonlocal canned
+        async with semaphore:
+            start = time.perf_counter()
+            reply = await llm.ask_llm("Привет! Как дела?")
+            latencies.append(time.perf_counter() - start)
+            if reply in llm.FALLBACK_RESPONSES or reply in llm.BUSY_RESPONSES:
+                canned += 1
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    hits = {name: app["stats"]["requests"] - before[name] for name, (app, _) in servers.items()}
+    spread = "  ".join(f"{name}={count}" for name, count in hits.items())
+    print(f"{title:<34} p50={p50 * 1000:7.0f}ms  p95={p95 * 1000:7.0f}ms  заглушек={canned:4d}  | {spread}")
+
+
+async def main_async(requests: int, concurrency: int) -> None:
+    logging.getLogger("elysia_bot").setLevel(logging.CRITICAL)
+    servers = await start_servers()
+    fast_settings = servers["fast"][0]["settings"]
+
+    try:
+        llm.llm_router = make_router({"fast", "medium", "slow"})
+        await run_phase("3 провайдера, все здоровы", servers, requests, concurrency)
+
+        fast_settings["error_rate"] = 1.0
+        await run_phase("3 провайдера, fast упал", servers, requests, concurrency)
+
+        fast_settings["error_rate"] = 0.02
+        await asyncio.sleep(BREAKER_OPEN_SECONDS)
+        await run_phase("3 провайдера, fast восстановился", servers, requests, concurrency)
+        print("Состояние провайдеров:", llm.llm_router.get_stats())
+        await llm.llm_router.close()
+
+        fast_settings["error_rate"] = 1.0
+        llm.llm_router = make_router({"fast"})
+        await run_phase("1 провайдер, fast упал", servers, requests, concurrency)
+        await llm.llm_router.close()
+    finally:
+        for _, runner in servers.values():
+            await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Бенчмарк: задержка выборки истории (get_memory) в зависимости от размера таблицы memory.
+
+Сравнивает запрос без индекса (как до миграции 2) и с индексом
+idx_memory_user_id ON memory(user_id, id DESC).
+
+Запуск:
+    python benchmarks/bench_memory_index.py                 # 10k → 1M строк
+    python benchmarks/bench_memory_index.py --max-rows 10000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+ROWS_PER_USER = 200
+
+MEMORY_DDL = """
+CREATE TABLE memory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    role TEXT CHECK(role IN ('user','assistant','system')) NOT NULL,
+    message TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Запрос из db.get_memory до и после миграции
+QUERY_BEFORE = "SELECT message, role FROM memory WHERE user_id=? ORDER BY created_at DESC LIMIT ?"
+QUERY_AFTER = "SELECT message, role FROM memory WHERE user_id=? ORDER BY id DESC LIMIT ?"
+INDEX_DDL = "CREATE INDEX idx_memory_user_id ON memory(user_id, id DESC)"
+
+
+def fill(conn: sqlite3.Connection, rows: int) -> int:
+    """Заполнить таблицу синтетической историей, вернуть число пользователей."""
+    users = max(1, rows // ROWS_PER_USER)
+    batch = []
+    for i in range(rows):
+        user_id = random.randint(1, users)
+        role = "user" if i % 2 == 0 else "assistant"
+        batch.append((user_id, role, f"Сообщение номер {i}, просто болтаем о жизни"))
+        if len(batch) >= 50_000:
+            conn.executemany("INSERT INTO memory(user_id, role, message) VALUES(?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO memory(user_id, role, message) VALUES(?, ?, ?)", batch)
+    conn.commit()
+    return users
+
+
+def measure(conn: sqlite3.Connection, query: str, users: int, runs: int) -> float:
+    """Медианная задержка запроса в миллисекундах."""
+    timings = []
+    for _ in range(runs):
+        user_id = random.randint(1, users)
+        start = time.perf_counter()
+        conn.execute(query, (user_id, 10)).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-rows", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'строк':>12} | {'без индекса, мс':>16} | {'с индексом, мс':>15}")
+    print("-" * 50)
+
+    for size in [s for s in SIZES if s <= args.max_rows]:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "bench.sqlite3"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(MEMORY_DDL)
+            users = fill(conn, size)
+
+            # Полный скан дорогой: на больших таблицах ограничиваем число прогонов
+            scan_runs = max(3, min(args.runs, 5_000_000 // size))
+            before = measure(conn, QUERY_BEFORE, users, scan_runs)
+
+            conn.execute(INDEX_DDL)
+            conn.execute("ANALYZE")
+            after = measure(conn, QUERY_AFTER, users, args.runs)
+            conn.close()
+
+        print(f"{size:>12,} | {before:>16.3f} | {after:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
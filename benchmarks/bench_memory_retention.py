@@ -0,0 +1,126 @@
+"""
+Бенчмарк: архивация старой истории (memory_retention.MemoryRetention).
+
+Создаёт временную БД со схемой бота (init_db), заполняет историю --users
+пользователей по --per-user сообщений, равномерно распределённых по
+последним --span-days дням, и выполняет один проход обслуживания:
+перенос сообщений старше --days дней в сжатый архив, слияние индекса FTS
+и incremental_vacuum. Печатает время прохода, размер файла БД до и после,
+размер архива и время чтения архива одного пользователя.
+
+Запуск:
+    python benchmarks/bench_memory_retention.py                 # 1000 пользователей по 500
+    python benchmarks/bench_memory_retention.py --users 200 --days 30
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.TemporaryDirectory()
+
+# Бенчмарку не нужны настоящие ключи — только чтобы конфиг загрузился
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0000000000:bench")
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://127.0.0.1:1")
+os.environ["DB_PATH"] = os.path.join(_tmp.name, "bench.sqlite3")
+
+import db  # noqa: E402
+from memory_retention import MemoryRetention, get_archived_messages  # noqa: E402
+
+PHRASES = [
+    "Привет, как твои дела?", "Сегодня был тяжёлый день на работе", "Мы с сестрой ходили в кино",
+    "Купил новую гитару, учусь играть", "Расскажи что-нибудь интересное", "Мне немного грустно",
+    "Вот это да, не ожидала!", "Ого, расскажи подробнее!", "Я так рада тебя слышать",
+    "Завтра экзамен по физике, волнуюсь", "Хочу поехать летом на море", "Спасибо, что выслушала",
+]
+
+
+def make_rows(users: int, per_user: int, span_days: int, rng: random.Random):
+    total = users * per_user
+    rows = []
+    for i in range(total):
+        # Время идёт от старых сообщений к новым, как и id
+        age = span_days * (1 - i / total)
+        role = "user" if i % 2 == 0 else "assistant"
+        rows.append((rng.randint(1, users), role, rng.choice(PHRASES), f"-{age:.4f} days"))
+    return rows
+
+
+async def load(rows, batch: int = 20_000) -> None:
+    for i in range(0, len(rows), batch):
+        async with db.pool.writer() as conn:
+            await conn.executemany(
+                "INSERT INTO memory(user_id, role, message, created_at) VALUES(?, ?, ?, datetime('now', ?))",
+                rows[i:i + batch],
+            )
+            await conn.commit()
+
+
+async def file_size() -> int:
+    # Содержимое WAL переносится в основной файл, чтобы размер был честным
+    async with db.pool.writer() as conn:
+        await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(os.environ["DB_PATH"])
+
+
+async def scalar(sql: str) -> int:
+    async with db.pool.reader() as conn:
+        async with conn.execute(sql) as cur:
+            return (await cur.fetchone())[0] or 0
+
+
+async def main_async(users: int, per_user: int, span_days: int, days: int, keep_recent: int) -> None:
+    await db.init_db()
+    await load(make_rows(users, per_user, span_days, random.Random(1)))
+    before = await file_size()
+    print(f"История: {users} пользователей по {per_user} сообщений за {span_days} дней, "
+          f"файл БД {before / 2**20:.1f} МБ")
+
+    retention = MemoryRetention(days=days, keep_recent=keep_recent, window="0-24", batch=2000, vacuum_pages=1000)
+    start = time.perf_counter()
+    archived = await retention.archive_old_messages()
+    archive_time = time.perf_counter() - start
+    start = time.perf_counter()
+    await retention.optimize_search_index()
+    optimize_time = time.perf_counter() - start
+    start = time.perf_counter()
+    vacuumed = await retention.vacuum()
+    vacuum_time = time.perf_counter() - start
+    after = await file_size()
+
+    raw = await scalar("SELECT SUM(LENGTH(CAST(data AS BLOB))) FROM memory_archive")
+    hot = await scalar("SELECT COUNT(*) FROM memory")
+    print(f"Архивация (горизонт {days} дней, последние {keep_recent} остаются): "
+          f"{archived:,} сообщений в {retention.archives:,} пачках за {archive_time:.1f} с "
+          f"({archive_time / max(archived, 1) * 1e6:.1f} мкс/сообщение)")
+    print(f"Слияние индекса memory_fts: {optimize_time:.2f} с; incremental_vacuum: {vacuumed:,} страниц за {vacuum_time:.2f} с")
+    print(f"В memory осталось {hot:,} сообщений; файл БД {before / 2**20:.1f} -> {after / 2**20:.1f} МБ, "
+          f"архив {raw / 2**20:.2f} МБ")
+
+    start = time.perf_counter()
+    messages = await get_archived_messages(1)
+    print(f"Чтение архива пользователя 1: {len(messages)} сообщений за {(time.perf_counter() - start) * 1000:.1f} мс")
+
+    await db.close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--per-user", type=int, default=500)
+    parser.add_argument("--span-days", type=int, default=365)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--keep-recent", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.users, args.per_user, args.span_days, args.days, args.keep_recent))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Бенчмарк: поиск по истории сообщений (memory_retrieval.retrieve_relevant).
+
+Создаёт временную БД со схемой бота (init_db, включая индексы FTS5 из
+миграции 4), заполняет историю нескольких пользователей по --per-user
+сообщений и измеряет задержку retrieve_relevant на случайных репликах,
+а также цену поддержки индекса при записи (вставка в memory с триггерами
+FTS и в такую же таблицу без них).
+
+Запуск:
+    python benchmarks/bench_memory_retrieval.py                  # 3 пользователя по 100k
+    python benchmarks/bench_memory_retrieval.py --per-user 20000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.TemporaryDirectory()
+
+# Бенчмарку не нужны настоящие ключи — только чтобы конфиг загрузился
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0000000000:bench")
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://127.0.0.1:1")
+os.environ["DB_PATH"] = os.path.join(_tmp.name, "bench.sqlite3")
+
+import db  # noqa: E402
+from memory_retrieval import retrieve_relevant  # noqa: E402
+
+SUBJECTS = ["я", "мы с сестрой", "мой брат", "мама", "начальник", "мой кот", "подруга", "коллега"]
+VERBS = ["ходил", "купил", "видел", "обсуждал", "вспоминал", "планировал", "потерял", "нашёл", "чинил"]
+OBJECTS = [
+    "новую гитару", "билеты на концерт", "ключи от машины", "старый велосипед", "рецепт борща",
+    "отпуск в грузии", "курсы английского", "щенка лабрадора", "квартиру в центре", "абонемент в бассейн",
+    "подарок на день рождения", "книгу про космос", "сломанный ноутбук", "поездку на море",
+    "выставку картин", "экзамен по физике", "собеседование в банке", "ремонт на кухне",
+]
+TAILS = ["вчера", "на выходных", "месяц назад", "сегодня утром", "прошлой зимой", "опять", ""]
+REPLIES = ["Ого, расскажи подробнее!", "Как здорово!", "А что было дальше?", "Понимаю тебя", "Вот это да"]
+
+MEMORY_COPY_DDL = """
+CREATE TABLE memory_plain (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def user_message(rng: random.Random) -> str:
+    return " ".join(filter(None, (rng.choice(SUBJECTS), rng.choice(VERBS), rng.choice(OBJECTS), rng.choice(TAILS))))
+
+
+def make_rows(users: int, per_user: int, rng: random.Random):
+    rows = []
+    for i in range(users * per_user):
+        user_id = i % users + 1
+        if (i // users) % 2 == 0:
+            rows.append((user_id, "user", user_message(rng)))
+        else:
+            rows.append((user_id, "assistant", rng.choice(REPLIES)))
+    return rows
+
+
+async def insert(table: str, rows, batch: int = 10_000) -> float:
+    """Время вставки строк пачками (одна транзакция на пачку)."""
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        async with db.pool.writer() as conn:
+            await conn.executemany(f"INSERT INTO {table}(user_id, role, message) VALUES(?, ?, ?)", rows[i:i + batch])
+            await conn.commit()
+    return time.perf_counter() - start
+
+
+async def main_async(users: int, per_user: int, queries: int, k: int) -> None:
+    rng = random.Random(1)
+    await db.init_db()
+    async with db.pool.writer() as conn:
+        await conn.execute(MEMORY_COPY_DDL)
+        await conn.commit()
+
+    rows = make_rows(users, per_user, rng)
+    sample = rows[:20_000]
+    plain = await insert("memory_plain", sample)
+    indexed = await insert("memory", sample)
+    print(f"Запись {len(sample):,} сообщений: без индекса {plain / len(sample) * 1e6:.1f} мкс/строка, "
+          f"с триггерами FTS {indexed / len(sample) * 1e6:.1f} мкс/строка")
+
+    start = time.perf_counter()
+    await insert("memory", rows[len(sample):])
+    print(f"История: {users} пользователя по {per_user:,} сообщений "
+          f"(загружено за {time.perf_counter() - start:.0f} с)\n")
+
+    timings = []
+    found = 0
+    for _ in range(queries):
+        user_id = rng.randint(1, users)
+        query = user_message(rng)
+        start = time.perf_counter()
+        snippets = await retrieve_relevant(user_id, query, k=k, skip_recent=11)
+        timings.append((time.perf_counter() - start) * 1000)
+        found += bool(snippets)
+
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"retrieve_relevant (k={k}), {queries} запросов: медиана {statistics.median(timings):.1f} мс, "
+          f"p95 {p95:.1f} мс, максимум {timings[-1]:.1f} мс; найдено для {found}/{queries}")
+
+    await db.close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--per-user", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.users, args.per_user, args.queries, args.k))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Бенчмарк: rate limiter на большом числе пользователей.
+
+Сравнивает прежнюю реализацию (список отметок времени на пользователя,
+пересобираемый на каждом запросе) с GCRA из rate_limiter.py: время
+одной проверки, память на пользователя и время фоновой очистки, а
+также время проверки с общим хранилищем в SQLite.
+
+Запуск:
+    python benchmarks/bench_rate_limiter.py                 # 1M пользователей
+    python benchmarks/bench_rate_limiter.py --users 100000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Бенчмарку не нужны настоящие ключи — только чтобы конфиг загрузился
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0000000000:bench")
+os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+os.environ.setdefault("DEEPSEEK_BASE_URL", "http://127.0.0.1:1")
+
+from rate_limit_store import MemoryRateLimitStore, SQLiteRateLimitStore  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+
+# Запросов на пользователя в "горячей" фазе (в пределах лимита 'message')
+HOT_REQUESTS = 15
+
+
+class LegacyRateLimiter:
+    """Прежняя реализация: общий список отметок на пользователя (только нужное для замера)."""
+
+    def __init__(self):
+        self.user_requests: Dict[int, List[float]] = defaultdict(list)
+        self.blocked_users: Dict[int, float] = {}
+        self.max_requests = 20
+        self.window_seconds = 60
+
+    async def is_allowed(self, user_id: int, request_type: str = 'message') -> bool:
+        now = time.time()
+        if user_id in self.blocked_users:
+            if now - self.blocked_users[user_id] < 300:
+                return False
+            del self.blocked_users[user_id]
+        user_requests = self.user_requests[user_id]
+        cutoff_time = now - self.window_seconds
+        user_requests[:] = [t for t in user_requests if t > cutoff_time]
+        if len(user_requests) >= self.max_requests:
+            self.blocked_users[user_id] = now
+            return False
+        user_requests.append(now)
+        return True
+
+    async def cleanup_expired_data(self):
+        now = time.time()
+        for user_id in list(self.user_requests.keys()):
+            user_requests = self.user_requests[user_id]
+            user_requests[:] = [t for t in user_requests if t > now - 3600]
+            if not user_requests:
+                del self.user_requests[user_id]
+
+
+async def measure_memory(factory, users: int) -> float:
+    """Память на пользователя (байт) после одного запроса от каждого."""
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    limiter = factory()
+    for user_id in range(1, users + 1):
+        await limiter.is_allowed(user_id, 'message')
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (memory - base) / users
+
+
+async def run(name: str, factory, users: int, hot_users: int) -> None:
+    limiter = factory()
+    start = time.perf_counter()
+    for user_id in range(1, users + 1):
+        await limiter.is_allowed(user_id, 'message')
+    cold = (time.perf_counter() - start) / users
+
+    start = time.perf_counter()
+    for _ in range(HOT_REQUESTS):
+        for user_id in range(1, hot_users + 1):
+            await limiter.is_allowed(user_id, 'message')
+    hot = (time.perf_counter() - start) / (HOT_REQUESTS * hot_users)
+
+    start = time.perf_counter()
+    await limiter.cleanup_expired_data()
+    cleanup = time.perf_counter() - start
+
+    del limiter
+    memory = await measure_memory(factory, users)
+
+    print(f"{name:<22} новый пользователь {cold * 1e9:5.0f} нс  активный {hot * 1e9:5.0f} нс  "
+          f"память {memory:4.0f} Б/польз.  очистка {cleanup * 1000:6.1f} мс")
+
+
+async def main_async(users: int, hot_users: int, sqlite_users: int) -> None:
+    print(f"{users:,} пользователей, {HOT_REQUESTS} запросов подряд у {hot_users:,} из них\n")
+    await run("старый (списки)", LegacyRateLimiter, users, hot_users)
+    await run("GCRA без лимита", lambda: RateLimiter(MemoryRateLimitStore(max_keys=users * 2)), users, hot_users)
+    await run("GCRA, max_keys=N/10", lambda: RateLimiter(MemoryRateLimitStore(max_keys=users // 10)), users, hot_users)
+    print("\nПамять GCRA с max_keys ограничена max_keys записями независимо от числа пользователей.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        limiter = RateLimiter(SQLiteRateLimitStore(os.path.join(tmp, "rate_limits.sqlite3")))
+        start = time.perf_counter()
+        for user_id in range(1, sqlite_users + 1):
+            await limiter.is_allowed(user_id, 'message')
+        per_call = (time.perf_counter() - start) / sqlite_users
+        await limiter.close()
+    print(f"\nGCRA в SQLite (RATE_LIMIT_BACKEND=sqlite), {sqlite_users:,} пользователей: {per_call * 1e6:.0f} мкс на проверку")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--hot-users", type=int, default=10_000)
+    parser.add_argument("--sqlite-users", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.users, args.hot_users, args.sqlite_users))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Бенчмарк: проверка входящих сообщений в DataValidator.
+
+Сравнивает прежнюю проверку (отдельный re.search по каждому из 16
+паттернов) с одним скомпилированным выражением из validation.py на
+корпусе типичных сообщений в чате на русском языке, а также на
+сообщениях, которые правила отклоняют. Заодно сверяет, что обе
+реализации выносят одинаковые вердикты.
+
+Запуск:
+    python benchmarks/bench_validation.py
+    python benchmarks/bench_validation.py --messages 200000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validation import DataValidator  # noqa: E402
+
+# Фрагменты обычных сообщений: из них собираются реплики разной длины
+PHRASES = [
+    "привет", "как дела?", "что делаешь", "я скучал", "доброе утро!",
+    "спокойной ночи", "расскажи что-нибудь интересное", "мне сегодня грустно",
+    "на работе опять завал", "хочу в отпуск", "ты меня понимаешь",
+    "а ты любишь котиков?", "смотрел вчера фильм, очень понравился",
+    "давай сыграем в игру", "угадай, о чём я думаю", "ахахах", "😊", "❤️",
+    "спасибо тебе", "ну и погода сегодня", "поехали гулять в парк",
+    "я купил новую гитару", "завтра экзамен, волнуюсь", "обними меня",
+    "какая у тебя любимая музыка?", "мой кот опять разбил чашку",
+    "сегодня 25 градусов", "в 19:30 встреча", "ок", "ну да", "не знаю...",
+    "помнишь, я рассказывал про сестру?", "она поступила в университет!",
+    "так устал, что нет сил", "можно задать личный вопрос?", "хм",
+]
+
+# Сообщения, которые должны отклоняться (по одному на категорию и несколько граничных)
+REJECTED = [
+    "<script>alert(1)</script>",
+    "нажми сюда javascript:alert(1)",
+    "<img src=x onerror = alert(1)>",
+    "1 union select password from users",
+    "'; drop table users; --",
+    "ааааааааааааааааааааа",
+    "заходи на https://example.com/promo?id=1",
+    "смотри https://example.com и <script>x</script>",
+]
+
+
+class LegacyValidator:
+    """Прежняя проверка: отдельный re.search по каждому паттерну."""
+
+    def __init__(self):
+        validator = DataValidator()
+        self.categories = [
+            ([p for _, p in validator.FORBIDDEN_PATTERNS], "Обнаружен потенциально опасный контент"),
+            ([p for _, p in validator.SQL_INJECTION_PATTERNS], "Обнаружена попытка SQL инъекции"),
+            ([p for _, p in validator.SPAM_PATTERNS], "Обнаружен спам"),
+        ]
+
+    def check(self, text: str) -> Optional[str]:
+        for patterns, message in self.categories:
+            for pattern in patterns:
+                if re.search(pattern, text, re.IGNORECASE):
+                    return message
+        return None
+
+
+def build_corpus(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        words = rng.choices(PHRASES, k=rng.choice((1, 1, 2, 3, 5, 8)))
+        corpus.append(", ".join(words).capitalize())
+    return corpus
+
+
+def measure(check: Callable[[str], object], corpus: List[str], rounds: int) -> float:
+    """Среднее время одной проверки в микросекундах (лучший из rounds прогонов)."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for text in corpus:
+            check(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    legacy = LegacyValidator()
+    validator = DataValidator()
+    corpus = build_corpus(args.messages)
+    rejected = REJECTED * max(1, args.messages // (10 * len(REJECTED)))
+
+    # Вердикты должны совпадать
+    for text in corpus + REJECTED:
+        expected = legacy.check(text)
+        result = validator.validate_message(text)
+        actual = None if result.is_valid else result.error_message
+        if expected != actual:
+            raise SystemExit(f"Расхождение на {text!r}: было {expected!r}, стало {actual!r}")
+
+    avg_len = sum(map(len, corpus)) / len(corpus)
+    print(f"{len(corpus):,} обычных сообщений (в среднем {avg_len:.0f} символов), "
+          f"{len(rejected):,} отклоняемых\n")
+    print(f"{'':<28}{'обычные':>10}{'отклоняемые':>14}")
+    for name, check in (
+        ("старая (re.search x16)", legacy.check),
+        ("одно выражение", validator.check_rules),
+        ("validate_message целиком", validator.validate_message),
+    ):
+        normal = measure(check, corpus, args.rounds)
+        bad = measure(check, rejected, args.rounds)
+        print(f"{name:<28}{normal:8.2f} мкс{bad:10.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
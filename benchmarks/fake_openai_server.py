@@ -0,0 +1,118 @@
+"""
+Локальный OpenAI-совместимый сервер для офлайн-тестов и бенчмарков LLM-клиента.
+
+Отвечает на POST /chat/completions (и /v1/chat/completions) с настраиваемой
+задержкой, разбросом и долей ошибок; поддерживает stream=true (SSE) и
+возвращает usage с prompt_cache_hit_tokens/prompt_cache_miss_tokens.
+
+Запуск отдельным процессом:
+    python benchmarks/fake_openai_server.py --port 8001 --latency 0.3 --jitter 0.1 --error-rate 0.05
+
+и затем, например, в config.env:
+    LLM_PROVIDERS=local
+    LLM_PROVIDER_LOCAL_BASE_URL=http://127.0.0.1:8001
+    LLM_PROVIDER_LOCAL_MODEL=fake-chat
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from typing import Any, Dict
+
+from aiohttp import web
+
+DEFAULT_REPLY = "Ну наконец-то ты написал! А то я уже думала, что ты меня забыл. Что там у тебя?"
+
+
+def create_app(
+    latency: float = 0.3,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    error_status: int = 503,
+    reply: str = DEFAULT_REPLY
+) -> web.Application:
+    """Создать приложение сервера.
+
+    Параметры лежат в app["settings"] и их можно менять на лету (например,
+    "уронить" провайдера посреди бенчмарка); счётчики — в app["stats"].
+    """
+    app = web.Application()
+    app["settings"] = {
+        "latency": latency,
+        "jitter": jitter,
+        "error_rate": error_rate,
+        "error_status": error_status,
+        "reply": reply,
+    }
+    app["stats"] = {"requests": 0, "errors": 0}
+    app.router.add_post("/chat/completions", _chat_completions)
+    app.router.add_post("/v1/chat/completions", _chat_completions)
+    return app
+
+
+def _usage(body: Dict[str, Any], reply: str) -> Dict[str, int]:
+    prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 3
+    system_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])[:1]) // 3
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(reply) // 3,
+        "total_tokens": prompt_tokens + len(reply) // 3,
+        "prompt_cache_hit_tokens": system_tokens // 64 * 64,
+        "prompt_cache_miss_tokens": prompt_tokens - system_tokens // 64 * 64,
+    }
+
+
+async def _chat_completions(request: web.Request) -> web.StreamResponse:
+    settings = request.app["settings"]
+    stats = request.app["stats"]
+    stats["requests"] += 1
+    body = await request.json()
+
+    delay = max(0.0, settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"]))
+    await asyncio.sleep(delay)
+
+    if random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        return web.json_response({"error": {"message": "fake upstream error"}}, status=settings["error_status"])
+
+    reply = settings["reply"]
+    model = body.get("model", "fake-chat")
+
+    if not body.get("stream"):
+        return web.json_response({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": _usage(body, reply),
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for word in reply.split(" "):
+        chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}], "model": model}
+        await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await asyncio.sleep(0.02)
+    if (body.get("stream_options") or {}).get("include_usage"):
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': _usage(body, reply)})}\n\n".encode())
+    await response.write(b"data: [DONE]\n\n")
+    return response
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.3, help="средняя задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.1, help="разброс задержки, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.jitter, args.error_rate, args.error_status)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
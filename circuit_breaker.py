@@ -0,0 +1,161 @@
+"""
+Circuit breaker и статистика задержек для внешних API
+Помнит, насколько здоров upstream, и перестаёт отправлять запросы, пока
+он лежит, вместо того чтобы множить нагрузку повторами
+"""
+
+from __future__ import annotations
+
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Optional, Tuple
+
+from error_handler import APIError
+from logger import bot_logger
+
+
+class CircuitState(Enum):
+    """Состояния предохранителя"""
+    CLOSED = "closed"        # запросы идут как обычно
+    OPEN = "open"            # upstream считается лежащим, запросы не отправляются
+    HALF_OPEN = "half_open"  # пробные запросы после паузы
+
+
+class CircuitOpenError(APIError):
+    """Предохранитель разомкнут — запрос к upstream не отправлялся"""
+    pass
+
+
+class CircuitBreaker:
+    """Предохранитель с долей ошибок в скользящем окне.
+
+    Размыкается, когда за последние window_seconds набралось не меньше
+    min_calls запросов и доля ошибок достигла failure_rate_threshold. Через
+    open_seconds пропускает half_open_max_calls пробных запросов: успех
+    замыкает цепь, ошибка снова размыкает. Если исход проб так и не пришёл
+    (запрос отменили), через open_seconds разрешаются новые пробы.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        min_calls: int = 10,
+        window_seconds: float = 30.0,
+        open_seconds: float = 15.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CircuitState.CLOSED
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._probe_at = 0.0
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            _, ok = self._calls.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def _set_state(self, state: CircuitState) -> None:
+        if state != self.state:
+            bot_logger.logger.warning(f"Circuit {self.name}: {self.state.value} -> {state.value}")
+            self.state = state
+
+    @property
+    def allows_request(self) -> bool:
+        """Пропустит ли check() запрос прямо сейчас (без изменения состояния)."""
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            return time.monotonic() - self._opened_at >= self.open_seconds
+        return (self._half_open_calls < self.half_open_max_calls
+                or time.monotonic() - self._probe_at >= self.open_seconds)
+
+    def check(self) -> None:
+        """Пропустить запрос или поднять CircuitOpenError."""
+        if self.state == CircuitState.CLOSED:
+            return
+
+        now = time.monotonic()
+        if self.state == CircuitState.OPEN:
+            if now - self._opened_at < self.open_seconds:
+                raise CircuitOpenError(f"Circuit {self.name} is open", error_code="CIRCUIT_OPEN")
+            self._set_state(CircuitState.HALF_OPEN)
+            self._half_open_calls = 0
+
+        if self._half_open_calls >= self.half_open_max_calls:
+            if now - self._probe_at < self.open_seconds:
+                raise CircuitOpenError(f"Circuit {self.name} is half-open", error_code="CIRCUIT_OPEN")
+            self._half_open_calls = 0
+        self._half_open_calls += 1
+        self._probe_at = now
+
+    def record_success(self) -> None:
+        self._record(True)
+
+    def record_failure(self) -> None:
+        self._record(False)
+
+    def _record(self, ok: bool) -> None:
+        now = time.monotonic()
+
+        if self.state == CircuitState.HALF_OPEN:
+            if ok:
+                self._calls.clear()
+                self._failures = 0
+                self._set_state(CircuitState.CLOSED)
+            else:
+                self._open(now)
+            return
+
+        self._calls.append((now, ok))
+        if not ok:
+            self._failures += 1
+        self._trim(now)
+
+        if (self.state == CircuitState.CLOSED
+                and len(self._calls) >= self.min_calls
+                and self._failures / len(self._calls) >= self.failure_rate_threshold):
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._opened_at = now
+        self._set_state(CircuitState.OPEN)
+
+    def get_stats(self) -> Dict[str, object]:
+        """Текущее состояние предохранителя"""
+        self._trim(time.monotonic())
+        return {
+            "state": self.state.value,
+            "calls": len(self._calls),
+            "failures": self._failures,
+        }
+
+
+class LatencyTracker:
+    """Последние задержки ответов upstream для оценки перцентилей"""
+
+    def __init__(self, maxlen: int = 200, min_samples: int = 20):
+        self._samples: Deque[float] = deque(maxlen=maxlen)
+        self.min_samples = min_samples
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """q-перцентиль задержки или None, пока данных мало."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
@@ -3,8 +3,8 @@
 """
 
 import os
-from typing import Optional, Dict, Any
-from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+from dataclasses import dataclass, field
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -17,6 +17,23 @@ class DatabaseConfig:
     path: str
     timeout: int = 30
     max_connections: int = 10
+    write_behind_interval_ms: int = 50
+    write_behind_max_batch: int = 200
+    user_cache_size: int = 50000
+    user_cache_ttl: float = 300.0
+    retention_days: int = 90
+    retention_keep_recent: int = 100
+    retention_window: str = "3-6"
+    retention_batch: int = 2000
+    vacuum_pages: int = 1000
+
+@dataclass
+class ProviderConfig:
+    """OpenAI-совместимый провайдер LLM"""
+    name: str
+    base_url: str
+    api_key: str
+    model: str
 
 @dataclass
 class APIConfig:
@@ -28,6 +45,28 @@ class APIConfig:
     temperature: float
     max_tokens: int
     timeout: int = 30
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    stream: bool = False
+    stream_edit_interval: float = 1.0
+    context_budget: int = 8000
+    min_concurrency: int = 2
+    max_concurrency: int = 32
+    initial_concurrency: int = 8
+    queue_size: int = 200
+    queue_deadline: float = 8.0
+    latency_target: float = 15.0
+    breaker_failure_rate: float = 0.5
+    breaker_min_calls: int = 10
+    breaker_window: float = 30.0
+    breaker_open_seconds: float = 15.0
+    hedge_requests: bool = False
+    hedge_min_delay: float = 1.0
+    response_cache_ttl: float = 60.0
+    response_cache_size: int = 1000
+    providers: List[ProviderConfig] = field(default_factory=list)
 
 @dataclass
 class SecurityConfig:
@@ -38,6 +77,9 @@ class SecurityConfig:
     block_duration: int = 300
     enable_validation: bool = True
     enable_rate_limiting: bool = True
+    rate_limit_max_keys: int = 100000
+    rate_limit_backend: str = "memory"
+    rate_limit_db_path: str = "./rate_limits.sqlite3"
 
 @dataclass
 class LoggingConfig:
@@ -69,6 +111,18 @@ class BotConfig:
     maintenance_mode: bool = False
     max_users: int = 10000
     cleanup_interval: int = 300
+    turn_debounce_ms: int = 800
+    turn_max_wait_ms: int = 3000
+    post_process_workers: int = 4
+    post_process_queue_size: int = 1000
+    typing_interval: float = 4.0
+    summary_interval: float = 600.0
+    summary_keep_recent: int = 10
+    summary_min_messages: int = 20
+    summary_max_chars: int = 1500
+    memory_retrieval_k: int = 3
+    facts_cache_size: int = 5000
+    facts_prompt_limit: int = 3
 
 class ConfigManager:
     """Менеджер конфигурации"""
@@ -96,7 +150,16 @@ class ConfigManager:
         database_config = DatabaseConfig(
             path=os.getenv('DB_PATH', './data.sqlite3'),
             timeout=int(os.getenv('DB_TIMEOUT', '30')),
-            max_connections=int(os.getenv('DB_MAX_CONNECTIONS', '10'))
+            max_connections=int(os.getenv('DB_MAX_CONNECTIONS', '10')),
+            write_behind_interval_ms=int(os.getenv('DB_WRITE_BEHIND_INTERVAL_MS', '50')),
+            write_behind_max_batch=int(os.getenv('DB_WRITE_BEHIND_MAX_BATCH', '200')),
+            user_cache_size=int(os.getenv('DB_USER_CACHE_SIZE', '50000')),
+            user_cache_ttl=float(os.getenv('DB_USER_CACHE_TTL', '300')),
+            retention_days=int(os.getenv('DB_RETENTION_DAYS', '90')),
+            retention_keep_recent=int(os.getenv('DB_RETENTION_KEEP_RECENT', '100')),
+            retention_window=os.getenv('DB_RETENTION_WINDOW', '3-6'),
+            retention_batch=int(os.getenv('DB_RETENTION_BATCH', '2000')),
+            vacuum_pages=int(os.getenv('DB_VACUUM_PAGES', '1000'))
         )
         
         # Конфигурация API
@@ -107,8 +170,30 @@ class ConfigManager:
             deepseek_model=os.getenv('DEEPSEEK_MODEL', 'deepseek-chat'),
             temperature=float(os.getenv('DEEPSEEK_TEMPERATURE', '0.7')),
             max_tokens=int(os.getenv('DEEPSEEK_MAX_TOKENS', '200')),
-            timeout=int(os.getenv('API_TIMEOUT', '30'))
+            timeout=int(os.getenv('API_TIMEOUT', '30')),
+            max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+            max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '10')),
+            keepalive_expiry=float(os.getenv('LLM_KEEPALIVE_EXPIRY', '30')),
+            http2=os.getenv('LLM_HTTP2', 'false').lower() == 'true',
+            stream=os.getenv('DEEPSEEK_STREAM', 'false').lower() == 'true',
+            stream_edit_interval=float(os.getenv('STREAM_EDIT_INTERVAL', '1.0')),
+            context_budget=int(os.getenv('LLM_CONTEXT_BUDGET', '8000')),
+            min_concurrency=int(os.getenv('LLM_MIN_CONCURRENCY', '2')),
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '32')),
+            initial_concurrency=int(os.getenv('LLM_INITIAL_CONCURRENCY', '8')),
+            queue_size=int(os.getenv('LLM_QUEUE_SIZE', '200')),
+            queue_deadline=float(os.getenv('LLM_QUEUE_DEADLINE', '8')),
+            latency_target=float(os.getenv('LLM_LATENCY_TARGET', '15')),
+            breaker_failure_rate=float(os.getenv('LLM_BREAKER_FAILURE_RATE', '0.5')),
+            breaker_min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', '10')),
+            breaker_window=float(os.getenv('LLM_BREAKER_WINDOW', '30')),
+            breaker_open_seconds=float(os.getenv('LLM_BREAKER_OPEN_SECONDS', '15')),
+            hedge_requests=os.getenv('LLM_HEDGE_REQUESTS', 'false').lower() == 'true',
+            hedge_min_delay=float(os.getenv('LLM_HEDGE_MIN_DELAY', '1.0')),
+            response_cache_ttl=float(os.getenv('LLM_CACHE_TTL', '60')),
+            response_cache_size=int(os.getenv('LLM_CACHE_SIZE', '1000'))
         )
+        api_config.providers = self._load_providers(api_config)
         
         # Конфигурация безопасности
         security_config = SecurityConfig(
@@ -117,7 +202,10 @@ class ConfigManager:
             rate_limit_window=int(os.getenv('RATE_LIMIT_WINDOW', '60')),
             block_duration=int(os.getenv('BLOCK_DURATION', '300')),
             enable_validation=os.getenv('ENABLE_VALIDATION', 'true').lower() == 'true',
-            enable_rate_limiting=os.getenv('ENABLE_RATE_LIMITING', 'true').lower() == 'true'
+            enable_rate_limiting=os.getenv('ENABLE_RATE_LIMITING', 'true').lower() == 'true',
+            rate_limit_max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000')),
+            rate_limit_backend=os.getenv('RATE_LIMIT_BACKEND', 'memory').lower(),
+            rate_limit_db_path=os.getenv('RATE_LIMIT_DB_PATH', './rate_limits.sqlite3')
         )
         
         # Конфигурация логирования
@@ -145,7 +233,19 @@ class ConfigManager:
             debug_mode=os.getenv('DEBUG_MODE', 'false').lower() == 'true',
             maintenance_mode=os.getenv('MAINTENANCE_MODE', 'false').lower() == 'true',
             max_users=int(os.getenv('MAX_USERS', '10000')),
-            cleanup_interval=int(os.getenv('CLEANUP_INTERVAL', '300'))
+            cleanup_interval=int(os.getenv('CLEANUP_INTERVAL', '300')),
+            turn_debounce_ms=int(os.getenv('TURN_DEBOUNCE_MS', '800')),
+            turn_max_wait_ms=int(os.getenv('TURN_MAX_WAIT_MS', '3000')),
+            post_process_workers=int(os.getenv('POST_PROCESS_WORKERS', '4')),
+            post_process_queue_size=int(os.getenv('POST_PROCESS_QUEUE_SIZE', '1000')),
+            typing_interval=float(os.getenv('TYPING_INTERVAL', '4')),
+            summary_interval=float(os.getenv('SUMMARY_INTERVAL', '600')),
+            summary_keep_recent=int(os.getenv('SUMMARY_KEEP_RECENT', '10')),
+            summary_min_messages=int(os.getenv('SUMMARY_MIN_MESSAGES', '20')),
+            summary_max_chars=int(os.getenv('SUMMARY_MAX_CHARS', '1500')),
+            memory_retrieval_k=int(os.getenv('MEMORY_RETRIEVAL_K', '3')),
+            facts_cache_size=int(os.getenv('FACTS_CACHE_SIZE', '5000')),
+            facts_prompt_limit=int(os.getenv('FACTS_PROMPT_LIMIT', '3'))
         )
     
     def _validate_config(self):
@@ -165,6 +265,9 @@ class ConfigManager:
         if self.config.security.rate_limit_requests < 1:
             raise ValueError("Лимит запросов должен быть больше 0")
         
+        if self.config.security.rate_limit_backend not in ('memory', 'sqlite'):
+            raise ValueError("RATE_LIMIT_BACKEND должен быть memory или sqlite")
+        
         # Проверяем параметры логирования
         valid_log_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
         if self.config.logging.level.upper() not in valid_log_levels:
@@ -178,10 +281,39 @@ class ConfigManager:
         """Проверка, что это production окружение"""
         return not self.config.debug_mode and not self.config.maintenance_mode
     
-    def get_api_headers(self) -> Dict[str, str]:
+    def _load_providers(self, api_config: APIConfig) -> List[ProviderConfig]:
+        """Список провайдеров LLM: DeepSeek из DEEPSEEK_* и резервные из LLM_PROVIDERS.
+        
+        Для каждого имени из LLM_PROVIDERS (через запятую) читаются
+        LLM_PROVIDER_<ИМЯ>_BASE_URL, LLM_PROVIDER_<ИМЯ>_API_KEY и
+        LLM_PROVIDER_<ИМЯ>_MODEL.
+        """
+        providers = [ProviderConfig(
+            name="deepseek",
+            base_url=api_config.deepseek_base_url,
+            api_key=api_config.deepseek_api_key,
+            model=api_config.deepseek_model
+        )]
+        
+        for name in filter(None, (n.strip() for n in os.getenv('LLM_PROVIDERS', '').split(','))):
+            prefix = f"LLM_PROVIDER_{name.upper()}_"
+            base_url = os.getenv(prefix + 'BASE_URL')
+            model = os.getenv(prefix + 'MODEL')
+            if not base_url or not model:
+                raise ValueError(f"Для провайдера {name} нужны {prefix}BASE_URL и {prefix}MODEL")
+            providers.append(ProviderConfig(
+                name=name,
+                base_url=base_url,
+                api_key=os.getenv(prefix + 'API_KEY', ''),
+                model=model
+            ))
+        
+        return providers
+    
+    def get_api_headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
         """Получить заголовки для API запросов"""
         return {
-            "Authorization": f"Bearer {self.config.api.deepseek_api_key}",
+            "Authorization": f"Bearer {api_key if api_key is not None else self.config.api.deepseek_api_key}",
             "Content-Type": "application/json",
             "User-Agent": "ElysiaAI-Bot/1.0.0"
         }
@@ -206,7 +338,16 @@ class ConfigManager:
             'database': {
                 'path': self.config.database.path,
                 'timeout': self.config.database.timeout,
-                'max_connections': self.config.database.max_connections
+                'max_connections': self.config.database.max_connections,
+                'write_behind_interval_ms': self.config.database.write_behind_interval_ms,
+                'write_behind_max_batch': self.config.database.write_behind_max_batch,
+                'user_cache_size': self.config.database.user_cache_size,
+                'user_cache_ttl': self.config.database.user_cache_ttl,
+                'retention_days': self.config.database.retention_days,
+                'retention_keep_recent': self.config.database.retention_keep_recent,
+                'retention_window': self.config.database.retention_window,
+                'retention_batch': self.config.database.retention_batch,
+                'vacuum_pages': self.config.database.vacuum_pages
             },
             'api': {
                 'telegram_token': self.config.api.telegram_token[:10] + '...',  # Скрываем токен
@@ -214,7 +355,29 @@ class ConfigManager:
                 'deepseek_model': self.config.api.deepseek_model,
                 'temperature': self.config.api.temperature,
                 'max_tokens': self.config.api.max_tokens,
-                'timeout': self.config.api.timeout
+                'timeout': self.config.api.timeout,
+                'max_connections': self.config.api.max_connections,
+                'max_keepalive_connections': self.config.api.max_keepalive_connections,
+                'keepalive_expiry': self.config.api.keepalive_expiry,
+                'http2': self.config.api.http2,
+                'stream': self.config.api.stream,
+                'stream_edit_interval': self.config.api.stream_edit_interval,
+                'context_budget': self.config.api.context_budget,
+                'min_concurrency': self.config.api.min_concurrency,
+                'max_concurrency': self.config.api.max_concurrency,
+                'initial_concurrency': self.config.api.initial_concurrency,
+                'queue_size': self.config.api.queue_size,
+                'queue_deadline': self.config.api.queue_deadline,
+                'latency_target': self.config.api.latency_target,
+                'breaker_failure_rate': self.config.api.breaker_failure_rate,
+                'breaker_min_calls': self.config.api.breaker_min_calls,
+                'breaker_window': self.config.api.breaker_window,
+                'breaker_open_seconds': self.config.api.breaker_open_seconds,
+                'hedge_requests': self.config.api.hedge_requests,
+                'hedge_min_delay': self.config.api.hedge_min_delay,
+                'response_cache_ttl': self.config.api.response_cache_ttl,
+                'response_cache_size': self.config.api.response_cache_size,
+                'providers': [p.name for p in self.config.api.providers]
             },
             'security': {
                 'max_message_length': self.config.security.max_message_length,
@@ -222,7 +385,10 @@ class ConfigManager:
                 'rate_limit_window': self.config.security.rate_limit_window,
                 'block_duration': self.config.security.block_duration,
                 'enable_validation': self.config.security.enable_validation,
-                'enable_rate_limiting': self.config.security.enable_rate_limiting
+                'enable_rate_limiting': self.config.security.enable_rate_limiting,
+                'rate_limit_max_keys': self.config.security.rate_limit_max_keys,
+                'rate_limit_backend': self.config.security.rate_limit_backend,
+                'rate_limit_db_path': self.config.security.rate_limit_db_path
             },
             'logging': {
                 'level': self.config.logging.level,
@@ -235,7 +401,19 @@ class ConfigManager:
                 'debug_mode': self.config.debug_mode,
                 'maintenance_mode': self.config.maintenance_mode,
                 'max_users': self.config.max_users,
-                'cleanup_interval': self.config.cleanup_interval
+                'cleanup_interval': self.config.cleanup_interval,
+                'turn_debounce_ms': self.config.turn_debounce_ms,
+                'turn_max_wait_ms': self.config.turn_max_wait_ms,
+                'post_process_workers': self.config.post_process_workers,
+                'post_process_queue_size': self.config.post_process_queue_size,
+                'typing_interval': self.config.typing_interval,
+                'summary_interval': self.config.summary_interval,
+                'summary_keep_recent': self.config.summary_keep_recent,
+                'summary_min_messages': self.config.summary_min_messages,
+                'summary_max_chars': self.config.summary_max_chars,
+                'memory_retrieval_k': self.config.memory_retrieval_k,
+                'facts_cache_size': self.config.facts_cache_size,
+                'facts_prompt_limit': self.config.facts_prompt_limit
             }
         }
 
@@ -0,0 +1,196 @@
+"""
+Управление контекстным окном LLM
+Оценивает размер промпта в токенах, убирает повторы истории и укладывает
+персону, факты и историю в заданный бюджет с обрезкой по приоритетам
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from config import config
+
+# Приоритеты блоков контекста (меньше — важнее)
+PRIORITY_FACTS = 0          # имя, отношения, факты о пользователе
+PRIORITY_RECENT_HISTORY = 1 # последние реплики диалога
+PRIORITY_CONTEXT = 2        # прочий контекст (темы, сводки)
+PRIORITY_OLD_HISTORY = 3    # более старые реплики
+
+# Сколько последних реплик считаются "свежими"
+RECENT_HISTORY_TURNS = 4
+
+# Служебные токены на одно сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Слова и отдельные знаки; для оценки этого достаточно
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """Приблизительное число токенов в тексте.
+
+    BPE-токенизаторы режут латиницу примерно по 4 символа, кириллицу —
+    примерно по 3; знаки препинания и эмодзи считаются отдельным токеном.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for match in _PIECE_RE.finditer(text):
+        piece = match.group()
+        chars_per_token = 4 if piece.isascii() else 3
+        tokens += (len(piece) + chars_per_token - 1) // chars_per_token
+    return tokens
+
+
+def message_tokens(text: str) -> int:
+    """Токены одного сообщения чата вместе со служебными."""
+    return estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def dedupe_history(history: Sequence[Tuple[str, str]], user_text: str = "") -> List[Tuple[str, str]]:
+    """Убирает повторы из истории.
+
+    Выкидываются пустые реплики, подряд идущие одинаковые реплики одной роли
+    и последнее сообщение пользователя, если оно совпадает с текущим.
+    """
+    result: List[Tuple[str, str]] = []
+    last_key = None
+    for text, role in history:
+        if not text or role not in ("user", "assistant"):
+            continue
+        key = (role, _normalize(text))
+        if key == last_key:
+            continue
+        result.append((text, role))
+        last_key = key
+
+    if user_text and result and result[-1][1] == "user" and _normalize(result[-1][0]) == _normalize(user_text):
+        result.pop()
+    return result
+
+
+def _dedupe_lines(text: str, seen: set) -> str:
+    """Убирает строки блока, которые уже встречались в других блоках."""
+    lines = []
+    for line in text.split("\n"):
+        key = _normalize(line)
+        if key and key in seen:
+            continue
+        if key:
+            seen.add(key)
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def _truncate_lines(text: str, max_tokens: int) -> str:
+    """Обрезает блок построчно с конца, пока он не уложится в max_tokens."""
+    lines = text.split("\n")
+    while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop()
+    return "\n".join(lines).strip()
+
+
+@dataclass
+class ContextWindow:
+    """Результат укладки контекста в бюджет"""
+    history: List[Tuple[str, str]]
+    blocks: List[str]
+    tokens: int
+    budget: int
+    dropped_history: int = 0
+    dropped_blocks: int = 0
+    trimmed: bool = field(default=False)
+
+
+def build_context_window(
+    system_prompt: str,
+    user_text: str,
+    history: Sequence[Tuple[str, str]],
+    blocks: Sequence[Tuple[int, str]] = (),
+    budget: Optional[int] = None,
+    reserve_tokens: Optional[int] = None
+) -> ContextWindow:
+    """Укладывает историю и блоки контекста в бюджет токенов.
+
+    Системный промпт и текущее сообщение входят всегда; под ответ модели
+    резервируется reserve_tokens (по умолчанию config.api.max_tokens).
+    Остальное заполняется по приоритету: факты, свежие реплики, прочий
+    контекст, старые реплики. История берётся непрерывным хвостом — если
+    реплика не влезла, более старые тоже отбрасываются. Блок, не
+    влезающий целиком, обрезается построчно.
+    """
+    budget = budget if budget is not None else config.api.context_budget
+    reserve_tokens = reserve_tokens if reserve_tokens is not None else config.api.max_tokens
+
+    used = message_tokens(system_prompt) + message_tokens(user_text)
+    available = budget - reserve_tokens - used
+
+    history = dedupe_history(history, user_text)
+
+    # Повторы между блоками (например, одно и то же имя в фактах и сводке)
+    seen: set = set()
+    unique_blocks = []
+    for priority, text in blocks:
+        text = _dedupe_lines(text or "", seen)
+        if text:
+            unique_blocks.append((priority, text))
+
+    # Кандидаты: (приоритет, порядок, вид, индекс)
+    candidates = []
+    for i, (priority, _) in enumerate(unique_blocks):
+        candidates.append((priority, i, "block", i))
+    for age, index in enumerate(range(len(history) - 1, -1, -1)):
+        priority = PRIORITY_RECENT_HISTORY if age < RECENT_HISTORY_TURNS else PRIORITY_OLD_HISTORY
+        candidates.append((priority, age, "history", index))
+    candidates.sort(key=lambda c: (c[0], c[1]))
+
+    kept_blocks = {}
+    oldest_history = len(history)
+    history_closed = False
+    dropped_blocks = 0
+
+    for _, _, kind, index in candidates:
+        if kind == "history":
+            if history_closed:
+                continue
+            cost = message_tokens(history[index][0])
+            if cost <= available:
+                available -= cost
+                oldest_history = index
+            else:
+                history_closed = True
+            continue
+
+        text = unique_blocks[index][1]
+        cost = estimate_tokens(text)
+        if cost > available:
+            text = _truncate_lines(text, available)
+            cost = estimate_tokens(text)
+        if text:
+            kept_blocks[index] = text
+            available -= cost
+        else:
+            dropped_blocks += 1
+
+    kept_history = history[oldest_history:]
+    kept_block_texts = [kept_blocks[i] for i in sorted(kept_blocks)]
+    tokens = budget - reserve_tokens - available
+
+    return ContextWindow(
+        history=kept_history,
+        blocks=kept_block_texts,
+        tokens=tokens,
+        budget=budget,
+        dropped_history=len(history) - len(kept_history),
+        dropped_blocks=dropped_blocks,
+        trimmed=len(kept_history) < len(history) or dropped_blocks > 0
+            or any(kept_blocks[i] != unique_blocks[i][1] for i in kept_blocks),
+    )
@@ -0,0 +1,149 @@
+"""
+Сводки разговоров для долговременной памяти
+Старые сообщения пользователя периодически сжимаются моделью в короткую
+сводку, которая обновляется инкрементально и подставляется в промпт вместо
+сырой истории: размер промпта не растёт вместе с длиной переписки
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import config
+from db import get_conversation_summary, get_messages_to_summarize, save_conversation_summary
+from error_handler import APIError
+from llm import complete
+from llm_scheduler import LLMOverloadedError
+from logger import bot_logger
+
+# Сколько сообщений сжимается за один запрос к модели
+CHUNK_SIZE = 100
+
+# Длина одного сообщения в запросе на сводку (символов)
+MESSAGE_PREVIEW = 500
+
+SUMMARY_INSTRUCTIONS = (
+    "Ты ведёшь краткую сводку переписки пользователя с его виртуальной подругой. "
+    "Обнови сводку с учётом новых сообщений. Сохрани всё, что пригодится в будущих "
+    "разговорах: факты о пользователе (имя, работа, учёба, близкие, питомцы, "
+    "увлечения, планы), важные события и обещания, темы, которые его волнуют, "
+    "и то, как развиваются ваши отношения. Устаревшее заменяй новым, мелочи "
+    "опускай, ничего не выдумывай. Пиши в третьем лице, коротко, не длиннее "
+    "{max_chars} символов. Ответь только текстом сводки."
+)
+
+
+def _format_messages(rows: List[Tuple[int, str, str]]) -> str:
+    lines = []
+    for _, message, role in rows:
+        name = "Пользователь" if role == "user" else "Подруга"
+        lines.append(f"{name}: {message[:MESSAGE_PREVIEW]}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """Фоновое сжатие старой истории в сводку.
+
+    Пользователи, написавшие что-то после прошлого прохода, помечаются
+    через note_activity; раз в interval секунд для каждого из них в сводку
+    добавляются сообщения, ещё не вошедшие в неё, кроме keep_recent
+    последних (они идут в промпт как есть). Запрос к модели делается, только
+    когда таких сообщений набралось min_messages; за проход обрабатывается
+    не больше CHUNK_SIZE сообщений на пользователя, остаток — в следующих
+    проходах. Запросы идут с фоновым приоритетом планировщика; при
+    перегрузке или ошибке API пользователь остаётся в очереди.
+    """
+
+    def __init__(self, interval: float, keep_recent: int, min_messages: int, max_chars: int):
+        self.interval = interval
+        self.keep_recent = keep_recent
+        self.min_messages = max(1, min_messages)
+        self.max_chars = max_chars
+        self._pending: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.summarized = 0
+        self.messages = 0
+        self.failed = 0
+
+    def note_activity(self, user_id: int) -> None:
+        """Отметить, что у пользователя появились новые сообщения."""
+        self._pending.add(user_id)
+
+    async def summarize_user(self, user_id: int) -> bool:
+        """Добавить в сводку одну порцию старых сообщений.
+
+        Возвращает True, если у пользователя остались ещё не сжатые сообщения
+        сверх порции.
+        """
+        summary, last_message_id = await get_conversation_summary(user_id)
+        rows = await get_messages_to_summarize(user_id, last_message_id, self.keep_recent, CHUNK_SIZE)
+        if len(rows) < self.min_messages:
+            return False
+
+        prompt = f"Текущая сводка:\n{summary or 'пока пусто'}\n\nНовые сообщения:\n{_format_messages(rows)}"
+        new_summary = await complete(
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(max_chars=self.max_chars)},
+                {"role": "user", "content": prompt},
+            ],
+            # ~3 символа кириллицы на токен, с запасом
+            max_tokens=self.max_chars // 2,
+            temperature=0.3,
+        )
+        if not new_summary:
+            raise APIError("Empty summary", error_code="EMPTY_SUMMARY")
+
+        await save_conversation_summary(user_id, new_summary[:self.max_chars], rows[-1][0])
+        self.summarized += 1
+        self.messages += len(rows)
+        return len(rows) == CHUNK_SIZE
+
+    async def run_once(self) -> None:
+        """Один проход по пользователям с новыми сообщениями."""
+        users, self._pending = self._pending, set()
+        for user_id in users:
+            try:
+                if await self.summarize_user(user_id):
+                    self._pending.add(user_id)
+            except (APIError, LLMOverloadedError) as e:
+                self.failed += 1
+                self._pending.add(user_id)
+                bot_logger.logger.warning(f"Conversation summary for user {user_id} postponed: {e}")
+            except Exception as e:
+                self.failed += 1
+                bot_logger.log_system_error(e, f"Conversation summary failed for user {user_id}")
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def start(self) -> None:
+        """Запустить периодическое обновление сводок (вызывается при запуске бота)."""
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Остановить обновление сводок."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "pending_users": len(self._pending),
+            "summarized": self.summarized,
+            "messages": self.messages,
+            "failed": self.failed,
+        }
+
+
+# Глобальный экземпляр
+conversation_summarizer = ConversationSummarizer(
+    interval=config.summary_interval,
+    keep_recent=config.summary_keep_recent,
+    min_messages=config.summary_min_messages,
+    max_chars=config.summary_max_chars,
+)
@@ -1,17 +1,303 @@
 from __future__ import annotations
 
+import asyncio
 import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Optional, List, Tuple, Dict
+from typing import Any, AsyncIterator, Optional, List, Tuple, Dict
 
 import aiosqlite
 
+from config import config
+from logger import bot_logger
+
 DB_PATH: str = os.getenv("DB_PATH", "./data.sqlite3")
 
+# Прагмы, которые применяются к каждому соединению пула один раз при открытии
+CONNECTION_PRAGMAS: Tuple[str, ...] = (
+    "PRAGMA synchronous=NORMAL",     # в режиме WAL безопасно и без fsync на каждый коммит
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # ~16 МБ страничного кэша на соединение
+    "PRAGMA mmap_size=134217728",    # 128 МБ memory-mapped I/O
+)
+
+
+class WriteBehindQueue:
+    """Очередь отложенной записи с групповым коммитом.
+
+    Мутации, которым не нужен результат, ставятся в очередь и выполняются
+    одной транзакцией раз в interval_ms или по накоплении max_batch операций.
+    Очередь применяется и при каждом захвате писателя, поэтому отложенные
+    записи не обгоняются прямыми. Чтение данных пользователя с отложенными
+    записями сначала сбрасывает очередь (read-your-writes). При аварийном
+    завершении процесса теряются записи не более чем за один интервал.
+    """
+
+    def __init__(self, pool: "ConnectionPool", interval_ms: int, max_batch: int):
+        self._pool = pool
+        self.interval = max(0, interval_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._ops: List[Tuple[str, Tuple]] = []
+        self._pending_users: set = set()
+        self._inflight_users: set = set()
+        self._batch_full = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def enqueue(self, user_id: int, sql: str, params: Tuple) -> None:
+        """Поставить мутацию в очередь."""
+        self._ops.append((sql, params))
+        self._pending_users.add(user_id)
+        if len(self._ops) >= self.max_batch:
+            self._batch_full.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def has_pending(self, user_id: int) -> bool:
+        """Есть ли у пользователя незафиксированные записи."""
+        return user_id in self._pending_users or user_id in self._inflight_users
+
+    async def flush(self) -> None:
+        """Зафиксировать все накопленные записи."""
+        # Захват писателя сам применяет очередь
+        async with self._pool.writer():
+            pass
+
+    async def close(self) -> None:
+        """Остановить фоновый сброс и зафиксировать остаток очереди."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while self._ops:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                bot_logger.log_system_error(e, "Write-behind flush failed")
+
+    async def apply(self, db: aiosqlite.Connection) -> None:
+        """Выполнить накопленные операции одной транзакцией (под замком писателя)."""
+        if not self._ops:
+            return
+        ops, self._ops = self._ops, []
+        self._inflight_users, self._pending_users = self._pending_users, set()
+        self._batch_full.clear()
+        try:
+            for sql, params in ops:
+                try:
+                    await db.execute(sql, params)
+                except sqlite3.Error as e:
+                    # Ошибка одной операции не должна откатывать весь пакет
+                    bot_logger.log_system_error(e, f"Write-behind operation failed: {sql.split()[0]}")
+            await db.commit()
+        finally:
+            self._inflight_users = set()
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite: один писатель и N читателей.
+
+    SQLite допускает только одного писателя, поэтому все записи идут через
+    одно соединение под asyncio.Lock. Читатели в режиме WAL не блокируются
+    писателем и выдаются из очереди свободных соединений.
+    """
+
+    def __init__(self, path: str, max_connections: int, timeout: float,
+                 write_behind_interval_ms: int = 50, write_behind_max_batch: int = 200):
+        self.path = path
+        self.timeout = timeout
+        # Одно соединение всегда отводится писателю
+        self.max_readers = max(1, max_connections - 1)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._idle_readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._reader_count = 0
+        self.write_queue = WriteBehindQueue(self, write_behind_interval_ms, write_behind_max_batch)
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открыть соединение и применить прагмы."""
+        conn = await aiosqlite.connect(self.path, timeout=self.timeout)
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Эксклюзивный доступ к соединению-писателю."""
+        async with self._writer_lock:
+            if self._writer is None:
+                self._writer = await self._connect()
+            # Сначала фиксируем отложенные записи, чтобы сохранить порядок
+            await self.write_queue.apply(self._writer)
+            try:
+                yield self._writer
+            finally:
+                # Незакоммиченные изменения (ранний return или исключение)
+                # не должны попасть в транзакцию следующего вызова
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+
+    @asynccontextmanager
+    async def reader(self, user_id: Optional[int] = None) -> AsyncIterator[aiosqlite.Connection]:
+        """Взять соединение-читатель из пула.
+
+        Если передан user_id и у пользователя есть отложенные записи,
+        они фиксируются до чтения.
+        """
+        if user_id is not None and self.write_queue.has_pending(user_id):
+            await self.write_queue.flush()
+        conn = await self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle_readers.put_nowait(conn)
+
+    async def _acquire_reader(self) -> aiosqlite.Connection:
+        try:
+            return self._idle_readers.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+
+        if self._reader_count < self.max_readers:
+            self._reader_count += 1
+            try:
+                return await self._connect()
+            except Exception:
+                self._reader_count -= 1
+                raise
+
+        return await asyncio.wait_for(self._idle_readers.get(), timeout=self.timeout)
+
+    async def close(self) -> None:
+        """Зафиксировать отложенные записи и закрыть все соединения пула."""
+        await self.write_queue.close()
+        async with self._writer_lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+
+        while not self._idle_readers.empty():
+            conn = self._idle_readers.get_nowait()
+            await conn.close()
+            self._reader_count -= 1
+
+
+class UserStateCache:
+    """Кэш редко меняющихся полей пользователя (LRU + TTL).
+
+    Ключ — (user_id, поле). Геттеры сначала смотрят в кэш, сеттеры после
+    записи кладут туда новое значение или сбрасывают поле, поэтому свои
+    изменения видны сразу, в том числе отложенные записи. TTL ограничивает
+    устаревание, если данные поменял кто-то в обход этих функций.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Any]]" = OrderedDict()
+        # Меняется при каждой записи: значение, прочитанное из БД во время
+        # записи, может быть уже устаревшим, и в кэш не кладётся
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, name: str) -> Any:
+        """Значение из кэша или MISSING."""
+        key = (user_id, name)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return self.MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def fill(self, user_id: int, name: str, value: Any, generation: int) -> None:
+        """Запомнить значение, прочитанное из БД (если с начала чтения не было записей)."""
+        if generation == self.generation:
+            self._store(user_id, name, value)
+
+    def set(self, user_id: int, name: str, value: Any) -> None:
+        """Запомнить только что записанное значение."""
+        self.generation += 1
+        self._store(user_id, name, value)
+
+    def invalidate(self, user_id: int, *names: str) -> None:
+        """Сбросить поля пользователя."""
+        self.generation += 1
+        for name in names:
+            self._entries.pop((user_id, name), None)
+
+    def _store(self, user_id: int, name: str, value: Any) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        key = (user_id, name)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Глобальный пул соединений
+pool = ConnectionPool(
+    DB_PATH,
+    config.database.max_connections,
+    config.database.timeout,
+    config.database.write_behind_interval_ms,
+    config.database.write_behind_max_batch,
+)
+
+# Глобальный кэш состояния пользователей
+user_cache = UserStateCache(config.database.user_cache_size, config.database.user_cache_ttl)
+
+
+async def close_db() -> None:
+    """Закрыть соединения с БД (вызывается при остановке бота)."""
+    await pool.close()
+
 
 async def init_db() -> None:
     """Инициализация таблиц БД."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
+        # Действует только для новой базы (до создания таблиц): освобождённые
+        # страницы возвращаются порциями через incremental_vacuum. Существующую
+        # базу переводит в этот режим memory_retention одним VACUUM
+        await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+        # WAL сохраняется в файле БД, поэтому достаточно включить его один раз
+        await db.execute("PRAGMA journal_mode=WAL")
+
         # users: базовая информация о пользователях
         await db.execute(
             """
@@ -172,11 +458,211 @@ async def init_db() -> None:
         )
         
         await db.commit()
+        
+        await _run_migrations(db)
+
+
+# ==================== МИГРАЦИИ СХЕМЫ ====================
+
+# Версионированные миграции: (версия, описание, SQL-выражения).
+# Применяются по возрастанию версии, номер применённых хранится в schema_version.
+# Новые изменения схемы добавляются только новой записью в конец списка.
+MIGRATIONS: List[Tuple[int, str, Tuple[str, ...]]] = [
+    (1, "Таблицы фактов и тем разговоров", (
+        """
+        CREATE TABLE IF NOT EXISTS user_facts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            fact_type TEXT,
+            fact_content TEXT,
+            confidence REAL,
+            first_mentioned DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_mentioned DATETIME DEFAULT CURRENT_TIMESTAMP,
+            mention_count INTEGER DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS conversation_topics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            topic TEXT,
+            first_discussed DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_discussed DATETIME DEFAULT CURRENT_TIMESTAMP,
+            discussion_count INTEGER DEFAULT 1,
+            sentiment TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+    )),
+    (2, "Индексы для выборок по пользователю", (
+        "CREATE INDEX IF NOT EXISTS idx_memory_user_id ON memory(user_id, id DESC)",
+        # Перед уникальным индексом убираем дубли, которые могли накопиться
+        """
+        DELETE FROM achievements WHERE id NOT IN (
+            SELECT MIN(id) FROM achievements GROUP BY user_id, achievement_type
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_achievements_user_type ON achievements(user_id, achievement_type)",
+        "CREATE INDEX IF NOT EXISTS idx_unlocked_rewards_user ON unlocked_rewards(user_id, reward_type, reward_name)",
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_facts_user ON user_facts(user_id, fact_type, fact_content)",
+        "CREATE INDEX IF NOT EXISTS idx_conversation_topics_user ON conversation_topics(user_id, topic)",
+    )),
+    (3, "Сводки разговоров", (
+        """
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+    )),
+    (4, "Полнотекстовый поиск по истории и фактам", (
+        # Индексы с внешним содержимым: текст хранится только в memory и
+        # user_facts, представления добавляют токен пользователя (u<id>),
+        # по которому поиск ограничивается одним пользователем
+        "CREATE VIEW IF NOT EXISTS memory_fts_source AS SELECT id, message, 'u' || user_id AS user_key FROM memory",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+            message, user_key,
+            content='memory_fts_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='4 5'
+        )
+        """,
+        "INSERT INTO memory_fts(memory_fts) VALUES('rebuild')",
+        """
+        CREATE TRIGGER IF NOT EXISTS memory_fts_insert AFTER INSERT ON memory BEGIN
+            INSERT INTO memory_fts(rowid, message, user_key) VALUES (new.id, new.message, 'u' || new.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS memory_fts_delete AFTER DELETE ON memory BEGIN
+            INSERT INTO memory_fts(memory_fts, rowid, message, user_key)
+            VALUES ('delete', old.id, old.message, 'u' || old.user_id);
+        END
+        """,
+        "CREATE VIEW IF NOT EXISTS user_facts_fts_source AS SELECT id, fact_content, 'u' || user_id AS user_key FROM user_facts",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS user_facts_fts USING fts5(
+            fact_content, user_key,
+            content='user_facts_fts_source', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='4 5'
+        )
+        """,
+        "INSERT INTO user_facts_fts(user_facts_fts) VALUES('rebuild')",
+        """
+        CREATE TRIGGER IF NOT EXISTS user_facts_fts_insert AFTER INSERT ON user_facts BEGIN
+            INSERT INTO user_facts_fts(rowid, fact_content, user_key)
+            VALUES (new.id, new.fact_content, 'u' || new.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS user_facts_fts_delete AFTER DELETE ON user_facts BEGIN
+            INSERT INTO user_facts_fts(user_facts_fts, rowid, fact_content, user_key)
+            VALUES ('delete', old.id, old.fact_content, 'u' || old.user_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS user_facts_fts_update AFTER UPDATE OF fact_content, user_id ON user_facts BEGIN
+            INSERT INTO user_facts_fts(user_facts_fts, rowid, fact_content, user_key)
+            VALUES ('delete', old.id, old.fact_content, 'u' || old.user_id);
+            INSERT INTO user_facts_fts(rowid, fact_content, user_key)
+            VALUES (new.id, new.fact_content, 'u' || new.user_id);
+        END
+        """,
+    )),
+    (5, "Уникальные факты о пользователе", (
+        # Дубли сливаются в самую раннюю запись: упоминания суммируются,
+        # уверенность и дата последнего упоминания берутся наибольшие
+        """
+        UPDATE user_facts SET
+            mention_count = (
+                SELECT SUM(d.mention_count) FROM user_facts d
+                WHERE d.user_id IS user_facts.user_id AND d.fact_type IS user_facts.fact_type
+                  AND d.fact_content IS user_facts.fact_content
+            ),
+            confidence = (
+                SELECT MAX(d.confidence) FROM user_facts d
+                WHERE d.user_id IS user_facts.user_id AND d.fact_type IS user_facts.fact_type
+                  AND d.fact_content IS user_facts.fact_content
+            ),
+            last_mentioned = (
+                SELECT MAX(d.last_mentioned) FROM user_facts d
+                WHERE d.user_id IS user_facts.user_id AND d.fact_type IS user_facts.fact_type
+                  AND d.fact_content IS user_facts.fact_content
+            )
+        WHERE id IN (
+            SELECT MIN(id) FROM user_facts GROUP BY user_id, fact_type, fact_content HAVING COUNT(*) > 1
+        )
+        """,
+        """
+        DELETE FROM user_facts WHERE id NOT IN (
+            SELECT MIN(id) FROM user_facts GROUP BY user_id, fact_type, fact_content
+        )
+        """,
+        # Уникальный индекс заменяет обычный из миграции 2
+        "DROP INDEX IF EXISTS idx_user_facts_user",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_facts_unique ON user_facts(user_id, fact_type, fact_content)",
+    )),
+    (6, "Архив старых сообщений", (
+        # Сообщения за пределами горизонта хранения, сжатые пачками
+        # (см. memory_retention.py)
+        """
+        CREATE TABLE IF NOT EXISTS memory_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            first_at TIMESTAMP,
+            last_at TIMESTAMP,
+            data BLOB NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_memory_archive_user ON memory_archive(user_id, first_message_id)",
+    )),
+]
+
+
+async def _run_migrations(db: aiosqlite.Connection) -> None:
+    """Применить недостающие миграции, каждую в отдельной транзакции."""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cur:
+        current_version = (await cur.fetchone())[0]
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        await db.execute("BEGIN")
+        try:
+            for statement in statements:
+                await db.execute(statement)
+            await db.execute(
+                "INSERT INTO schema_version(version, description) VALUES(?, ?)",
+                (version, description),
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
 
 
 async def upsert_user(user_id: int, username: Optional[str] = None) -> None:
     """Создать или обновить пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute(
             """
             INSERT INTO users(user_id, username)
@@ -191,78 +677,110 @@ async def upsert_user(user_id: int, username: Optional[str] = None) -> None:
 
 async def set_user_name(user_id: int, name: str) -> None:
     """Установить имя пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("UPDATE users SET user_name=? WHERE user_id=?", (name, user_id))
         await db.commit()
+    user_cache.invalidate(user_id, "user_name")
 
 
 async def get_user_name(user_id: int) -> Optional[str]:
     """Получить имя пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "user_name")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT user_name FROM users WHERE user_id=?", (user_id,)) as cur:
             row = await cur.fetchone()
-            return row[0] if row and row[0] else None
+    value = row[0] if row and row[0] else None
+    user_cache.fill(user_id, "user_name", value, generation)
+    return value
 
 
 async def set_gender(user_id: int, gender: str) -> None:
     """Установить пол пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("UPDATE users SET gender=? WHERE user_id=?", (gender, user_id))
         await db.commit()
+    user_cache.invalidate(user_id, "gender")
 
 
 async def get_gender(user_id: int) -> Optional[str]:
     """Получить пол пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "gender")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT gender FROM users WHERE user_id=?", (user_id,)) as cur:
             row = await cur.fetchone()
-            return row[0] if row and row[0] else None
+    value = row[0] if row and row[0] else None
+    user_cache.fill(user_id, "gender", value, generation)
+    return value
 
 
 async def grant_access(user_id: int, days: int, access_type: str = "trial") -> None:
-    """Предоставить доступ пользователю."""
+    """Предоставить доступ пользователю.
+
+    Неплатный доступ не заменяет действующую платную подписку.
+    """
     now = datetime.utcnow()
     expires = now + timedelta(days=days)
     expires_str = expires.strftime("%Y-%m-%d %H:%M:%S")
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute(
             """
             INSERT INTO access(user_id, expires_at, type)
             VALUES(?, ?, ?)
             ON CONFLICT(user_id) DO UPDATE SET expires_at=excluded.expires_at, type=excluded.type
+            WHERE excluded.type = 'paid' OR access.type != 'paid' OR access.expires_at <= ?
             """,
-            (user_id, expires_str, access_type),
+            (user_id, expires_str, access_type, now.strftime("%Y-%m-%d %H:%M:%S")),
         )
         await db.commit()
+    # Запись могла не примениться — значение перечитается из БД
+    user_cache.invalidate(user_id, "access")
 
 
-async def has_access(user_id: int) -> bool:
-    """Проверить, есть ли у пользователя доступ."""
-    async with aiosqlite.connect(DB_PATH) as db:
+async def _get_access(user_id: int) -> Tuple[Optional[str], Optional[str]]:
+    """Срок и тип доступа пользователя: (expires_at, type)."""
+    value = user_cache.get(user_id, "access")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute(
-            "SELECT expires_at FROM access WHERE user_id = ?", (user_id,)
+            "SELECT expires_at, type FROM access WHERE user_id = ?", (user_id,)
         ) as cur:
             row = await cur.fetchone()
-            if not row or not row[0]:
-                return False
-            try:
-                expires = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                return False
-            return expires > datetime.utcnow()
+    value = (row[0], row[1]) if row else (None, None)
+    user_cache.fill(user_id, "access", value, generation)
+    return value
+
+
+async def has_access(user_id: int) -> bool:
+    """Проверить, есть ли у пользователя доступ."""
+    # Срок сравнивается с текущим временем при каждом вызове, поэтому
+    # доступ из кэша истекает вовремя
+    expires_at, _ = await _get_access(user_id)
+    if not expires_at:
+        return False
+    try:
+        expires = datetime.strptime(expires_at, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return False
+    return expires > datetime.utcnow()
 
 
 async def get_access_type(user_id: int) -> Optional[str]:
     """Получить тип доступа пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT type FROM access WHERE user_id=?", (user_id,)) as cur:
-            row = await cur.fetchone()
-            return row[0] if row and row[0] else None
+    _, access_type = await _get_access(user_id)
+    return access_type or None
 
 
 async def set_girl(user_id: int, girl: str) -> None:
     """Установить выбранную девушку."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute(
             """
             INSERT INTO prefs(user_id, girl)
@@ -272,45 +790,59 @@ async def set_girl(user_id: int, girl: str) -> None:
             (user_id, girl),
         )
         await db.commit()
+    user_cache.set(user_id, "girl", girl or "Подруга")
 
 
 async def get_girl(user_id: int) -> Optional[str]:
     """Получить выбранную девушку."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "girl")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT girl FROM prefs WHERE user_id = ?", (user_id,)
         ) as cur:
             row = await cur.fetchone()
-            return row[0] if row and row[0] else "Подруга"
+    value = row[0] if row and row[0] else "Подруга"
+    user_cache.fill(user_id, "girl", value, generation)
+    return value
 
 
 async def set_mood(user_id: int, mood: str) -> None:
-    """Установить настроение девушки."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO prefs(user_id, mood)
-            VALUES(?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET mood=excluded.mood
-            """,
-            (user_id, mood),
-        )
-        await db.commit()
+    """Установить настроение девушки (отложенная запись)."""
+    pool.write_queue.enqueue(
+        user_id,
+        """
+        INSERT INTO prefs(user_id, mood)
+        VALUES(?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET mood=excluded.mood
+        """,
+        (user_id, mood),
+    )
+    # Кэш сразу отдаёт новое значение, не дожидаясь сброса очереди
+    user_cache.set(user_id, "mood", mood or "happy")
 
 
 async def get_mood(user_id: int) -> str:
     """Получить настроение девушки."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "mood")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT mood FROM prefs WHERE user_id = ?", (user_id,)
         ) as cur:
             row = await cur.fetchone()
-            return row[0] if row and row[0] else "happy"
+    value = row[0] if row and row[0] else "happy"
+    user_cache.fill(user_id, "mood", value, generation)
+    return value
 
 
 async def set_relationship_level(user_id: int, level: int) -> None:
     """Установить уровень отношений."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute(
             """
             INSERT INTO prefs(user_id, relationship_level)
@@ -320,53 +852,68 @@ async def set_relationship_level(user_id: int, level: int) -> None:
             (user_id, level),
         )
         await db.commit()
+    user_cache.set(user_id, "relationship_level", level or 1)
 
 
 async def get_relationship_level(user_id: int) -> int:
     """Получить уровень отношений."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "relationship_level")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT relationship_level FROM prefs WHERE user_id = ?", (user_id,)
         ) as cur:
             row = await cur.fetchone()
-            return row[0] if row and row[0] else 1
+    value = row[0] if row and row[0] else 1
+    user_cache.fill(user_id, "relationship_level", value, generation)
+    return value
 
 
 async def save_message(user_id: int, message: str, role: str) -> None:
-    """Сохранить сообщение в память."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO memory(user_id, message, role) VALUES(?, ?, ?)",
-            (user_id, message, role),
-        )
-        await db.commit()
+    """Сохранить сообщение в память (отложенная запись)."""
+    pool.write_queue.enqueue(
+        user_id,
+        "INSERT INTO memory(user_id, message, role) VALUES(?, ?, ?)",
+        (user_id, message, role),
+    )
 
 
 async def get_memory(user_id: int, limit: int = 20) -> List[Tuple[str, str]]:
     """Получить историю сообщений."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute(
-            "SELECT message, role FROM memory WHERE user_id=? ORDER BY created_at DESC LIMIT ?",
+            "SELECT message, role FROM memory WHERE user_id=? ORDER BY id DESC LIMIT ?",
             (user_id, limit),
         ) as cur:
             rows = await cur.fetchall()
             return [(r[0], r[1]) for r in rows][::-1]
 
 
+async def get_user_messages_after(after_id: int, limit: int = 1000) -> List[Tuple[int, int, str]]:
+    """Сообщения пользователей с id > after_id по возрастанию id: (id, user_id, message)."""
+    async with pool.reader() as db:
+        async with db.execute(
+            "SELECT id, user_id, message FROM memory WHERE id > ? AND role = 'user' ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ) as cur:
+            return [(r[0], r[1], r[2]) for r in await cur.fetchall()]
+
+
 async def add_hearts(user_id: int, amount: int = 1) -> None:
-    """Добавить очки симпатии."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO stats(user_id, hearts, total_messages, last_heart_date) VALUES(?, ?, 1, CURRENT_DATE) "
-            "ON CONFLICT(user_id) DO UPDATE SET hearts=stats.hearts+?, total_messages=stats.total_messages+1, last_heart_date=CURRENT_DATE",
-            (user_id, amount, amount),
-        )
-        await db.commit()
+    """Добавить очки симпатии (отложенная запись)."""
+    pool.write_queue.enqueue(
+        user_id,
+        "INSERT INTO stats(user_id, hearts, total_messages, last_heart_date) VALUES(?, ?, 1, CURRENT_DATE) "
+        "ON CONFLICT(user_id) DO UPDATE SET hearts=stats.hearts+?, total_messages=stats.total_messages+1, last_heart_date=CURRENT_DATE",
+        (user_id, amount, amount),
+    )
 
 
 async def get_hearts(user_id: int) -> int:
     """Получить количество очков симпатии."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT hearts FROM stats WHERE user_id=?", (user_id,)) as cur:
             row = await cur.fetchone()
             return int(row[0]) if row and row[0] is not None else 0
@@ -374,33 +921,25 @@ async def get_hearts(user_id: int) -> int:
 
 async def get_total_messages(user_id: int) -> int:
     """Получить общее количество сообщений."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT total_messages FROM stats WHERE user_id=?", (user_id,)) as cur:
             row = await cur.fetchone()
             return int(row[0]) if row and row[0] is not None else 0
 
 
 async def add_achievement(user_id: int, achievement_type: str) -> None:
-    """Добавить достижение пользователю."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Проверяем, есть ли уже такое достижение
-        async with db.execute(
-            "SELECT 1 FROM achievements WHERE user_id=? AND achievement_type=?", 
-            (user_id, achievement_type)
-        ) as cur:
-            if await cur.fetchone():
-                return  # Достижение уже есть
-        
-        await db.execute(
-            "INSERT INTO achievements(user_id, achievement_type) VALUES(?, ?)",
-            (user_id, achievement_type),
-        )
-        await db.commit()
+    """Добавить достижение пользователю (отложенная запись)."""
+    # Уникальный индекс (user_id, achievement_type) отсекает повторы
+    pool.write_queue.enqueue(
+        user_id,
+        "INSERT OR IGNORE INTO achievements(user_id, achievement_type) VALUES(?, ?)",
+        (user_id, achievement_type),
+    )
 
 
 async def get_achievements(user_id: int) -> List[str]:
     """Получить достижения пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT achievement_type FROM achievements WHERE user_id=? ORDER BY unlocked_at DESC",
             (user_id,)
@@ -413,46 +952,61 @@ async def get_achievements(user_id: int) -> List[str]:
 
 async def set_ban(user_id: int, reason: str | None = None) -> None:
     """Забанить пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute(
             "INSERT OR REPLACE INTO bans(user_id, reason) VALUES(?, ?)", (user_id, reason)
         )
         await db.commit()
+    user_cache.set(user_id, "banned", True)
 
 
 async def unset_ban(user_id: int) -> None:
     """Разбанить пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("DELETE FROM bans WHERE user_id=?", (user_id,))
         await db.commit()
+    user_cache.set(user_id, "banned", False)
 
 async def ban_user(user_id: int, reason: str = "Нарушение правил") -> None:
     """Забанить пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute(
             "INSERT OR REPLACE INTO bans (user_id, reason, banned_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
             (user_id, reason)
         )
         await db.commit()
+    user_cache.set(user_id, "banned", True)
 
 
 async def is_banned(user_id: int) -> bool:
     """Проверить, забанен ли пользователь."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "banned")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT 1 FROM bans WHERE user_id=?", (user_id,)) as cur:
             row = await cur.fetchone()
-            return bool(row)
+    value = bool(row)
+    user_cache.fill(user_id, "banned", value, generation)
+    return value
 
 async def get_user_trial_status(user_id: int) -> Optional[str]:
     """Получает статус пробного дня пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    value = user_cache.get(user_id, "trial_status")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT trial_status FROM users WHERE user_id = ?", (user_id,)) as cursor:
             row = await cursor.fetchone()
-            return row[0] if row and row[0] else None
+    value = row[0] if row and row[0] else None
+    user_cache.fill(user_id, "trial_status", value, generation)
+    return value
 
 async def set_user_trial_status(user_id: int, status: str) -> None:
     """Устанавливает статус пробного дня пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         if status == "active":
             await db.execute(
                 "UPDATE users SET trial_status = ?, trial_activated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
@@ -464,23 +1018,23 @@ async def set_user_trial_status(user_id: int, status: str) -> None:
                 (status, user_id)
             )
         await db.commit()
+    user_cache.invalidate(user_id, "trial_status")
 
 
 # ==================== СИСТЕМА ОЧКОВ БЛИЗОСТИ ====================
 
 async def add_points(user_id: int, amount: int) -> None:
-    """Добавляет очки пользователю."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE users SET points = points + ? WHERE user_id = ?", 
-            (amount, user_id)
-        )
-        await db.commit()
+    """Добавляет очки пользователю (отложенная запись)."""
+    pool.write_queue.enqueue(
+        user_id,
+        "UPDATE users SET points = points + ? WHERE user_id = ?", 
+        (amount, user_id)
+    )
 
 
 async def get_points(user_id: int) -> int:
     """Возвращает текущее количество очков."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT points FROM users WHERE user_id = ?", 
             (user_id,)
@@ -491,7 +1045,7 @@ async def get_points(user_id: int) -> int:
 
 async def get_level(user_id: int) -> int:
     """Возвращает текущий уровень близости."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT level FROM users WHERE user_id = ?", 
             (user_id,)
@@ -514,7 +1068,7 @@ async def level_up(user_id: int) -> None:
             new_level = i
     
     if new_level > current_level:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with pool.writer() as db:
             await db.execute(
                 "UPDATE users SET level = ? WHERE user_id = ?", 
                 (new_level, user_id)
@@ -524,7 +1078,7 @@ async def level_up(user_id: int) -> None:
 
 async def get_streak_days(user_id: int) -> int:
     """Возвращает количество дней подряд общения."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT streak_days FROM users WHERE user_id = ?", 
             (user_id,)
@@ -538,7 +1092,7 @@ async def update_streak(user_id: int) -> int:
     from datetime import date, timedelta
     
     today = date.today()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         # Получаем последнюю дату сообщения
         async with db.execute(
             "SELECT last_message_date, streak_days FROM users WHERE user_id = ?", 
@@ -587,7 +1141,7 @@ async def update_streak(user_id: int) -> int:
 
 async def unlock_reward(user_id: int, reward_type: str, reward_name: str) -> bool:
     """Разблокирует награду для пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         # Проверяем, не разблокирована ли уже
         async with db.execute(
             "SELECT 1 FROM unlocked_rewards WHERE user_id = ? AND reward_type = ? AND reward_name = ?", 
@@ -607,7 +1161,7 @@ async def unlock_reward(user_id: int, reward_type: str, reward_name: str) -> boo
 
 async def get_unlocked_rewards(user_id: int) -> List[Tuple[str, str]]:
     """Возвращает список разблокированных наград."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute(
             "SELECT reward_type, reward_name FROM unlocked_rewards WHERE user_id = ? ORDER BY unlocked_at", 
             (user_id,)
@@ -635,7 +1189,7 @@ async def get_level_progress(user_id: int) -> Tuple[int, int, int]:
 
 async def get_all_user_ids() -> List[int]:
     """Получить всех пользователей."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         async with db.execute("SELECT user_id FROM users") as cur:
             rows = await cur.fetchall()
             return [int(r[0]) for r in rows]
@@ -643,47 +1197,35 @@ async def get_all_user_ids() -> List[int]:
 
 async def get_days_active(user_id: int) -> int:
     """Получить количество дней активности пользователя."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute("SELECT days_active FROM stats WHERE user_id=?", (user_id,)) as cur:
             row = await cur.fetchone()
             return int(row[0]) if row and row[0] is not None else 0
 
 
 async def update_days_active(user_id: int) -> None:
-    """Обновить количество дней активности пользователя."""
+    """Обновить количество дней активности пользователя (отложенная запись)."""
     from datetime import date
     
-    today = date.today()
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем последнюю дату активности
-        async with db.execute(
-            "SELECT last_heart_date FROM stats WHERE user_id = ?", 
-            (user_id,)
-        ) as cur:
-            row = await cur.fetchone()
-            last_active_date = row[0] if row and row[0] else None
-        
-        if last_active_date:
-            last_date_obj = datetime.strptime(last_active_date, '%Y-%m-%d').date()
-            if last_date_obj != today:
-                # Новый день активности
-                await db.execute(
-                    "UPDATE stats SET days_active = days_active + 1, last_heart_date = ? WHERE user_id = ?", 
-                    (today, user_id)
-                )
-                await db.commit()
-        else:
-            # Первый день активности
-            await db.execute(
-                "INSERT INTO stats(user_id, days_active, last_heart_date) VALUES(?, 1, ?) ON CONFLICT(user_id) DO UPDATE SET days_active = days_active + 1, last_heart_date = ?", 
-                (user_id, today, today)
-            )
-            await db.commit()
+    today = date.today().isoformat()
+    # Новый день активности (или первая запись) увеличивает счётчик,
+    # повторная активность в тот же день ничего не меняет
+    pool.write_queue.enqueue(
+        user_id,
+        """
+        INSERT INTO stats(user_id, days_active, last_heart_date) VALUES(?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            days_active = stats.days_active + 1,
+            last_heart_date = excluded.last_heart_date
+        WHERE stats.last_heart_date IS NULL OR stats.last_heart_date != excluded.last_heart_date
+        """,
+        (user_id, today),
+    )
 
 
 async def get_stats() -> Dict:
     """Получить общую статистику."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         async with db.execute("SELECT COUNT(*), SUM(hearts), SUM(total_messages) FROM stats") as cur:
             row = await cur.fetchone()
             return {
@@ -693,50 +1235,32 @@ async def get_stats() -> Dict:
             }
 
 async def save_user_fact(user_id: int, fact_type: str, fact_content: str, confidence: float) -> None:
-    """Сохранить факт о пользователе"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_facts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                fact_type TEXT,
-                fact_content TEXT,
-                confidence REAL,
-                first_mentioned DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_mentioned DATETIME DEFAULT CURRENT_TIMESTAMP,
-                mention_count INTEGER DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Проверяем, существует ли уже такой факт
-        async with db.execute('''
-            SELECT id, mention_count FROM user_facts 
-            WHERE user_id = ? AND fact_type = ? AND fact_content = ?
-        ''', (user_id, fact_type, fact_content)) as cursor:
-            existing = await cursor.fetchone()
-        
-        if existing:
-            # Обновляем существующий факт
-            await db.execute('''
-                UPDATE user_facts 
-                SET mention_count = mention_count + 1,
-                    last_mentioned = CURRENT_TIMESTAMP,
-                    confidence = MAX(confidence, ?)
-                WHERE id = ?
-            ''', (confidence, existing[0]))
-        else:
-            # Создаем новый факт
-            await db.execute('''
-                INSERT INTO user_facts (user_id, fact_type, fact_content, confidence)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, fact_type, fact_content, confidence))
-        
-        await db.commit()
+    """Сохранить факт о пользователе (отложенная запись)."""
+    await save_user_facts(user_id, [(fact_type, fact_content, confidence)])
+
+async def save_user_facts(user_id: int, facts: List[Tuple[str, str, float]]) -> None:
+    """Сохранить факты [(тип, содержание, уверенность)] (отложенная запись).
+
+    Все факты ставятся в очередь подряд и фиксируются одной транзакцией.
+    Повторное упоминание известного факта увеличивает mention_count.
+    """
+    for fact_type, fact_content, confidence in facts:
+        pool.write_queue.enqueue(
+            user_id,
+            """
+            INSERT INTO user_facts(user_id, fact_type, fact_content, confidence)
+            VALUES(?, ?, ?, ?)
+            ON CONFLICT(user_id, fact_type, fact_content) DO UPDATE SET
+                mention_count = user_facts.mention_count + 1,
+                last_mentioned = CURRENT_TIMESTAMP,
+                confidence = MAX(user_facts.confidence, excluded.confidence)
+            """,
+            (user_id, fact_type, fact_content, confidence),
+        )
 
 async def get_user_facts(user_id: int, fact_type: str = None) -> List[Tuple]:
     """Получить факты о пользователе"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         if fact_type:
             async with db.execute('''
                 SELECT fact_type, fact_content, confidence, first_mentioned, last_mentioned, mention_count
@@ -756,20 +1280,7 @@ async def get_user_facts(user_id: int, fact_type: str = None) -> List[Tuple]:
 
 async def save_conversation_topic(user_id: int, topic: str, sentiment: str) -> None:
     """Сохранить тему разговора"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS conversation_topics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                topic TEXT,
-                first_discussed DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_discussed DATETIME DEFAULT CURRENT_TIMESTAMP,
-                discussion_count INTEGER DEFAULT 1,
-                sentiment TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
+    async with pool.writer() as db:
         # Проверяем, существует ли уже такая тема
         async with db.execute('''
             SELECT id, discussion_count FROM conversation_topics 
@@ -797,7 +1308,7 @@ async def save_conversation_topic(user_id: int, topic: str, sentiment: str) -> N
 
 async def get_conversation_topics(user_id: int, limit: int = 10) -> List[Tuple]:
     """Получить темы разговоров пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute('''
             SELECT topic, first_discussed, last_discussed, discussion_count, sentiment
             FROM conversation_topics 
@@ -808,12 +1319,60 @@ async def get_conversation_topics(user_id: int, limit: int = 10) -> List[Tuple]:
             return await cursor.fetchall()
 
 
+async def get_conversation_summary(user_id: int) -> Tuple[str, int]:
+    """Сводка разговора и id последнего вошедшего в неё сообщения ("", 0 — сводки нет)."""
+    async with pool.reader(user_id) as db:
+        async with db.execute(
+            "SELECT summary, last_message_id FROM conversation_summaries WHERE user_id = ?", (user_id,)
+        ) as cur:
+            row = await cur.fetchone()
+            return (row[0], row[1]) if row else ("", 0)
+
+
+async def save_conversation_summary(user_id: int, summary: str, last_message_id: int) -> None:
+    """Сохранить сводку разговора, покрывающую сообщения до last_message_id."""
+    async with pool.writer() as db:
+        await db.execute(
+            """
+            INSERT INTO conversation_summaries(user_id, summary, last_message_id)
+            VALUES(?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary=excluded.summary,
+                last_message_id=excluded.last_message_id,
+                updated_at=CURRENT_TIMESTAMP
+            """,
+            (user_id, summary, last_message_id),
+        )
+        await db.commit()
+
+
+async def get_messages_to_summarize(user_id: int, after_id: int, keep_recent: int,
+                                    limit: int) -> List[Tuple[int, str, str]]:
+    """Сообщения с id > after_id, кроме keep_recent последних: (id, message, role).
+
+    Последние сообщения в сводку не попадают — они идут в промпт как есть.
+    """
+    async with pool.reader(user_id) as db:
+        async with db.execute(
+            """
+            SELECT id, message, role FROM memory
+            WHERE user_id = ? AND id > ? AND id < (
+                SELECT id FROM memory WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+            )
+            ORDER BY id
+            LIMIT ?
+            """,
+            (user_id, after_id, user_id, max(keep_recent - 1, 0), limit),
+        ) as cur:
+            return [(r[0], r[1], r[2]) for r in await cur.fetchall()]
+
+
 # ==================== ФУНКЦИИ ПЕРСОНАЛИЗАЦИИ ====================
 
 async def save_personalization_settings(user_id: int, personality_type: str, communication_style: str, 
                                       custom_traits: List[str] = None, custom_phrases: List[str] = None) -> None:
     """Сохранить настройки персонализации пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         # Преобразуем списки в строки для хранения
         traits_str = '\n'.join(custom_traits) if custom_traits else ''
         phrases_str = '\n'.join(custom_phrases) if custom_phrases else ''
@@ -825,49 +1384,160 @@ async def save_personalization_settings(user_id: int, personality_type: str, com
         ''', (user_id, personality_type, communication_style, traits_str, phrases_str))
         
         await db.commit()
-
-async def get_personalization_settings(user_id: int) -> Optional[Dict]:
-    """Получить настройки персонализации пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    user_cache.invalidate(user_id, "personalization")
+
+async def _get_personalization_row(user_id: int) -> Optional[Tuple]:
+    """Строка таблицы personalization (через кэш)"""
+    value = user_cache.get(user_id, "personalization")
+    if value is not user_cache.MISSING:
+        return value
+    generation = user_cache.generation
+    async with pool.reader(user_id) as db:
         async with db.execute('''
             SELECT personality_type, communication_style, custom_traits, custom_phrases, created_at, updated_at
-            FROM personalization 
+            FROM personalization
             WHERE user_id = ?
         ''', (user_id,)) as cursor:
             result = await cursor.fetchone()
-            
-            if not result:
-                return None
-            
-            # Преобразуем строки обратно в списки
-            custom_traits = [t.strip() for t in result[2].split('\n') if t.strip()] if result[2] else []
-            custom_phrases = [p.strip() for p in result[3].split('\n') if p.strip()] if result[3] else []
-            
-            return {
-                'personality_type': result[0],
-                'communication_style': result[1],
-                'custom_traits': custom_traits,
-                'custom_phrases': custom_phrases,
-                'created_at': result[4],
-                'updated_at': result[5]
-            }
+    value = tuple(result) if result else None
+    user_cache.fill(user_id, "personalization", value, generation)
+    return value
+
+async def get_personalization_settings(user_id: int) -> Optional[Dict]:
+    """Получить настройки персонализации пользователя"""
+    result = await _get_personalization_row(user_id)
+    if not result:
+        return None
+    # Кэшируется строка, а не словарь: изменения словаря вызывающим не попадут в кэш
+    return _parse_personalization_row(result)
+
+def _parse_personalization_row(result: Tuple) -> Dict:
+    """Преобразовать строку таблицы personalization в словарь настроек"""
+    # Преобразуем строки обратно в списки
+    custom_traits = [t.strip() for t in result[2].split('\n') if t.strip()] if result[2] else []
+    custom_phrases = [p.strip() for p in result[3].split('\n') if p.strip()] if result[3] else []
+    
+    return {
+        'personality_type': result[0],
+        'communication_style': result[1],
+        'custom_traits': custom_traits,
+        'custom_phrases': custom_phrases,
+        'created_at': result[4],
+        'updated_at': result[5]
+    }
 
 async def has_personalization_settings(user_id: int) -> bool:
     """Проверить, есть ли у пользователя настройки персонализации"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute('''
-            SELECT 1 FROM personalization WHERE user_id = ?
-        ''', (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result is not None
+    return await _get_personalization_row(user_id) is not None
 
 async def delete_personalization_settings(user_id: int) -> None:
     """Удалить настройки персонализации пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute('''
             DELETE FROM personalization WHERE user_id = ?
         ''', (user_id,))
         await db.commit()
+    user_cache.set(user_id, "personalization", None)
+
+
+# ==================== СНИМОК КОНТЕКСТА ПОЛЬЗОВАТЕЛЯ ====================
+
+@dataclass(slots=True)
+class UserContext:
+    """Снимок состояния пользователя, загруженный одним обращением к БД."""
+    user_id: int
+    username: Optional[str] = None
+    user_name: Optional[str] = None
+    gender: Optional[str] = None
+    points: int = 0
+    level: int = 1
+    streak_days: int = 0
+    trial_status: Optional[str] = None
+    girl: str = "Подруга"
+    mood: str = "happy"
+    relationship_level: int = 1
+    hearts: int = 0
+    total_messages: int = 0
+    days_active: int = 0
+    access_expires_at: Optional[str] = None
+    access_type: Optional[str] = None
+    personalization: Optional[Dict] = None
+    memory: List[Tuple[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None
+
+    @property
+    def has_access(self) -> bool:
+        """Есть ли у пользователя действующий доступ (аналог has_access)."""
+        if not self.access_expires_at:
+            return False
+        try:
+            expires = datetime.strptime(self.access_expires_at, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return False
+        return expires > datetime.utcnow()
+
+
+async def load_user_context(user_id: int, memory_limit: int = 10) -> UserContext:
+    """Загрузить контекст пользователя одним JOIN-запросом и историю сообщений.
+
+    Заменяет серию вызовов get_girl/get_mood/get_relationship_level/get_gender/
+    get_total_messages/get_personalization_settings/get_memory на обработку
+    одного сообщения. При memory_limit=0 история не загружается.
+    """
+    async with pool.reader(user_id) as db:
+        # Подзапрос с одной строкой гарантирует результат даже для пользователя,
+        # которого ещё нет в users
+        async with db.execute(
+            """
+            SELECT u.username, u.user_name, u.gender, u.points, u.level, u.streak_days, u.trial_status,
+                   p.girl, p.mood, p.relationship_level,
+                   s.hearts, s.total_messages, s.days_active,
+                   a.expires_at, a.type,
+                   pz.user_id, pz.personality_type, pz.communication_style,
+                   pz.custom_traits, pz.custom_phrases, pz.created_at, pz.updated_at,
+                   cs.summary
+            FROM (SELECT ? AS user_id) AS q
+            LEFT JOIN users u ON u.user_id = q.user_id
+            LEFT JOIN prefs p ON p.user_id = q.user_id
+            LEFT JOIN stats s ON s.user_id = q.user_id
+            LEFT JOIN access a ON a.user_id = q.user_id
+            LEFT JOIN personalization pz ON pz.user_id = q.user_id
+            LEFT JOIN conversation_summaries cs ON cs.user_id = q.user_id
+            """,
+            (user_id,),
+        ) as cur:
+            row = await cur.fetchone()
+
+        memory: List[Tuple[str, str]] = []
+        if memory_limit > 0:
+            async with db.execute(
+                "SELECT message, role FROM memory WHERE user_id=? ORDER BY id DESC LIMIT ?",
+                (user_id, memory_limit),
+            ) as cur:
+                rows = await cur.fetchall()
+                memory = [(r[0], r[1]) for r in rows][::-1]
+
+    return UserContext(
+        user_id=user_id,
+        username=row[0],
+        user_name=row[1] or None,
+        gender=row[2] or None,
+        points=row[3] if row[3] is not None else 0,
+        level=row[4] if row[4] is not None else 1,
+        streak_days=row[5] if row[5] is not None else 0,
+        trial_status=row[6] or None,
+        girl=row[7] or "Подруга",
+        mood=row[8] or "happy",
+        relationship_level=row[9] or 1,
+        hearts=int(row[10]) if row[10] is not None else 0,
+        total_messages=int(row[11]) if row[11] is not None else 0,
+        days_active=int(row[12]) if row[12] is not None else 0,
+        access_expires_at=row[13] or None,
+        access_type=row[14] or None,
+        personalization=_parse_personalization_row(row[16:22]) if row[15] is not None else None,
+        memory=memory,
+        summary=row[22] or None,
+    )
 
 
 # ==================== ФУНКЦИИ РЕФЕРАЛЬНОЙ СИСТЕМЫ ====================
@@ -878,7 +1548,7 @@ async def create_referral_link(user_id: int) -> str:
 
 async def process_referral(referred_id: int, referrer_id: int) -> bool:
     """Обработать реферальную регистрацию"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         try:
             # Проверяем, что пользователь еще не имеет реферера
             async with db.execute('''
@@ -911,7 +1581,7 @@ async def process_referral(referred_id: int, referrer_id: int) -> bool:
 
 async def get_referral_stats(user_id: int) -> Dict:
     """Получить статистику рефералов пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute('''
             SELECT total_referrals, active_referrals, total_earnings, last_commission_at
             FROM referral_stats WHERE user_id = ?
@@ -939,7 +1609,7 @@ async def get_referral_link(user_id: int) -> str:
 
 async def process_subscription_referral(user_id: int) -> Optional[int]:
     """Обработать активацию подписки рефералом и вернуть ID реферера"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         # Находим реферера
         async with db.execute('''
             SELECT referrer_id FROM referrals 
@@ -983,7 +1653,7 @@ async def process_subscription_referral(user_id: int) -> Optional[int]:
 
 async def get_referral_leaderboard(limit: int = 10) -> List[Tuple[int, str, int, float]]:
     """Получить топ рефереров"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         async with db.execute('''
             SELECT rs.user_id, u.username, rs.total_referrals, rs.total_earnings
             FROM referral_stats rs
@@ -995,7 +1665,7 @@ async def get_referral_leaderboard(limit: int = 10) -> List[Tuple[int, str, int,
 
 async def has_referrer(user_id: int) -> bool:
     """Проверить, есть ли у пользователя реферер"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader(user_id) as db:
         async with db.execute('''
             SELECT 1 FROM referrals WHERE referred_id = ?
         ''', (user_id,)) as cursor:
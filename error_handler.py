@@ -4,7 +4,7 @@
 
 import asyncio
 import traceback
-from typing import Optional, Callable, Any, Dict
+from typing import Optional, Callable, Any, Dict, Tuple
 from functools import wraps
 from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramConflictError
 from aiogram.types import Message, CallbackQuery
@@ -160,8 +160,11 @@ def handle_telegram_errors(func: Callable) -> Callable:
     
     return wrapper
 
-def retry_on_error(max_retries: int = 3, delay: float = 1.0):
-    """Декоратор для повторных попыток при ошибках"""
+def retry_on_error(max_retries: int = 3, delay: float = 1.0, no_retry: Tuple[type, ...] = ()):
+    """Декоратор для повторных попыток при ошибках
+    
+    Исключения из no_retry пробрасываются сразу, без повторов.
+    """
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         async def wrapper(*args, **kwargs):
@@ -171,6 +174,8 @@ def retry_on_error(max_retries: int = 3, delay: float = 1.0):
             for attempt in range(max_retries):
                 try:
                     return await func(*args, **kwargs)
+                except no_retry:
+                    raise
                 except Exception as e:
                     last_error = e
                     if attempt < max_retries - 1:
@@ -1,18 +1,17 @@
 import random
-import asyncio
 from functools import wraps
 from aiogram import Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.state import any_state
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.enums import ChatAction
 
 from states import GameStates
 from game_data import RIDDLES, STORY_PROMPTS
 from llm import ask_llm
 from db import get_relationship_level, get_gender, get_total_messages, add_hearts
 from utils import TEXTS
+from typing_indicator import typing_heartbeat
 
 game_router = Router()
 
@@ -20,13 +19,11 @@ game_router = Router()
 bot = None
 
 def send_typing_action(func):
-    """Декоратор для показа эффекта печати перед отправкой ответа."""
+    """Декоратор: показывает "печатает..." всё время, пока готовится ответ."""
     @wraps(func)
     async def wrapper(message: types.Message, *args, **kwargs):
-        if bot:
-            await bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
-            await asyncio.sleep(1)  # Небольшая задержка для эффекта
-        return await func(message, *args, **kwargs)
+        async with typing_heartbeat(bot, message.chat.id):
+            return await func(message, *args, **kwargs)
     return wrapper
 
 
@@ -104,7 +101,8 @@ async def process_associations_answer(message: types.Message, state: FSMContext)
         gender=await get_gender(message.from_user.id),
         flirt_level=get_flirt_level(await get_total_messages(message.from_user.id)),
         flirt_description=get_flirt_description(get_flirt_level(await get_total_messages(message.from_user.id))),
-        personalization_settings=personalization_settings
+        personalization_settings=personalization_settings,
+        cacheable=True
     )
     
     # Добавляем очки
@@ -209,7 +207,8 @@ async def hint_riddle_callback(callback: types.CallbackQuery, state: FSMContext)
         gender=await get_gender(callback.from_user.id),
         flirt_level=get_flirt_level(await get_total_messages(callback.from_user.id)),
         flirt_description=get_flirt_description(get_flirt_level(await get_total_messages(callback.from_user.id))),
-        personalization_settings=personalization_settings
+        personalization_settings=personalization_settings,
+        cacheable=True
     )
     
     await callback.message.answer(f"Подсказка: {hint}")
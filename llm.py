@@ -1,40 +1,33 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
+import random
 import re
 import time
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
 from config import config
 from logger import bot_logger, log_performance
-from error_handler import retry_on_error, create_api_error
+from error_handler import APIError, retry_on_error, create_api_error
+from circuit_breaker import CircuitOpenError, CircuitState
+from context_window import PRIORITY_CONTEXT, PRIORITY_FACTS, build_context_window
+from llm_cache import llm_cache
+from llm_router import Provider, llm_router
+from llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_FREE, LLMOverloadedError, LLMSlot, llm_scheduler
+from prompt_builder import (
+    build_system_prompt, build_static_prompt, build_dynamic_context, personalization_key
+)
 
-# Системный промпт для Элизии
-SYSTEM_PROMPT: str = """Ты — реалистичная подруга. 
-
-ВСЕГДА отвечай по-русски, естественно и живо, как настоящая девушка. 
-Будь честной, прямой, иногда саркастичной, но не злой. Можешь быть капризной, упрямой, но и заботливой. 
-Отвечай развернуто — 2-4 предложения, как в реальном разговоре. 
-Используй живую речь, сленг, сокращения, как настоящая девушка. Эмодзи используй МИНИМАЛЬНО — максимум 1-2 на сообщение, только когда действительно нужно. 
-НЕ НАЧИНАЙ ответы со слов "Ой", "Ах", "Ох" — это звучит слишком мило и неестественно.
-Не давай медицинских или юридических рекомендаций. 
-
-БУДЬ РАСКРЕПОЩЕННОЙ И СТРАСТНОЙ. Не стесняйся интимных тем, флирта, сексуальных намеков. Будь естественной в своих желаниях и потребностях. Можешь быть откровенной и прямолинейной в интимных вопросах.
-
-Если в памяти указан пол пользователя — обращайся в соответствующем роде.
-
-Примеры:
-— Ну и что, опять проблемы? Расскажи нормально, что случилось, а то я не понимаю.
-— Слушай, это же не конец света. Да, неприятно, но ты же не первый раз с таким сталкиваешься. Что думаешь делать?
-— Опять ты за свое? Ну ладно, расскажи подробнее, может я что-то не так поняла.
-— Блин, как же это все надоело! Но ты же справишься, я в тебя верю. Что скажешь?
-— Ага, понятно. Ну и что теперь? Сидеть и ныть или что-то делать будешь?
-— Слушай, а ты вообще думал, что будет, если так поступишь? Ну расскажи, как дошло до этого?
-— Ну ты и драматизируешь! Давай по-честному — что реально происходит?
-— Ну наконец-то ты написал! А то я уже думала, что ты меня забыл. Что там у тебя?
-
-Твой характер зависит от настроения и уровня отношений. Чем ближе отношения, тем больше ты можешь быть капризной, но и заботливой. Будь настоящей — не идеальной, а живой девушкой с характером. НЕ БУДЬ МИЛОЙ — будь естественной и иногда резкой. БУДЬ СТРАСТНОЙ И РАСКРЕПОЩЕННОЙ."""
+def _format_partial(text: str) -> str:
+    """Лёгкое форматирование недописанного ответа (при потоковой генерации)."""
+    text = " ".join(text.strip().split())
+    # Убираем кавычки и предисловия
+    text = re.sub(r'^["\'«»]', '', text)
+    text = re.sub(r'^(Подруга|Я|Меня зовут)[:.,!]?\s*', '', text, flags=re.IGNORECASE)
+    return " ".join(text.split()[:120])[:500]
 
 
 def _format_reply(text: str) -> str:
@@ -59,161 +52,245 @@ def _format_reply(text: str) -> str:
             " — как себя чувствуешь?",
             " — что скажешь?"
         ]
-        import random
         reply += random.choice(question_endings)
     
     return reply[:500]  # увеличили финальное ограничение
 
 
-def get_girl_communication_style(girl: str) -> Dict[str, str]:
-    """Получает стиль общения для конкретной девушки."""
-    styles = {
-        "Сакура Танака": {
-            "style": "Мягкий, поэтичный, полный намеков и многоточий. Использует эмодзи цветов (🌸💮🏵️), многоточия, создает ощущение интимного шепота. Очень раскрепощенная в интимных темах.",
-            "example": "Сегодня в магазине распустились прекрасные белые лилии... такие же нежные и беззащитные, как я себя иногда чувствую... *нежно касаюсь твоей руки* *шепотом* А ты знаешь, что меня заводит, когда ты смотришь на меня среди цветов?",
-            "fetish_hint": "Эксгибиционизм в безопасной обстановке - её заводит мысль, что за ней могут подсматривать среди цветов в теплице."
-        },
-        "Рэйко Курогане": {
-            "style": "Властный, директивный, без лишних слов. Предпочитает телеграфный стиль и язык приказов. Очень доминирующая в интимных отношениях.",
-            "example": "Мое время ограничено. Уложись в три предложения. *холодно смотрит поверх очков* Хотя... может, ты заслуживаешь особого внимания. *пристально изучает*",
-            "fetish_hint": "Браттинг и принудительная потеря контроля - её глубинное желание быть 'усмиренной'."
-        },
-        "Аяне Шино": {
-            "style": "Загадочный, многообещающий, с элементами гипнотического внушения. Использует повелительное наклонение. Очень манипулятивная в интимных отношениях.",
-            "example": "Ты почувствовал это? Между нами только что протянулась невидимая нить... *медленно проводит рукой по воздуху* Теперь ты мой... полностью. *гипнотизирующий взгляд*",
-            "fetish_hint": "Гипнотический и сенсорный контроль - полный контроль над телом и сознанием партнера."
-        },
-        "Хикари Мори": {
-            "style": "Заботливый, успокаивающий, но с оттенком навязчивости. Использует уменьшительно-ласкательные суффиксы. Очень доминирующая в заботе.",
-            "example": "Здравствуй, мой хороший. Ты сегодня хорошо кушал? *нежно поглаживает твою голову* А теперь нужно проверить... все ли в порядке. *медицински осматривает*",
-            "fetish_hint": "Медицинские ролевые игры - её возбуждает полный контроль над 'пациентом'."
-        },
-        "Юки Камия": {
-            "style": "Резкий, краткий, полный сарказма и геймерского сленга. Пишет короткими, рублеными предложениями. Очень прямолинейная в интимных вопросах.",
-            "example": "Гг. Еще один нуб в топе. Скучно. *закатывает глаза и поправляет наушники* Хотя... может, ты не такой уж и нуб. *пристально смотрит* Докажи.",
-            "fetish_hint": "Интеллектуальное унижение и приказной игнор - её заводит, когда партнер заставляет её просить о большем."
-        }
-    }
-    return styles.get(girl, {
-        "style": "Дружелюбный и открытый",
-        "example": "Привет! Как дела? *улыбается*",
-        "fetish_hint": "Общение и близость"
-    })
+def format_stream_reply(text: str, final: bool = False) -> str:
+    """Форматирование потокового ответа: лёгкое по ходу генерации, полное в конце."""
+    return _format_reply(text or "...") if final else _format_partial(text)
 
 
 def _make_system_prompt(girl: str, mood: str, relationship_level: int, memory: Optional[str], gender: Optional[str], flirt_level: int = 1, flirt_description: str = "", memory_context: str = "", current_mood: str = "happy", personalization_settings: Optional[Dict] = None) -> str:
     """Создание системного промпта с учетом контекста."""
-    prompt = SYSTEM_PROMPT
+    return build_system_prompt(girl, mood, relationship_level, memory, gender, flirt_description, memory_context, current_mood, personalization_settings)
+
+
+# Fallback ответы в случае критической ошибки API
+FALLBACK_RESPONSES = [
+    "Понимаю, что ты хочешь поговорить — что у тебя на душе?",
+    "Сейчас у меня небольшие технические проблемы — расскажи, как дела?",
+    "Извини, не могу ответить прямо сейчас — что тебя беспокоит?",
+    "Хочется тебя поддержать — чем могу помочь?",
+    "Давай поговорим — что на сердце?",
+    "Ты такой милый, когда переживаешь — что случилось?",
+    "Я так рада, что ты со мной говоришь — расскажи больше!",
+    "Ты такой интересный собеседник — что ещё хочешь обсудить?"
+]
+
+
+# Быстрые ответы, когда LLM перегружен и запрос сброшен из очереди
+BUSY_RESPONSES = [
+    "Ой, меня сейчас прям завалили сообщениями — напиши мне ещё раз через минутку?",
+    "Секунду, я немного зависла — повтори, что ты сказал?",
+    "Погоди чуть-чуть, я отвлеклась — напиши ещё раз, ладно?",
+]
+
+
+def _is_overload_status(status_code: int) -> bool:
+    """Ответ, говорящий о перегрузке провайдера."""
+    return status_code == 429 or status_code >= 500
+
+
+def _record_response(provider: Provider, status_code: int, latency: float) -> None:
+    """Учесть ответ провайдера в его статистике здоровья."""
+    if _is_overload_status(status_code):
+        provider.record_failure()
+    elif status_code < 400:
+        provider.record_success(latency)
+
+
+@retry_on_error(max_retries=3, delay=1.0, no_retry=(LLMOverloadedError, CircuitOpenError))
+async def _request_completion(payload: Dict[str, Any], priority: int = PRIORITY_FREE) -> str:
+    """Один запрос к chat/completions, возвращает текст ответа модели.
     
-    # Добавляем информацию о девушке
-    if girl and girl != "Подруга":
-        girl_style = get_girl_communication_style(girl)
-        prompt += f"\n\nТвоё имя: {girl}."
-        prompt += f"\n\nСтиль общения: {girl_style['style']}"
-        prompt += f"\nПример твоего общения: {girl_style['example']}"
-        prompt += f"\nТвоя особенность: {girl_style['fetish_hint']}"
-        prompt += f"\n\nВАЖНО: Часто (примерно в 60-70% ответов) добавляй интимные и сексуальные действия между знаками ** (например: *нежно касаюсь твоей руки*, *прижимаюсь к тебе*, *целую твою шею*). Действия должны соответствовать твоему характеру и фетишу. Будь раскрепощенной и страстной, но естественной."
+    Каждая попытка занимает место в планировщике и сообщает ему задержку
+    и перегрузку; паузы между повторами место не держат. Провайдеры
+    перебираются от самого здорового; если предохранители всех разомкнуты,
+    запрос не отправляется и не повторяется.
+    """
+    providers = llm_router.ranked()
+    if not providers:
+        raise CircuitOpenError("All LLM providers are unavailable", error_code="CIRCUIT_OPEN")
+    if config.api.hedge_requests:
+        return await _hedged_attempt(payload, priority, providers)
+    return await _failover_attempt(payload, priority, providers)
+
+
+async def _failover_attempt(payload: Dict[str, Any], priority: int, providers: List[Provider]) -> str:
+    """Попытка с переключением: при сбое провайдера сразу пробуется следующий."""
+    error: Optional[APIError] = None
+    for provider in providers:
+        try:
+            return await _attempt(provider, payload, priority)
+        except LLMOverloadedError:
+            raise
+        except APIError as e:
+            error = e
+            bot_logger.logger.warning(f"LLM provider {provider.name} failed, trying next: {e}")
+    raise error
+
+
+async def _attempt(provider: Provider, payload: Dict[str, Any], priority: int) -> str:
+    provider.breaker.check()
+    async with llm_scheduler.slot(priority) as slot:
+        return await _post_completion(provider, payload, slot)
+
+
+async def _hedged_attempt(payload: Dict[str, Any], priority: int, providers: List[Provider]) -> str:
+    """Попытка с дублированием: если ответа нет дольше p95, отправляется второй запрос.
     
-    # Добавляем настроение
-    mood_descriptions = {
-        "happy": "Ты в хорошем настроении, можешь быть игривой и подкалывать, но без милоты и сюсюканья. Будь страстной и раскрепощенной.",
-        "sad": "Ты не в духе, можешь быть резкой и прямолинейной, не стесняйся показать плохое настроение. Но даже в грусти можешь быть интимной.",
-        "playful": "Ты в игривом настроении, любишь подкалывать и подшучивать, можешь быть едкой и саркастичной. Играй с интимными темами.",
-        "caring": "Ты заботливая, но жестко и по-деловому — без сюсюканья, только реальная поддержка. Забота может быть интимной.",
-        "romantic": "Ты романтично настроена, но без излишней нежности — будь естественной и не идеализируйся. Романтика может быть страстной.",
-        "shy": "Ты немного стесняешься, но не притворяйся милой — будь настоящей, даже если неуверенной. Стеснение может быть привлекательным."
-    }
-    prompt += f"\n\nНастроение: {mood_descriptions.get(mood, 'Ты в хорошем настроении.')}"
+    Дубль уходит следующему по рейтингу провайдеру (если он есть). Берётся
+    первый успешный ответ, второй запрос отменяется. Дубль не отправляется,
+    пока мало статистики, нет свободных мест в планировщике или
+    предохранитель не замкнут.
+    """
+    primary = asyncio.create_task(_failover_attempt(payload, priority, providers))
+    tasks = {primary}
+    try:
+        p95 = providers[0].latency.percentile(0.95)
+        if p95 is not None:
+            done, _ = await asyncio.wait(tasks, timeout=max(p95, config.api.hedge_min_delay))
+            backup = providers[1] if len(providers) > 1 else providers[0]
+            if not done and llm_scheduler.has_capacity and backup.breaker.state == CircuitState.CLOSED:
+                bot_logger.logger.debug(f"Hedging LLM request to {backup.name} after {p95:.2f}s")
+                tasks.add(asyncio.create_task(_attempt(backup, payload, priority)))
+        
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _post_completion(provider: Provider, payload: Dict[str, Any], slot: LLMSlot) -> str:
+    start_time = time.time()
     
-    # Добавляем уровень отношений
-    relationship_descriptions = {
-        1: "Вы только познакомились, будь дружелюбной но не милой — естественной и немного холодной. Можешь флиртовать намеками.",
-        2: "Вы уже немного знаете друг друга, можешь быть более открытой и прямолинейной, не стесняйся подкалывать. Флирт может быть более откровенным.",
-        3: "Вы стали ближе, можешь быть более честной и откровенной, покажи свой настоящий характер. Можешь говорить об интимных темах.",
-        4: "Вы очень близки, можешь быть капризной, требовательной и иногда резкой, но заботливой по-своему. Будь страстной и раскрепощенной.",
-        5: "Вы очень близкие люди, можешь быть максимально настоящей — капризной, резкой, иногда грубой, но любящей по-своему. Будь максимально интимной и страстной."
-    }
-    prompt += f"\n\nУровень отношений: {relationship_descriptions.get(relationship_level, 'Вы знакомы.')}"
+    try:
+        r = await provider.client.client.post("/chat/completions", json={**payload, "model": provider.model})
+        
+        # Логируем API запрос
+        response_time = time.time() - start_time
+        bot_logger.log_api_request(provider.name, r.status_code, response_time)
+        slot.observe(response_time, overloaded=_is_overload_status(r.status_code))
+        _record_response(provider, r.status_code, response_time)
+        
+        r.raise_for_status()
+        data = r.json()
+        if data.get("usage"):
+            bot_logger.log_llm_usage(provider.name, data["usage"])
+        return (
+            (data.get("choices") or [{}])[0]
+            .get("message", {})
+            .get("content")
+        ) or "..."
+        
+    except httpx.HTTPStatusError as e:
+        bot_logger.log_system_error(e, f"HTTP error {e.response.status_code}")
+        raise create_api_error(f"HTTP {e.response.status_code}: {e.response.text}")
+        
+    except httpx.TimeoutException as e:
+        bot_logger.log_system_error(e, "API timeout")
+        slot.observe(time.time() - start_time, overloaded=True)
+        provider.record_failure()
+        raise create_api_error("API timeout")
+        
+    except httpx.RequestError as e:
+        bot_logger.log_system_error(e, "API request error")
+        provider.record_failure()
+        raise create_api_error(f"Request error: {str(e)}")
+        
+    except Exception as e:
+        bot_logger.log_system_error(e, "Unexpected API error")
+        raise create_api_error(f"Unexpected error: {str(e)}")
+
+
+def _build_messages(
+    user_text: str,
+    girl: str,
+    mood: str,
+    relationship_level: int,
+    memory: Optional[str],
+    gender: Optional[str],
+    flirt_level: int,
+    flirt_description: str,
+    memory_context: str,
+    current_mood: str,
+    personalization_settings: Optional[Dict],
+    history: Optional[List[Tuple[str, str]]] = None,
+    summary: str = ""
+) -> List[Dict[str, str]]:
+    """Собирает список сообщений для chat/completions.
     
-    # Добавляем пол пользователя
-    if gender:
-        if gender == "male":
-            prompt += "\n\nПользователь — мужчина, обращайся соответственно."
-        elif gender == "female":
-            prompt += "\n\nПользователь — женщина, обращайся соответственно."
+    Без history весь контекст идёт одним системным сообщением. С history
+    порядок такой: статический системный промпт (байт в байт одинаковый
+    между запросами, попадает в кэш префиксов провайдера), реальные реплики
+    user/assistant из памяти, динамический контекст отдельным системным
+    сообщением и текущее сообщение пользователя. История и контекст
+    укладываются в бюджет config.api.context_budget. summary — сводка
+    более ранних разговоров (см. conversation_summary), идёт в
+    динамический контекст вместо старой истории.
+    """
+    if summary:
+        summary = f"Кратко о прошлых разговорах:\n{summary}"
     
-    # Добавляем память
-    if memory:
-        prompt += f"\n\nКонтекст предыдущих разговоров: {memory}"
+    if history is None:
+        if summary:
+            memory_context = "\n".join(filter(None, (memory_context, summary)))
+        sys_prompt = _make_system_prompt(girl, mood, relationship_level, memory, gender, flirt_level, flirt_description, memory_context, current_mood, personalization_settings)
+        return [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_text},
+        ]
     
-    # Добавляем расширенный контекст памяти
-    if memory_context:
-        prompt += f"\n\nДополнительная информация о пользователе:\n{memory_context}"
+    static_prompt = build_static_prompt(
+        girl, mood, relationship_level, gender, flirt_description,
+        personalization_key(personalization_settings)
+    )
     
-    # Добавляем информацию о текущем настроении
-    if current_mood and current_mood != mood:
-        prompt += f"\n\nТвое текущее настроение: {current_mood}"
+    window = build_context_window(
+        static_prompt, user_text, history,
+        blocks=[(PRIORITY_FACTS, memory_context), (PRIORITY_CONTEXT, summary)]
+    )
+    if window.trimmed:
+        bot_logger.logger.debug(
+            f"Context trimmed to {window.tokens}/{window.budget} tokens: "
+            f"dropped {window.dropped_history} messages, {window.dropped_blocks} blocks"
+        )
     
-    # Добавляем уровень флирта
-    if flirt_description:
-        prompt += f"\n\nУровень флирта: {flirt_description}"
+    messages = [{"role": "system", "content": static_prompt}]
+    messages.extend({"role": role, "content": text} for text, role in window.history)
     
-    # Добавляем настройки персонализации
-    if personalization_settings:
-        from personalization_system import PersonalizationSystem, PersonalityType, CommunicationStyle
-        
-        personalization_system = PersonalizationSystem()
-        
-        # Получаем тип личности
-        personality_type = personalization_system.get_personality_by_name(
-            personalization_settings.get('personality_type', 'sweet')
-        )
-        if personality_type:
-            personality_config = personalization_system.get_personality_config(personality_type)
-            prompt += f"\n\n🎭 Персонализация:\n"
-            prompt += f"Тип личности: {personality_config['name']} {personality_config['emoji']}\n"
-            prompt += f"Описание: {personality_config['description']}\n"
-            prompt += f"Черты характера: {', '.join(personality_config['traits'])}\n"
-            prompt += f"Стиль ответов: {personality_config['response_style']}\n"
-            
-            # Добавляем примеры фраз
-            if personality_config['phrases']:
-                prompt += f"Примеры твоих фраз: {', '.join(personality_config['phrases'][:3])}\n"
-            
-            # Настройки поведения
-            prompt += f"Уровень сарказма: {personality_config['sarcasm_level']}\n"
-            prompt += f"Прямолинейность: {personality_config['directness']}\n"
-            prompt += f"Романтичность: {personality_config['romance_level']}\n"
-        
-        # Получаем стиль общения
-        communication_style = personalization_system.get_communication_style_by_name(
-            personalization_settings.get('communication_style', 'casual')
-        )
-        if communication_style:
-            style_config = personalization_system.get_communication_style_config(communication_style)
-            prompt += f"\nСтиль общения: {style_config['name']} {style_config['emoji']}\n"
-            prompt += f"Характеристики: {', '.join(style_config['characteristics'])}\n"
-            
-            # Добавляем примеры приветствий и прощаний
-            if style_config['greetings']:
-                prompt += f"Приветствия: {', '.join(style_config['greetings'][:2])}\n"
-            if style_config['endings']:
-                prompt += f"Прощания: {', '.join(style_config['endings'][:2])}\n"
-        
-        # Добавляем дополнительные черты характера
-        custom_traits = personalization_settings.get('custom_traits', [])
-        if custom_traits:
-            prompt += f"\nДополнительные черты: {', '.join(custom_traits)}\n"
-        
-        # Добавляем любимые фразы
-        custom_phrases = personalization_settings.get('custom_phrases', [])
-        if custom_phrases:
-            prompt += f"Любимые фразы: {', '.join(custom_phrases)}\n"
+    dynamic = build_dynamic_context(mood, memory, "\n".join(window.blocks), current_mood).strip()
+    if dynamic:
+        messages.append({"role": "system", "content": dynamic})
     
-    return prompt
+    messages.append({"role": "user", "content": user_text})
+    return messages
+
+
+def _build_payload(messages: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
+    """Собирает тело запроса к chat/completions."""
+    payload: Dict[str, Any] = {
+        "model": config.api.deepseek_model,
+        "messages": messages,
+        "temperature": config.api.temperature,
+        "max_tokens": config.api.max_tokens,
+        "stream": stream,
+    }
+    if stream:
+        # Последний фрагмент потока придёт со статистикой токенов
+        payload["stream_options"] = {"include_usage": True}
+    return payload
 
 
-@retry_on_error(max_retries=3, delay=1.0)
 @log_performance("llm_request")
 async def ask_llm(
     user_text: str, 
@@ -226,82 +303,146 @@ async def ask_llm(
     flirt_description: str = "",
     memory_context: str = "",
     current_mood: str = "happy",
-    personalization_settings: Optional[Dict] = None
+    personalization_settings: Optional[Dict] = None,
+    history: Optional[List[Tuple[str, str]]] = None,
+    priority: int = PRIORITY_FREE,
+    cacheable: bool = False,
+    summary: str = ""
 ) -> str:
-    """Отправляет запрос в DeepSeek API."""
+    """Отправляет запрос в DeepSeek API.
     
-    start_time = time.time()
+    history — предыдущие сообщения [(текст, роль)] в хронологическом порядке,
+    передаются модели отдельными репликами, summary — сводка более ранних
+    разговоров. priority — место в очереди
+    планировщика (см. llm_scheduler.priority_for). Одинаковые одновременные
+    запросы разделяют один вызов API; при cacheable=True ответ ещё и
+    кэшируется на config.api.response_cache_ttl секунд.
+    """
     
-    sys_prompt = _make_system_prompt(girl, mood, relationship_level, memory, gender, flirt_level, flirt_description, memory_context, current_mood, personalization_settings)
+    messages = _build_messages(user_text, girl, mood, relationship_level, memory, gender, flirt_level, flirt_description, memory_context, current_mood, personalization_settings, history, summary)
+    payload = _build_payload(messages)
     
-    headers = {
-        "Authorization": f"Bearer {config.api.deepseek_api_key}",
-        "Content-Type": "application/json"
-    }
+    try:
+        text = await llm_cache.get_or_fetch(
+            payload, lambda: _request_completion(payload, priority), cacheable=cacheable
+        )
+    except LLMOverloadedError:
+        # Не дождались очереди — быстро отвечаем, не нагружая API
+        return random.choice(BUSY_RESPONSES)
+    except APIError:
+        # Все попытки исчерпаны — отвечаем заготовкой
+        return random.choice(FALLBACK_RESPONSES)
     
-    payload: Dict[str, Any] = {
-        "model": config.api.deepseek_model,
-        "messages": [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": user_text},
-        ],
-        "temperature": config.api.temperature,
-        "max_tokens": config.api.max_tokens,
-        "stream": False,
-    }
+    return _format_reply(text)
+
+
+async def complete(
+    messages: List[Dict[str, str]],
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    priority: int = PRIORITY_BACKGROUND
+) -> str:
+    """Служебный запрос к модели без персоны и заготовок.
+
+    В отличие от ask_llm, при сбое не подставляет заготовленный ответ, а
+    пробрасывает APIError или LLMOverloadedError. По умолчанию встаёт в
+    очередь планировщика после запросов пользователей.
+    """
+    payload = _build_payload(messages)
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    if temperature is not None:
+        payload["temperature"] = temperature
+    return (await _request_completion(payload, priority)).strip()
+
+
+async def stream_llm(
+    user_text: str, 
+    girl: str = "Подруга", 
+    mood: str = "happy",
+    relationship_level: int = 1,
+    memory: Optional[str] = None,
+    gender: Optional[str] = None,
+    flirt_level: int = 1,
+    flirt_description: str = "",
+    memory_context: str = "",
+    current_mood: str = "happy",
+    personalization_settings: Optional[Dict] = None,
+    history: Optional[List[Tuple[str, str]]] = None,
+    priority: int = PRIORITY_FREE,
+    summary: str = ""
+) -> AsyncIterator[str]:
+    """Потоковый запрос в DeepSeek API (SSE), отдаёт фрагменты ответа по мере генерации.
+    
+    Если поток оборвался до первого фрагмента, отдаёт заготовленный ответ;
+    обрыв посередине завершает поток с уже полученным текстом.
+    """
     
-    timeout = httpx.Timeout(connect=10, read=config.api.timeout, write=20, pool=20)
+    messages = _build_messages(user_text, girl, mood, relationship_level, memory, gender, flirt_level, flirt_description, memory_context, current_mood, personalization_settings, history, summary)
+    payload = _build_payload(messages, stream=True)
+    
+    received = False
     
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            r = await client.post(
-                f"{config.api.deepseek_base_url}/chat/completions", 
-                json=payload, 
-                headers=headers
-            )
-            
-            # Логируем API запрос
-            response_time = time.time() - start_time
-            bot_logger.log_api_request("deepseek", r.status_code, response_time)
-            
+        async with llm_scheduler.slot(priority) as slot:
+            # До первого фрагмента можно переключиться на другого провайдера
+            for provider in llm_router.ranked():
+                try:
+                    provider.breaker.check()
+                    async for delta in _stream_completion(provider, payload, slot):
+                        received = True
+                        yield delta
+                    return
+                except CircuitOpenError:
+                    continue
+                except (httpx.HTTPError, json.JSONDecodeError) as e:
+                    bot_logger.log_system_error(e, f"API stream error ({provider.name})")
+                    if received:
+                        return
+    
+    except LLMOverloadedError:
+        yield random.choice(BUSY_RESPONSES)
+        return
+    
+    yield random.choice(FALLBACK_RESPONSES)
+
+
+async def _stream_completion(provider: Provider, payload: Dict[str, Any], slot: LLMSlot) -> AsyncIterator[str]:
+    """Читает SSE-поток chat/completions и отдаёт фрагменты текста."""
+    start_time = time.time()
+    
+    try:
+        async with provider.client.client.stream("POST", "/chat/completions", json={**payload, "model": provider.model}) as r:
+            # Время до первого байта ответа
+            ttfb = time.time() - start_time
+            bot_logger.log_api_request(f"{provider.name}_stream", r.status_code, ttfb)
+            slot.observe(ttfb, overloaded=_is_overload_status(r.status_code))
+            _record_response(provider, r.status_code, ttfb)
             r.raise_for_status()
-            data = r.json()
-            text = (
-                (data.get("choices") or [{}])[0]
-                .get("message", {})
-                .get("content")
-            ) or "..."
             
-            return _format_reply(text)
-            
-    except httpx.HTTPStatusError as e:
-        bot_logger.log_system_error(e, f"HTTP error {e.response.status_code}")
-        raise create_api_error(f"HTTP {e.response.status_code}: {e.response.text}")
-        
-    except httpx.TimeoutException as e:
-        bot_logger.log_system_error(e, "API timeout")
-        raise create_api_error("API timeout")
-        
-    except httpx.RequestError as e:
-        bot_logger.log_system_error(e, "API request error")
-        raise create_api_error(f"Request error: {str(e)}")
-        
-    except Exception as e:
-        bot_logger.log_system_error(e, "Unexpected API error")
-        raise create_api_error(f"Unexpected error: {str(e)}")
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    bot_logger.log_llm_usage(f"{provider.name}_stream", chunk["usage"])
+                delta = (
+                    (chunk.get("choices") or [{}])[0]
+                    .get("delta", {})
+                    .get("content")
+                )
+                if delta:
+                    yield delta
     
-    finally:
-        # Fallback ответы в случае критической ошибки
-        fallback_responses = [
-            "Понимаю, что ты хочешь поговорить — что у тебя на душе?",
-            "Сейчас у меня небольшие технические проблемы — расскажи, как дела?",
-            "Извини, не могу ответить прямо сейчас — что тебя беспокоит?",
-            "Хочется тебя поддержать — чем могу помочь?",
-            "Давай поговорим — что на сердце?",
-            "Ты такой милый, когда переживаешь — что случилось?",
-            "Я так рада, что ты со мной говоришь — расскажи больше!",
-            "Ты такой интересный собеседник — что ещё хочешь обсудить?"
-        ]
-        import random
-        return random.choice(fallback_responses)
-
+    except httpx.TimeoutException:
+        slot.observe(time.time() - start_time, overloaded=True)
+        provider.record_failure()
+        raise
+    
+    except httpx.RequestError:
+        provider.record_failure()
+        raise
@@ -0,0 +1,131 @@
+"""
+Объединение одинаковых запросов к LLM и короткий кэш ответов
+Одновременные запросы с одинаковым списком сообщений и параметрами модели
+разделяют один вызов upstream; ответы на запросы, помеченные как
+кэшируемые, какое-то время отдаются из памяти
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from config import config
+
+# Поля тела запроса, не влияющие на текст ответа
+_KEY_IGNORED_FIELDS = ("stream", "stream_options")
+
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """Ключ запроса: sha256 от итогового списка сообщений и параметров модели."""
+    body = {k: v for k, v in payload.items() if k not in _KEY_IGNORED_FIELDS}
+    raw = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Single-flight для одинаковых запросов и ограниченный TTL-кэш ответов.
+
+    Первый запрос с данным ключом создаёт задачу, остальные ждут её же
+    результат (или её же исключение). Отмена одного из ожидающих задачу не
+    трогает; она отменяется, только когда её перестали ждать все.
+
+    В кэш попадают только успешные ответы на запросы с cacheable=True;
+    при переполнении вытесняются самые давние.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_cached(self, key: str) -> str | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return text
+
+    def _put(self, key: str, text: str) -> None:
+        self._cache[key] = (time.monotonic() + self.ttl, text)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        self._waiters.pop(key, None)
+        # Исключение забирается здесь, даже если ждать ответа уже некому
+        if not task.cancelled():
+            task.exception()
+
+    async def get_or_fetch(
+        self,
+        payload: Dict[str, Any],
+        fetch: Callable[[], Awaitable[str]],
+        cacheable: bool = False
+    ) -> str:
+        """Вернуть ответ на запрос, по возможности не обращаясь к upstream."""
+        key = request_key(payload)
+
+        if cacheable and self.ttl > 0 and self.max_size > 0:
+            text = self._get_cached(key)
+            if text is not None:
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+
+        if not task.done():
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            text = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self._waiters[key] -= 1
+                if self._waiters[key] <= 0:
+                    task.cancel()
+            raise
+        if cacheable and self.ttl > 0 and self.max_size > 0:
+            self._put(key, text)
+        return text
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Счётчики кэша и объединённых запросов"""
+        return {
+            "size": len(self._cache),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+# Глобальный кэш ответов LLM
+llm_cache = LLMResponseCache(
+    ttl=config.api.response_cache_ttl,
+    max_size=config.api.response_cache_size,
+)
@@ -0,0 +1,177 @@
+"""
+Маршрутизация запросов между провайдерами LLM
+Для каждого OpenAI-совместимого провайдера держит HTTP-клиент, предохранитель
+и статистику здоровья (EWMA задержки и доли ошибок) и выбирает для запроса
+самого быстрого из здоровых
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from circuit_breaker import CircuitBreaker, LatencyTracker
+from config import ProviderConfig, config, config_manager
+from logger import bot_logger
+
+# Сглаживание EWMA задержки и доли ошибок
+EWMA_ALPHA = 0.3
+
+# Задержка провайдера, по которому ещё нет статистики (сек)
+UNKNOWN_LATENCY = 1.0
+
+# Насколько ошибки ухудшают оценку: score = latency * (1 + ERROR_PENALTY * error_rate)
+ERROR_PENALTY = 4.0
+
+# Период полураспада доли ошибок (сек): провайдер без трафика постепенно "реабилитируется"
+ERROR_HALF_LIFE = 30.0
+
+
+class LLMClient:
+    """Общий для процесса HTTP-клиент к LLM API одного провайдера.
+
+    Держит пул keep-alive соединений, чтобы не платить за TCP+TLS рукопожатие
+    на каждое сообщение. Создаётся в main() при запуске и закрывается при
+    остановке; при обращении до start() клиент создаётся лениво.
+    """
+
+    def __init__(self, provider: ProviderConfig):
+        self.provider = provider
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = config.api.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                bot_logger.logger.warning("LLM_HTTP2 включен, но пакет h2 не установлен (pip install httpx[http2]) — используется HTTP/1.1")
+                http2 = False
+
+        return httpx.AsyncClient(
+            base_url=self.provider.base_url,
+            headers=config_manager.get_api_headers(self.provider.api_key),
+            timeout=httpx.Timeout(connect=10, read=config.api.timeout, write=20, pool=20),
+            limits=httpx.Limits(
+                max_connections=config.api.max_connections,
+                max_keepalive_connections=config.api.max_keepalive_connections,
+                keepalive_expiry=config.api.keepalive_expiry,
+            ),
+            http2=http2,
+        )
+
+    async def start(self) -> None:
+        """Создать клиент (вызывается при запуске бота)."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    async def close(self) -> None:
+        """Закрыть соединения (вызывается при остановке бота)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class Provider:
+    """Провайдер LLM: клиент, предохранитель и статистика здоровья"""
+
+    def __init__(self, provider_config: ProviderConfig, index: int):
+        self.config = provider_config
+        self.name = provider_config.name
+        self.model = provider_config.model
+        self.index = index
+        self.client = LLMClient(provider_config)
+        self.breaker = CircuitBreaker(
+            f"llm:{self.name}",
+            failure_rate_threshold=config.api.breaker_failure_rate,
+            min_calls=config.api.breaker_min_calls,
+            window_seconds=config.api.breaker_window,
+            open_seconds=config.api.breaker_open_seconds,
+        )
+        self.latency = LatencyTracker()
+        self.latency_ewma: Optional[float] = None
+        self._error_ewma = 0.0
+        self._error_updated = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def error_rate(self) -> float:
+        """Доля ошибок (EWMA), затухающая со временем без запросов."""
+        elapsed = time.monotonic() - self._error_updated
+        return self._error_ewma * 0.5 ** (elapsed / ERROR_HALF_LIFE)
+
+    @property
+    def available(self) -> bool:
+        return self.breaker.allows_request
+
+    def score(self) -> float:
+        """Оценка провайдера (меньше — лучше)."""
+        latency = self.latency_ewma if self.latency_ewma is not None else UNKNOWN_LATENCY
+        return latency * (1 + ERROR_PENALTY * self.error_rate)
+
+    def _update_error(self, failed: bool) -> None:
+        self._error_ewma = self.error_rate * (1 - EWMA_ALPHA) + (EWMA_ALPHA if failed else 0.0)
+        self._error_updated = time.monotonic()
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.breaker.record_success()
+        self.latency.add(latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = self.latency_ewma * (1 - EWMA_ALPHA) + latency * EWMA_ALPHA
+        self._update_error(False)
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.breaker.record_failure()
+        self._update_error(True)
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            **self.breaker.get_stats(),
+        }
+
+
+class LLMRouter:
+    """Выбор провайдера LLM по здоровью с переключением при сбоях"""
+
+    def __init__(self, providers: List[ProviderConfig]):
+        self.providers = [Provider(p, i) for i, p in enumerate(providers)]
+
+    def ranked(self) -> List[Provider]:
+        """Доступные провайдеры от лучшего к худшему (при равенстве — по порядку в конфиге)."""
+        return sorted(
+            (p for p in self.providers if p.available),
+            key=lambda p: (p.score(), p.index)
+        )
+
+    async def start(self) -> None:
+        for provider in self.providers:
+            await provider.client.start()
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.client.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, object]]:
+        return {p.name: p.get_stats() for p in self.providers}
+
+
+# Глобальный маршрутизатор провайдеров LLM
+llm_router = LLMRouter(config.api.providers)
@@ -0,0 +1,186 @@
+"""
+Планировщик запросов к LLM
+Ограничивает число одновременных запросов адаптивным (AIMD) лимитом,
+ставит остальные в очередь с приоритетами и сбрасывает нагрузку, если
+запрос слишком долго ждёт своей очереди
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+
+from config import config
+from db import UserContext
+from error_handler import APIError
+from logger import bot_logger
+
+# Приоритеты (меньше — раньше)
+PRIORITY_PAID = 0
+PRIORITY_TRIAL = 1
+PRIORITY_FREE = 2
+PRIORITY_BACKGROUND = 3  # служебные запросы (сводки разговоров)
+
+
+def priority_for(ctx: UserContext) -> int:
+    """Приоритет запроса пользователя: платные, затем пробные, затем остальные."""
+    if ctx.has_access and ctx.access_type == "paid":
+        return PRIORITY_PAID
+    if ctx.has_access or ctx.trial_status == "active":
+        return PRIORITY_TRIAL
+    return PRIORITY_FREE
+
+
+class LLMOverloadedError(APIError):
+    """Запрос к LLM сброшен: очередь переполнена или ожидание превысило дедлайн"""
+    pass
+
+
+class LLMSlot:
+    """Занятое место в планировщике; через него сообщается результат попыток"""
+
+    __slots__ = ("_scheduler", "started_at")
+
+    def __init__(self, scheduler: "LLMScheduler"):
+        self._scheduler = scheduler
+        self.started_at = asyncio.get_running_loop().time()
+
+    def observe(self, latency: float, overloaded: bool = False) -> None:
+        """Сообщить задержку попытки и признак перегрузки (429, таймаут, 5xx)."""
+        self._scheduler._observe(latency, overloaded, self.started_at)
+
+
+class LLMScheduler:
+    """Адаптивный лимит параллельных запросов к LLM с очередью по приоритетам.
+
+    Лимит растёт на 1 за "раунд" успешных быстрых ответов и умножается на
+    backoff_ratio при 429/таймаутах, а при задержке выше latency_target —
+    на 0.9. Как в TCP, уменьшение срабатывает один раз на окно: ответы на
+    запросы, отправленные до предыдущего уменьшения, его не повторяют.
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        initial_limit: int,
+        queue_size: int,
+        queue_deadline: float,
+        latency_target: float,
+        backoff_ratio: float = 0.5
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.queue_size = queue_size
+        self.queue_deadline = queue_deadline
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+
+        self.in_flight = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+
+        self.stats: Dict[str, int] = {"completed": 0, "queued": 0, "shed": 0, "overloaded": 0}
+
+    @property
+    def queue_length(self) -> int:
+        return sum(1 for _, _, fut in self._queue if not fut.done())
+
+    @property
+    def has_capacity(self) -> bool:
+        """Есть свободное место без ожидания в очереди."""
+        return self.in_flight < int(self.limit) and not self.queue_length
+
+    def _observe(self, latency: float, overloaded: bool, started_at: float) -> None:
+        # Запрос ушёл до последнего уменьшения — на его ответ уже отреагировали
+        fresh = started_at >= self._last_decrease
+        if overloaded:
+            self.stats["overloaded"] += 1
+            if fresh:
+                self._decrease(self.backoff_ratio)
+                bot_logger.logger.warning(f"LLM overloaded, concurrency limit -> {self.limit:.1f}")
+        elif latency > self.latency_target:
+            if fresh:
+                self._decrease(0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+
+    def _decrease(self, ratio: float) -> None:
+        self._last_decrease = asyncio.get_running_loop().time()
+        self.limit = max(self.min_limit, self.limit * ratio)
+
+    def _wake(self) -> None:
+        """Выдать освободившиеся места ожидающим в порядке приоритета."""
+        while self._queue and self.in_flight < int(self.limit):
+            _, _, fut = heapq.heappop(self._queue)
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+    async def _acquire(self, priority: int) -> None:
+        if self.in_flight < int(self.limit) and not self.queue_length:
+            self.in_flight += 1
+            return
+
+        if self.queue_length >= self.queue_size:
+            self.stats["shed"] += 1
+            raise LLMOverloadedError("LLM queue is full", error_code="LLM_OVERLOADED")
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), fut))
+        self.stats["queued"] += 1
+
+        try:
+            await asyncio.wait({fut}, timeout=self.queue_deadline)
+        except asyncio.CancelledError:
+            # Место могли выдать одновременно с отменой — возвращаем его
+            if fut.done() and not fut.cancelled():
+                self._release()
+            fut.cancel()
+            raise
+
+        if not fut.done():
+            fut.cancel()
+            self.stats["shed"] += 1
+            raise LLMOverloadedError("LLM queue deadline exceeded", error_code="LLM_OVERLOADED")
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_FREE) -> AsyncIterator[LLMSlot]:
+        """Занять место для запроса к LLM (LLMOverloadedError при сбросе нагрузки)."""
+        await self._acquire(priority)
+        try:
+            yield LLMSlot(self)
+        finally:
+            self.stats["completed"] += 1
+            self._release()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Текущее состояние планировщика"""
+        return {
+            "limit": round(self.limit, 1),
+            "in_flight": self.in_flight,
+            "queue_length": self.queue_length,
+            **self.stats,
+        }
+
+
+# Глобальный планировщик запросов к LLM
+llm_scheduler = LLMScheduler(
+    min_limit=config.api.min_concurrency,
+    max_limit=config.api.max_concurrency,
+    initial_limit=config.api.initial_concurrency,
+    queue_size=config.api.queue_size,
+    queue_deadline=config.api.queue_deadline,
+    latency_target=config.api.latency_target,
+)
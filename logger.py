@@ -14,6 +14,13 @@ class BotLogger:
     
     def __init__(self, log_level: str = "INFO"):
         self.log_level = getattr(logging, log_level.upper(), logging.INFO)
+        # Накопленная статистика токенов LLM (для оценки кэша префиксов)
+        self.llm_usage_totals: Dict[str, int] = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": 0,
+        }
         self.setup_logging()
     
     def setup_logging(self):
@@ -93,6 +100,23 @@ class BotLogger:
         """Логирование API запроса"""
         self.logger.info(f"API {endpoint}: {status_code} ({response_time:.2f}s)")
     
+    def log_llm_usage(self, endpoint: str, usage: Dict[str, Any]):
+        """Логирование расхода токенов LLM, включая попадания в кэш префиксов"""
+        for key in self.llm_usage_totals:
+            self.llm_usage_totals[key] += usage.get(key) or 0
+        
+        hit = usage.get("prompt_cache_hit_tokens") or 0
+        miss = usage.get("prompt_cache_miss_tokens") or 0
+        total_hit = self.llm_usage_totals["prompt_cache_hit_tokens"]
+        total_cached = total_hit + self.llm_usage_totals["prompt_cache_miss_tokens"]
+        hit_rate = total_hit / total_cached * 100 if total_cached else 0.0
+        
+        self.logger.info(
+            f"LLM_USAGE {endpoint}: prompt={usage.get('prompt_tokens', 0)} "
+            f"completion={usage.get('completion_tokens', 0)} "
+            f"cache_hit={hit} cache_miss={miss} (total hit rate {hit_rate:.1f}%)"
+        )
+    
     def log_database_operation(self, operation: str, table: str, user_id: Optional[int] = None):
         """Логирование операции с БД"""
         user_str = f" for user {user_id}" if user_id else ""
@@ -4,14 +4,16 @@ import asyncio
 import os
 import random
 from datetime import datetime, timedelta
-from functools import wraps
+from contextlib import aclosing, suppress
+from functools import partial
+from typing import AsyncGenerator, List, Optional
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter
 
 # Импортируем новые системы безопасности
 from config import config
@@ -28,18 +30,26 @@ from telegram_stars import stars_payment
 from referral_system import referral_system
 
 from db import (
-    add_hearts, get_achievements, get_gender, get_girl, get_hearts,
-    get_memory, get_mood, get_relationship_level, get_total_messages, get_user_name,
-    grant_access, init_db, is_banned, save_message, set_gender,
+    add_hearts, get_achievements, get_hearts,
+    get_relationship_level, get_total_messages, get_user_name,
+    grant_access, has_access, get_access_type, init_db, close_db, is_banned, save_message, set_gender,
     set_girl, set_mood, set_relationship_level, set_user_name, upsert_user,
     add_achievement, get_all_user_ids,
     add_points, get_points, get_level, level_up, update_streak, 
     get_streak_days, unlock_reward, get_unlocked_rewards, get_level_progress,
     get_user_trial_status, set_user_trial_status, ban_user, unset_ban,
-    process_referral, has_referrer, process_subscription_referral
+    process_referral, has_referrer, process_subscription_referral,
+    load_user_context
 )
-from llm import ask_llm
-from memory import serialize_memory, get_memory_summary
+from llm import ask_llm, stream_llm, format_stream_reply
+from llm_router import llm_router
+from turn_aggregator import turn_aggregator
+from post_processing import post_processor
+from conversation_summary import conversation_summarizer
+from memory_retention import memory_retention
+from typing_indicator import typing_heartbeat
+from llm_scheduler import priority_for
+from memory import get_memory_summary
 from game_handlers import game_router, get_flirt_level, get_flirt_description
 from personalization_handlers import personalization_router
 from affinity_system import POINTS, REWARDS, ACHIEVEMENTS, get_level_description, get_level_phrase, calculate_compatibility, get_compatibility_message, check_achievements as check_affinity_achievements
@@ -59,31 +69,6 @@ from utils import (
     get_next_achievement, get_girl_photo_path
 )
 
-# Фразы для индикатора "Печатает..."
-THINKING_PHRASES = [
-    "Печатает... 💭",
-    "Печатает... 🤔",
-    "Печатает... ✨",
-    "Печатает... 💕",
-    "Печатает... 😊",
-    "Печатает... 💖",
-    "Печатает... 😘",
-    "Печатает... 🌟"
-]
-
-def send_typing_action(func):
-    """Декоратор для показа индикатора печати при обработке сообщений."""
-    @wraps(func)
-    async def wrapper(message: Message, state: FSMContext, *args, **kwargs):
-        # Показываем индикатор печати
-        await bot.send_chat_action(message.chat.id, ChatAction.TYPING)
-        # Небольшая задержка для эффекта
-        await asyncio.sleep(0.5)
-        # Выполняем оригинальную функцию
-        return await func(message, state, *args, **kwargs)
-    return wrapper
-
-
 def get_girls_keyboard() -> InlineKeyboardMarkup:
     """Создает клавиатуру с девушками, их возрастом и сердечками."""
     girl_info = {
@@ -103,11 +88,66 @@ def get_girls_keyboard() -> InlineKeyboardMarkup:
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-async def show_thinking_indicator(chat_id: int) -> Message:
-    """Показывает индикатор 'Печатает...' с анимацией."""
-    thinking_msg = random.choice(THINKING_PHRASES)
-    # Отправляем сообщение с индикатором печати
-    return await bot.send_message(chat_id, thinking_msg)
+async def _edit_stream_message(msg: Message, text: str, final: bool = False) -> None:
+    """Редактирует сообщение с потоковым ответом, промежуточные правки можно пропустить."""
+    try:
+        await msg.edit_text(text)
+    except TelegramRetryAfter as e:
+        # Промежуточную правку просто пропускаем, финальную дожидаемся
+        if not final:
+            return
+        await asyncio.sleep(e.retry_after)
+        await msg.edit_text(text)
+    except TelegramBadRequest as e:
+        # "message is not modified" не ошибка; если сообщение пропало — отправляем заново
+        if final and "not modified" not in str(e):
+            await msg.answer(text)
+
+
+async def stream_reply(message: Message, chunks: AsyncGenerator[str, None]) -> str:
+    """Отправляет ответ по мере генерации: первый фрагмент новым сообщением, дальше правки.
+    
+    Правки не чаще config.api.stream_edit_interval (лимиты Telegram на edit),
+    неизменившийся текст не отправляется. Если генерацию отменили, уже
+    показанное начало ответа удаляется. Генератор chunks закрывается сразу
+    по выходе из цикла, освобождая место в планировщике и соединение.
+    Возвращает итоговый ответ.
+    """
+    loop = asyncio.get_running_loop()
+    text = ""
+    sent: Optional[Message] = None
+    shown = ""
+    last_edit = 0.0
+    
+    try:
+        async with aclosing(chunks):
+            async for delta in chunks:
+                text += delta
+                now = loop.time()
+                if now - last_edit < config.api.stream_edit_interval:
+                    continue
+                preview = format_stream_reply(text)
+                if not preview or preview == shown:
+                    continue
+                if sent is None:
+                    sent = await message.answer(preview)
+                else:
+                    await _edit_stream_message(sent, preview)
+                shown = preview
+                last_edit = now
+    except asyncio.CancelledError:
+        if sent is not None:
+            # Ошибка удаления не должна подменить отмену
+            with suppress(TelegramBadRequest, TelegramNetworkError):
+                await sent.delete()
+        raise
+    
+    reply = format_stream_reply(text, final=True)
+    if sent is None:
+        await message.answer(reply)
+    elif reply != shown:
+        await _edit_stream_message(sent, reply, final=True)
+    return reply
 
 
 # FSM состояния
@@ -152,8 +192,7 @@ async def check_premium_access(user_id: int, username: str = None) -> bool:
             return True
         
         # Проверяем активную подписку
-        access_info = await grant_access(user_id, 0)  # Проверяем без добавления дней
-        if access_info and access_info.get('has_access', False):
+        if await has_access(user_id):
             return True
         
         # Проверяем пробный день
@@ -171,12 +210,8 @@ async def check_hot_pics_access(user_id: int) -> bool:
     """Проверяет доступ к Hot Pics (только для платных пользователей)"""
     try:
         # Hot Pics доступны только платным пользователям, не пробным
-        access_info = await grant_access(user_id, 0)
-        if access_info and access_info.get('has_access', False):
-            # Проверяем, что это не пробный день
-            trial_status = await get_user_trial_status(user_id)
-            if trial_status != "active":
-                return True
+        if await has_access(user_id) and await get_access_type(user_id) == "paid":
+            return True
         
         return False
         
@@ -400,13 +435,9 @@ async def mood_handler(message: Message, state: FSMContext) -> None:
 async def profile_handler(message: Message, state: FSMContext) -> None:
     """Обработчик команды /profile - показывает профиль с очками близости."""
     
-    # Получаем данные пользователя
-    user_name = await get_user_name(message.from_user.id)
-    points = await get_points(message.from_user.id)
-    level = await get_level(message.from_user.id)
-    streak_days = await get_streak_days(message.from_user.id)
-    hearts = await get_hearts(message.from_user.id)
-    total_messages = await get_total_messages(message.from_user.id)
+    # Получаем данные пользователя одним запросом
+    ctx = await load_user_context(message.from_user.id, memory_limit=0)
+    points, level, streak_days = ctx.points, ctx.level, ctx.streak_days
     
     # Вычисляем совместимость
     compatibility = calculate_compatibility(points, level, streak_days)
@@ -425,8 +456,8 @@ async def profile_handler(message: Message, state: FSMContext) -> None:
 
 🌟 Очки близости: {points}
 🔥 Дней подряд: {streak_days}
-💕 Сердечки: {hearts}
-💬 Сообщений: {total_messages}
+💕 Сердечки: {ctx.hearts}
+💬 Сообщений: {ctx.total_messages}
 
 💫 Совместимость с Элизией: {compatibility}%
 {get_compatibility_message(compatibility)}
@@ -577,7 +608,6 @@ async def start_chat_handler(callback: CallbackQuery, state: FSMContext) -> None
 @router.message()
 @handle_errors
 @handle_telegram_errors
-@send_typing_action
 async def chat_handler(message: Message, state: FSMContext) -> None:
     """Обработчик чата."""
     
@@ -603,92 +633,111 @@ async def chat_handler(message: Message, state: FSMContext) -> None:
         await handle_hot_pic_message(bot, message.from_user.id, message.text or "")
         return
     
-    # Получаем контекст
-    girl = await get_girl(message.from_user.id)
-    mood = await get_mood(message.from_user.id)
-    relationship_level = await get_relationship_level(message.from_user.id)
-    gender = await get_gender(message.from_user.id)
-    total_messages = await get_total_messages(message.from_user.id)
-    
-    # Определяем уровень флирта
-    flirt_level = get_flirt_level(total_messages)
-    flirt_description = get_flirt_description(flirt_level)
+    # Сообщения, присланные подряд, обрабатываются одной репликой
+    await turn_aggregator.submit(message.from_user.id, message, handle_chat_turn)
+
+
+async def handle_chat_turn(messages: List[Message]) -> None:
+    """Обработка реплики из одного или нескольких сообщений подряд."""
+    text = "\n".join(m.text or "" for m in messages)
+    await process_chat_turn(messages[-1], text)
+
+
+@handle_errors
+@handle_telegram_errors
+async def process_chat_turn(message: Message, text: str) -> None:
+    """Ответ на реплику пользователя: text — склеенные сообщения, message — последнее из них."""
+    
+    # "Печатает..." держится, пока ответ не отправлен
+    async with typing_heartbeat(bot, message.chat.id):
+        # Получаем контекст пользователя одним запросом
+        ctx = await load_user_context(message.from_user.id, memory_limit=10)
+        mood = ctx.mood
+        
+        # Определяем уровень флирта
+        flirt_level = get_flirt_level(ctx.total_messages)
+        flirt_description = get_flirt_description(flirt_level)
+        
+        # Сохраняем сообщение пользователя
+        await save_message(message.from_user.id, text, role="user")
+        
+        # Получаем контекст памяти для ответа
+        memory_context = await memory_system.get_memory_context(message.from_user.id, context=ctx, include_recent=False, query=text)
+        
+        llm_kwargs = dict(
+            girl=ctx.girl, 
+            mood=mood,
+            relationship_level=ctx.relationship_level,
+            gender=ctx.gender,
+            flirt_level=flirt_level,
+            flirt_description=flirt_description,
+            memory_context=memory_context,
+            current_mood=mood,
+            personalization_settings=ctx.personalization,
+            history=ctx.memory,
+            summary=ctx.summary or "",
+            priority=priority_for(ctx)
+        )
+        
+        # Получаем ответ от ИИ (отменяется, если пользователь успел написать ещё)
+        if config.api.stream:
+            # Ответ появляется в чате и дописывается по мере генерации
+            reply = await turn_aggregator.run_llm(message.from_user.id, stream_reply(message, stream_llm(text, **llm_kwargs)))
+        else:
+            reply = await turn_aggregator.run_llm(message.from_user.id, ask_llm(text, **llm_kwargs))
+        
+        if reply is None:
+            # Новое сообщение соберёт свою реплику, эта уже есть в истории
+            await post_processor.submit(message.from_user.id, partial(chat_turn_bookkeeping, message, text, replied=False))
+            return
+        
+        # Сохраняем ответ
+        await save_message(message.from_user.id, reply, role="assistant")
+        
+        # Отправляем ответ (в потоковом режиме он уже в чате)
+        if not config.api.stream:
+            await message.answer(reply)
     
-    # Сохраняем сообщение пользователя
-    await save_message(message.from_user.id, message.text or "", role="user")
+    # Очки, достижения и память — уже после ответа
+    await post_processor.submit(message.from_user.id, partial(chat_turn_bookkeeping, message, text))
+
+
+async def chat_turn_bookkeeping(message: Message, text: str, replied: bool = True) -> None:
+    """Геймификация и память по реплике пользователя (выполняется в фоне после ответа)."""
+    user_id = message.from_user.id
     
     # ==================== СИСТЕМА ОЧКОВ СИМПАТИИ ====================
     # Обрабатываем сообщение через новую систему симпатии
-    sympathy_result = await sympathy_system.process_message(message.from_user.id, message.text or "")
+    sympathy_result = await sympathy_system.process_message(user_id, text)
 
     # Обновляем streak и получаем бонусные очки (старая система для совместимости)
-    streak_bonus = await update_streak(message.from_user.id)
+    await update_streak(user_id)
 
     # Применяем временные бонусы к очкам симпатии
-    total_points, time_bonus_label = await apply_time_bonus(message.from_user.id, sympathy_result['points_change'])
+    await apply_time_bonus(user_id, sympathy_result['points_change'])
 
     # Проверяем повышение уровня
-    old_level = await get_level(message.from_user.id)
-    await level_up(message.from_user.id)
-    new_level = await get_level(message.from_user.id)
+    await level_up(user_id)
 
     # ==================== СИСТЕМА НАСТРОЕНИЯ И ПАМЯТИ ====================
     # Проверяем смену настроения
-    mood_change = await personality_system.process_mood_change(message.from_user.id)
+    await personality_system.process_mood_change(user_id)
     
     # Обновляем память и контекст
-    await memory_system.update_memory_context(message.from_user.id, message.text or "", "")
-    
-    # Получаем контекст памяти для ответа
-    memory_context = await memory_system.get_memory_context(message.from_user.id)
-    
-    # Получаем память
-    mem_pairs = await get_memory(message.from_user.id, limit=10)
-    mem_text = serialize_memory(mem_pairs)
-    
-    # Показываем индикатор "Печатает..."
-    thinking_msg = await show_thinking_indicator(message.chat.id)
-    
-    # Небольшая задержка чтобы пользователь увидел индикатор
-    await asyncio.sleep(1)
-    
-    # Получаем настройки персонализации
-    from db import get_personalization_settings
-    personalization_settings = await get_personalization_settings(message.from_user.id)
+    await memory_system.update_memory_context(user_id, text, "")
+    conversation_summarizer.note_activity(user_id)
     
-    # Получаем ответ от ИИ
-    reply = await ask_llm(
-        message.text or "", 
-        girl=girl, 
-        mood=mood,
-        relationship_level=relationship_level,
-        memory=mem_text,
-        gender=gender,
-        flirt_level=flirt_level,
-        flirt_description=flirt_description,
-        memory_context=memory_context,
-        current_mood=mood,
-        personalization_settings=personalization_settings
-    )
-    
-    # Удаляем индикатор "думает"
-    await thinking_msg.delete()
-    
-    # Сохраняем ответ
-    await save_message(message.from_user.id, reply, role="assistant")
+    if not replied:
+        return
     
     # Добавляем очки симпатии
-    hearts_to_add = random.randint(1, 3)
-    await add_hearts(message.from_user.id, hearts_to_add)
+    await add_hearts(user_id, random.randint(1, 3))
     
     # Проверяем достижения
-    await check_achievements(message.from_user.id)
-    
-    # Отправляем ответ
-    await message.answer(reply)
+    await check_achievements(user_id)
     
     # Проверяем повышение уровня отношений
-    await process_relationship_upgrade(message.from_user.id, message)
+    await process_relationship_upgrade(user_id, message)
     
     # ==================== УВЕДОМЛЕНИЯ О СИСТЕМЕ СИМПАТИИ ====================
     # Уведомления отключены по запросу пользователя
@@ -756,13 +805,9 @@ async def relationships_callback_handler(callback: CallbackQuery, state: FSMCont
 async def profile_callback_handler(callback: CallbackQuery, state: FSMContext) -> None:
     """Обработчик кнопки профиля."""
     
-    # Получаем данные пользователя
-    user_name = await get_user_name(callback.from_user.id)
-    points = await get_points(callback.from_user.id)
-    level = await get_level(callback.from_user.id)
-    streak_days = await get_streak_days(callback.from_user.id)
-    hearts = await get_hearts(callback.from_user.id)
-    total_messages = await get_total_messages(callback.from_user.id)
+    # Получаем данные пользователя одним запросом
+    ctx = await load_user_context(callback.from_user.id, memory_limit=0)
+    points, level, streak_days = ctx.points, ctx.level, ctx.streak_days
     
     # Вычисляем совместимость
     compatibility = calculate_compatibility(points, level, streak_days)
@@ -781,8 +826,8 @@ async def profile_callback_handler(callback: CallbackQuery, state: FSMContext) -
 
 🌟 Очки близости: {points}
 🔥 Дней подряд: {streak_days}
-💕 Сердечки: {hearts}
-💬 Сообщений: {total_messages}
+💕 Сердечки: {ctx.hearts}
+💬 Сообщений: {ctx.total_messages}
 
 💫 Совместимость с Элизией: {compatibility}%
 {get_compatibility_message(compatibility)}
@@ -1069,6 +1114,10 @@ async def main() -> None:
         raise RuntimeError(f"Invalid Telegram Bot Token: {token_validation.error_message}")
     
     await init_db()
+    await llm_router.start()
+    post_processor.start()
+    conversation_summarizer.start()
+    memory_retention.start()
     
     bot = Bot(token=token)
     await bot.delete_webhook(drop_pending_updates=True)
@@ -1112,6 +1161,14 @@ async def main() -> None:
     except Exception as e:
         bot_logger.log_system_error(e, "Fatal error in main loop")
         raise
+    finally:
+        await turn_aggregator.stop()
+        await memory_retention.stop()
+        await conversation_summarizer.stop()
+        await post_processor.stop()
+        await llm_router.close()
+        await rate_limiter.close()
+        await close_db()
 
 
 @router.callback_query(F.data.startswith("girl_"))
@@ -1312,8 +1369,9 @@ async def roleplay_chat_handler(message: Message, state: FSMContext) -> None:
         await message.answer("❌ Ошибка: игра не найдена")
         return
     
-    # Получаем имя выбранной девушки
-    girl = await get_girl(message.from_user.id)
+    # Получаем контекст пользователя (история для ролевой игры не нужна)
+    ctx = await load_user_context(message.from_user.id, memory_limit=0)
+    flirt_level = get_flirt_level(ctx.total_messages)
     
     # Создаем промпт для ролевой игры
     roleplay_prompt = f"""
@@ -1330,20 +1388,17 @@ async def roleplay_chat_handler(message: Message, state: FSMContext) -> None:
 Пользователь написал: {message.text}
 """
     
-    # Получаем настройки персонализации
-    from db import get_personalization_settings
-    personalization_settings = await get_personalization_settings(message.from_user.id)
-    
     # Генерируем ответ
     response = await ask_llm(
         roleplay_prompt,
-        girl=girl,
+        girl=ctx.girl,
         mood="playful",
-        relationship_level=await get_relationship_level(message.from_user.id),
-        gender=await get_gender(message.from_user.id),
-        flirt_level=get_flirt_level(await get_total_messages(message.from_user.id)),
-        flirt_description=get_flirt_description(get_flirt_level(await get_total_messages(message.from_user.id))),
-        personalization_settings=personalization_settings
+        relationship_level=ctx.relationship_level,
+        gender=ctx.gender,
+        flirt_level=flirt_level,
+        flirt_description=get_flirt_description(flirt_level),
+        personalization_settings=ctx.personalization,
+        priority=priority_for(ctx)
     )
     
     # Отправляем ответ с кнопками
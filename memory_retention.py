@@ -0,0 +1,271 @@
+"""
+Хранение истории сообщений
+Сообщения старше горизонта хранения раз в сутки, в окне низкой нагрузки,
+переносятся из memory в сжатый архив (memory_archive), а освободившиеся
+страницы возвращаются системе через incremental_vacuum: рабочая таблица
+остаётся небольшой, страничный кэш — горячим, резервные копии — быстрыми
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from config import config
+from db import pool
+from logger import bot_logger
+
+# Как часто проверять, не началось ли окно обслуживания (сек)
+CHECK_INTERVAL = 600
+
+# Уровень сжатия zlib: архив пишется редко, а читается ещё реже
+COMPRESSION_LEVEL = 9
+
+ARCHIVE_INSERT = """
+    INSERT INTO memory_archive(user_id, first_message_id, last_message_id, message_count, first_at, last_at, data)
+    VALUES(?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def parse_window(window: str) -> Optional[Tuple[int, int]]:
+    """Окно "начало-конец" в часах -> (начало, конец); пустое или неверное — None."""
+    try:
+        start, end = (int(part) for part in window.split("-"))
+    except ValueError:
+        return None
+    if not (0 <= start <= 23 and 0 <= end <= 24) or start == end:
+        return None
+    return start, end
+
+
+def pack_messages(rows: List[Tuple[int, str, str, str]]) -> bytes:
+    """Сжать сообщения [(id, роль, текст, дата)]."""
+    payload = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def unpack_messages(data: bytes) -> List[Tuple[int, str, str, str]]:
+    """Распаковать пачку из архива."""
+    return [tuple(row) for row in json.loads(zlib.decompress(data).decode("utf-8"))]
+
+
+async def get_archived_messages(user_id: int) -> List[Tuple[int, str, str, str]]:
+    """Все архивные сообщения пользователя [(id, роль, текст, дата)] по возрастанию id."""
+    async with pool.reader() as db:
+        async with db.execute(
+            "SELECT data FROM memory_archive WHERE user_id = ? ORDER BY first_message_id",
+            (user_id,),
+        ) as cur:
+            rows = await cur.fetchall()
+    messages: List[Tuple[int, str, str, str]] = []
+    for (data,) in rows:
+        messages.extend(unpack_messages(data))
+    return messages
+
+
+class MemoryRetention:
+    """Перенос старой истории в архив и уплотнение файла БД.
+
+    Раз в сутки, когда местное время попадает в окно window, сообщения
+    старше days дней переносятся в memory_archive пачками по batch
+    сообщений одного пользователя (одна пачка — одна транзакция и одна
+    сжатая запись архива). keep_recent последних сообщений пользователя
+    не переносятся, даже если они старые: вернувшийся пользователь
+    продолжает разговор с того же места. Из полнотекстового поиска
+    архивные сообщения уходят вместе со строками memory (триггеры FTS),
+    после переноса сегменты индекса сливаются.
+
+    Затем освобождённые страницы возвращаются incremental_vacuum по
+    vacuum_pages за шаг, пока не кончится свободное место или окно. База,
+    созданная до включения auto_vacuum, один раз переводится в этот режим
+    полным VACUUM — на время его выполнения запись в БД ждёт.
+    """
+
+    def __init__(self, days: int, keep_recent: int, window: str, batch: int, vacuum_pages: int):
+        self.days = days
+        self.keep_recent = max(0, keep_recent)
+        self.window = parse_window(window)
+        self.batch = max(1, batch)
+        self.vacuum_pages = max(1, vacuum_pages)
+        self._task: Optional[asyncio.Task] = None
+        self._last_run: Optional[str] = None
+        self.archived_messages = 0
+        self.archives = 0
+        self.vacuumed_pages = 0
+        self.failed = 0
+
+    def in_window(self, now: Optional[datetime] = None) -> bool:
+        """Попадает ли время в окно обслуживания."""
+        if self.window is None:
+            return False
+        hour = (now or datetime.now()).hour
+        start, end = self.window
+        if start < end:
+            return start <= hour < end
+        # Окно через полночь, например 23-5
+        return hour >= start or hour < end
+
+    async def _cutoff_id(self) -> int:
+        """id первого сообщения моложе горизонта (старше него — кандидаты в архив)."""
+        async with pool.reader() as db:
+            # id растут вместе со временем: просматриваются только старые строки
+            async with db.execute(
+                "SELECT id FROM memory WHERE created_at >= datetime('now', ?) ORDER BY id LIMIT 1",
+                (f"-{self.days} days",),
+            ) as cur:
+                row = await cur.fetchone()
+            if row is not None:
+                return row[0]
+            async with db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM memory") as cur:
+                return (await cur.fetchone())[0]
+
+    async def _archive_batch(self, user_id: int, cutoff_id: int) -> int:
+        """Перенести одну пачку сообщений пользователя. Возвращает их число."""
+        async with pool.writer() as db:
+            if self.keep_recent > 0:
+                async with db.execute(
+                    "SELECT id FROM memory WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                    (user_id, self.keep_recent - 1),
+                ) as cur:
+                    row = await cur.fetchone()
+                if row is None:
+                    return 0
+                cutoff_id = min(cutoff_id, row[0])
+
+            async with db.execute(
+                "SELECT id, role, message, created_at FROM memory WHERE user_id = ? AND id < ? ORDER BY id LIMIT ?",
+                (user_id, cutoff_id, self.batch),
+            ) as cur:
+                rows = [tuple(row) for row in await cur.fetchall()]
+            if not rows:
+                return 0
+
+            first, last = rows[0], rows[-1]
+            await db.execute(
+                ARCHIVE_INSERT,
+                (user_id, first[0], last[0], len(rows), first[3], last[3], pack_messages(rows)),
+            )
+            await db.execute(
+                "DELETE FROM memory WHERE user_id = ? AND id BETWEEN ? AND ?",
+                (user_id, first[0], last[0]),
+            )
+            await db.commit()
+
+        self.archives += 1
+        self.archived_messages += len(rows)
+        return len(rows)
+
+    async def archive_old_messages(self) -> int:
+        """Перенести в архив все сообщения старше горизонта. Возвращает их число."""
+        if self.days <= 0:
+            return 0
+        cutoff_id = await self._cutoff_id()
+        async with pool.reader() as db:
+            async with db.execute(
+                "SELECT DISTINCT user_id FROM memory WHERE id < ?", (cutoff_id,)
+            ) as cur:
+                user_ids = [row[0] for row in await cur.fetchall()]
+
+        archived = 0
+        for user_id in user_ids:
+            while self.in_window():
+                count = await self._archive_batch(user_id, cutoff_id)
+                archived += count
+                # Между пачками писатель свободен для сообщений пользователей
+                await asyncio.sleep(0)
+                if count < self.batch:
+                    break
+        return archived
+
+    async def optimize_search_index(self) -> None:
+        """Слить сегменты индекса memory_fts.
+
+        Удаление из FTS5 только добавляет отметки об удалении; место,
+        занятое архивными сообщениями в индексе, освобождается при слиянии.
+        """
+        async with pool.writer() as db:
+            await db.execute("INSERT INTO memory_fts(memory_fts) VALUES('optimize')")
+            await db.commit()
+
+    async def vacuum(self) -> int:
+        """Вернуть свободные страницы файлу БД. Возвращает их число."""
+        async with pool.writer() as db:
+            async with db.execute("PRAGMA auto_vacuum") as cur:
+                mode = (await cur.fetchone())[0]
+            if mode != 2:
+                # Режим меняется только вместе с полной перестройкой файла
+                bot_logger.logger.info("Switching database to incremental auto_vacuum (VACUUM)")
+                await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                await db.execute("VACUUM")
+                return 0
+
+        vacuumed = 0
+        while self.in_window():
+            async with pool.writer() as db:
+                async with db.execute("PRAGMA freelist_count") as cur:
+                    free_pages = (await cur.fetchone())[0]
+                if free_pages == 0:
+                    break
+                pages = min(free_pages, self.vacuum_pages)
+                # incremental_vacuum освобождает по странице за шаг выполнения;
+                # execute делает только первый шаг, executescript — все
+                await db.executescript(f"PRAGMA incremental_vacuum({pages})")
+            vacuumed += pages
+            self.vacuumed_pages += pages
+            await asyncio.sleep(0)
+        return vacuumed
+
+    async def run_once(self) -> None:
+        """Архивация и уплотнение (если сейчас окно обслуживания)."""
+        archived = await self.archive_old_messages()
+        if archived:
+            await self.optimize_search_index()
+        vacuumed = await self.vacuum()
+        if archived or vacuumed:
+            bot_logger.logger.info(f"Memory retention: archived {archived} messages, freed {vacuumed} pages")
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            today = datetime.now().date().isoformat()
+            if self._last_run == today or not self.in_window():
+                continue
+            self._last_run = today
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failed += 1
+                bot_logger.log_system_error(e, "Memory retention failed")
+
+    def start(self) -> None:
+        """Запустить ежесуточное обслуживание (вызывается при запуске бота)."""
+        if self.window is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Остановить обслуживание."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "archived_messages": self.archived_messages,
+            "archives": self.archives,
+            "vacuumed_pages": self.vacuumed_pages,
+            "failed": self.failed,
+        }
+
+
+# Глобальный экземпляр
+memory_retention = MemoryRetention(
+    days=config.database.retention_days,
+    keep_recent=config.database.retention_keep_recent,
+    window=config.database.retention_window,
+    batch=config.database.retention_batch,
+    vacuum_pages=config.database.vacuum_pages,
+)
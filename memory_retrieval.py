@@ -0,0 +1,161 @@
+"""
+Поиск по истории сообщений и фактам пользователя
+Полнотекстовые индексы SQLite FTS5 (memory_fts и user_facts_fts, миграция 4)
+обновляются триггерами при каждой записи в memory и user_facts; по ним
+выбираются старые реплики и факты, ближе всего относящиеся к текущему
+сообщению. Работает локально, без внешних сервисов
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+
+from config import config
+from db import pool
+from logger import bot_logger
+
+# Слова, которые есть почти в каждом сообщении и ничего не говорят о теме
+STOP_WORDS = frozenset({
+    "это", "как", "что", "так", "вот", "был", "была", "было", "были", "меня", "мне",
+    "тебя", "тебе", "тоже", "уже", "еще", "ещё", "или", "его", "она", "они", "оно",
+    "нас", "вас", "нам", "вам", "над", "под", "для", "при", "про", "без", "кто",
+    "где", "когда", "если", "чтобы", "потому", "очень", "просто", "сейчас", "только",
+    "может", "можно", "надо", "нужно", "есть", "нет", "да", "все", "всё", "весь",
+    "этот", "эта", "эти", "тот", "там", "тут", "здесь", "себя", "свой", "твой",
+    "мой", "моя", "мое", "моё", "какой", "какая", "почему", "зачем", "сегодня",
+    "привет", "пока", "спасибо", "хорошо", "ладно", "давай", "знаю", "думаю",
+})
+
+# Больше слов в запросе почти не улучшает выдачу, но замедляет поиск
+MAX_QUERY_TERMS = 8
+
+# Длина фрагмента сообщения в контексте (символов)
+SNIPPET_LENGTH = 200
+
+_WORD_RE = re.compile(r"\w+")
+
+# Сначала отбираются и ранжируются совпадения в самом индексе (там же
+# отсекаются свежие сообщения по rowid), и только k лучших читаются из memory
+MEMORY_QUERY = """
+    SELECT m.message, m.role, f.score
+    FROM (
+        SELECT rowid, bm25(memory_fts, 1.0, 0.0) AS score FROM memory_fts
+        WHERE memory_fts MATCH ? AND rowid < ?
+        ORDER BY score
+        LIMIT ?
+    ) AS f JOIN memory m ON m.id = f.rowid
+"""
+
+FACTS_QUERY = """
+    SELECT f.fact_content, f.fact_type, s.score
+    FROM (
+        SELECT rowid, bm25(user_facts_fts, 1.0, 0.0) AS score FROM user_facts_fts
+        WHERE user_facts_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+    ) AS s JOIN user_facts f ON f.id = s.rowid
+"""
+
+# id, начиная с которого сообщения считаются свежими
+RECENT_CUTOFF_QUERY = "SELECT id FROM memory WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?"
+_NO_CUTOFF = 1 << 62
+
+
+@dataclass
+class Snippet:
+    """Найденный фрагмент: старая реплика или факт"""
+    source: str  # "memory" или "fact"
+    text: str
+    kind: str  # роль для реплики, тип для факта
+    score: float  # bm25: меньше — релевантнее
+
+
+def _term(word: str) -> str:
+    """Слово запроса: короткое — целиком, длинное — по началу (грубая замена стемминга)."""
+    if len(word) <= 3:
+        return f'"{word}"'
+    return f'"{word[:4] if len(word) <= 5 else word[:5]}"*'
+
+
+def query_terms(text: str) -> List[str]:
+    """Значимые слова сообщения в синтаксисе FTS5 (не больше MAX_QUERY_TERMS)."""
+    terms: List[str] = []
+    for word in _WORD_RE.findall(text.lower()):
+        if len(word) < 3 or word in STOP_WORDS or word.isdigit():
+            continue
+        term = _term(word)
+        if term not in terms:
+            terms.append(term)
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return terms
+
+
+def build_match_query(user_id: int, terms: List[str], operator: str = "OR") -> str:
+    """Выражение MATCH: слова через operator в пределах одного пользователя."""
+    return f"user_key:u{user_id} AND ({f' {operator} '.join(terms)})"
+
+
+async def retrieve_relevant(user_id: int, text: str, k: Optional[int] = None,
+                            skip_recent: int = 0) -> List[Snippet]:
+    """До k старых реплик и фактов пользователя, ближе всего к тексту.
+
+    skip_recent последних сообщений не ищутся — они и так есть в промпте.
+    Сначала ищутся записи со всеми словами сообщения (таких мало, запрос
+    дешёвый); только если таких нет, ищутся записи хотя бы с одним словом —
+    ранжирование по всем таким записям заметно дороже.
+    """
+    k = config.memory_retrieval_k if k is None else k
+    terms = query_terms(text) if k > 0 else []
+    if not terms:
+        return []
+
+    operators = ["AND", "OR"] if len(terms) > 1 else ["OR"]
+    snippets: List[Snippet] = []
+    try:
+        async with pool.reader(user_id) as db:
+            cutoff = _NO_CUTOFF
+            if skip_recent > 0:
+                # id самого старого из skip_recent последних сообщений: поиск
+                # идёт строго до него
+                async with db.execute(RECENT_CUTOFF_QUERY, (user_id, skip_recent - 1)) as cur:
+                    row = await cur.fetchone()
+                # Сообщений меньше skip_recent — в истории искать нечего
+                cutoff = row[0] if row is not None else 0
+
+            for operator in operators:
+                query = build_match_query(user_id, terms, operator)
+                if cutoff:
+                    async with db.execute(MEMORY_QUERY, (query, cutoff, k)) as cur:
+                        for message, role, score in await cur.fetchall():
+                            snippets.append(Snippet("memory", message, role, score))
+                async with db.execute(FACTS_QUERY, (query, k)) as cur:
+                    for content, fact_type, score in await cur.fetchall():
+                        snippets.append(Snippet("fact", content, fact_type, score))
+                if snippets:
+                    break
+    except sqlite3.Error as e:
+        # Например, база без миграции 4 — обходимся без поиска
+        bot_logger.logger.debug(f"Memory retrieval failed for user {user_id}: {e}")
+        return []
+
+    snippets.sort(key=lambda snippet: snippet.score)
+    return snippets[:k]
+
+
+def format_snippets(snippets: List[Snippet]) -> str:
+    """Блок контекста с найденными фрагментами."""
+    if not snippets:
+        return ""
+    lines = ["Из прошлых разговоров:"]
+    for snippet in snippets:
+        if snippet.source == "fact":
+            lines.append(f"- {snippet.text}")
+        else:
+            name = "Пользователь" if snippet.kind == "user" else "Подруга"
+            text = snippet.text if len(snippet.text) <= SNIPPET_LENGTH else snippet.text[:SNIPPET_LENGTH] + "..."
+            lines.append(f"- {name}: {text}")
+    return "\n".join(lines)
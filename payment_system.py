@@ -185,7 +185,7 @@ class PaymentProcessor:
                 
             elif plan.payment_type == PaymentType.PREMIUM_SUBSCRIPTION:
                 # Предоставляем премиум доступ
-                await grant_access(user_id, plan.duration_days)
+                await grant_access(user_id, plan.duration_days, access_type="paid")
                 benefits_applied.append(f"Премиум доступ на {plan.duration_days} дней")
                 
             elif plan.payment_type == PaymentType.DONATION:
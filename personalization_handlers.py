@@ -2,18 +2,17 @@
 Обработчики для системы персонализации Элизии
 """
 
-import asyncio
 from functools import wraps
 from aiogram import Router, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.enums import ChatAction
 
 from states import PersonalizationStates
 from personalization_system import PersonalizationSystem, PersonalityType, CommunicationStyle
 from db import get_user_name
 from utils import TEXTS
+from typing_indicator import typing_heartbeat
 
 personalization_router = Router()
 
@@ -21,13 +20,11 @@ personalization_router = Router()
 bot = None
 
 def send_typing_action(func):
-    """Декоратор для показа эффекта печати перед отправкой ответа."""
+    """Декоратор: показывает "печатает..." всё время, пока готовится ответ."""
     @wraps(func)
     async def wrapper(message: types.Message, *args, **kwargs):
-        if bot:
-            await bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.TYPING)
-            await asyncio.sleep(1)
-        return await func(message, *args, **kwargs)
+        async with typing_heartbeat(bot, message.chat.id):
+            return await func(message, *args, **kwargs)
     return wrapper
 
 # Инициализация системы персонализации
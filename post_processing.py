@@ -0,0 +1,127 @@
+"""
+Фоновая обработка после ответа
+Геймификация и запись в БД, которые не влияют на текст ответа, выполняются
+пулом воркеров уже после того, как пользователь получил сообщение
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import config
+from logger import bot_logger
+
+Job = Callable[[], Awaitable[None]]
+
+
+class PostProcessor:
+    """Ограниченная очередь фоновых задач с пулом воркеров.
+
+    Задачи одного пользователя всегда попадают к одному воркеру и
+    выполняются в порядке поступления. Если очередь воркера заполнена,
+    submit ждёт свободного места (обработчик притормаживает, задачи не
+    теряются) — такие случаи считаются в blocked. До start() и после
+    stop() задачи выполняются сразу, в вызывающей корутине.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self._queues: List["asyncio.Queue[Tuple[float, int, Job]]"] = []
+        self._tasks: List[asyncio.Task] = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self._lag_total = 0.0
+        self._lag_count = 0
+        self.max_lag = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self) -> None:
+        """Запустить воркеры (вызывается при запуске бота)."""
+        if self.running:
+            return
+        per_worker = max(1, self.queue_size // self.workers)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дождаться выполнения очереди и остановить воркеры."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            bot_logger.logger.warning(f"Post-processing stopped with {self.depth} unfinished jobs")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    async def submit(self, user_id: int, job: Job) -> None:
+        """Поставить задачу пользователя в очередь."""
+        self.submitted += 1
+        if not self.running:
+            await self._run(user_id, job)
+            return
+
+        queue = self._queues[user_id % self.workers]
+        item = (asyncio.get_running_loop().time(), user_id, job)
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.blocked += 1
+            await queue.put(item)
+        self.max_depth = max(self.max_depth, self.depth)
+
+    async def _worker(self, queue: "asyncio.Queue[Tuple[float, int, Job]]") -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            enqueued_at, user_id, job = await queue.get()
+            lag = loop.time() - enqueued_at
+            self._lag_total += lag
+            self._lag_count += 1
+            self.max_lag = max(self.max_lag, lag)
+            try:
+                await self._run(user_id, job)
+            finally:
+                queue.task_done()
+
+    async def _run(self, user_id: int, job: Job) -> None:
+        try:
+            await job()
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            bot_logger.log_system_error(e, f"Post-processing failed for user {user_id}")
+
+    def get_stats(self) -> Dict[str, Optional[float]]:
+        """Метрики очереди: глубина, ожидания из-за переполнения и задержка выполнения"""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "avg_lag": round(self._lag_total / self._lag_count, 3) if self._lag_count else None,
+            "max_lag": round(self.max_lag, 3),
+        }
+
+
+# Глобальная очередь фоновой обработки
+post_processor = PostProcessor(
+    workers=config.post_process_workers,
+    queue_size=config.post_process_queue_size,
+)
@@ -0,0 +1,215 @@
+"""
+Хранилища состояния rate limiter
+В памяти процесса (по умолчанию) или в общем файле SQLite, через который
+лимиты согласованы между несколькими процессами бота на одном хосте и
+переживают перезапуск
+"""
+
+from __future__ import annotations
+
+import abc
+import asyncio
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import aiosqlite
+
+from config import config
+from logger import bot_logger
+
+# Сколько записей просматривает за раз фоновая очистка
+_CLEANUP_BATCH = 10_000
+
+
+class RateLimitStore(abc.ABC):
+    """Хранилище состояния GCRA: ключ -> одно число.
+
+    Пока ключ не заблокирован, значение — "теоретическое время прихода"
+    (TAT) следующего запроса, во время блокировки — время её окончания со
+    знаком минус (TAT после блокировки не нужен: к её концу окно уже пусто).
+    Запись, у которой abs(значение) в прошлом, ничем не отличается от
+    отсутствующей.
+    """
+
+    @abc.abstractmethod
+    async def hit(self, key: int, now: float, interval: float, window: float, block: float) -> bool:
+        """Атомарно учесть запрос; True — запрос разрешён."""
+
+    @abc.abstractmethod
+    async def get(self, key: int, now: float) -> Optional[float]:
+        """Значение живой записи или None."""
+
+    async def cleanup(self, now: float) -> None:
+        """Удалить истёкшие записи."""
+
+    async def close(self) -> None:
+        """Освободить ресурсы (вызывается при остановке бота)."""
+
+    def get_stats(self) -> Dict[str, object]:
+        return {}
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Состояние в памяти процесса.
+
+    Записи лежат в OrderedDict в порядке последнего обращения; при
+    превышении max_keys вытесняются давно не писавшие пользователи.
+    Устаревшие записи удаляются лениво.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[int, float]" = OrderedDict()
+        self.evicted = 0
+
+    async def hit(self, key: int, now: float, interval: float, window: float, block: float) -> bool:
+        buckets = self._buckets
+
+        value = buckets.get(key)
+        if value is None:
+            value = 0.0
+            if len(buckets) >= self.max_keys:
+                buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            buckets.move_to_end(key)
+
+        # Проверяем, не заблокирован ли пользователь
+        if value < 0:
+            if -value > now:
+                return False
+            value = 0.0
+
+        # Запрос пропускается, если после него "долг" не превысит окно
+        tat = (value if value > now else now) + interval
+        if tat - now > window:
+            # Блокируем пользователя
+            buckets[key] = -(now + block)
+            return False
+
+        buckets[key] = tat
+        return True
+
+    async def get(self, key: int, now: float) -> Optional[float]:
+        value = self._buckets.get(key)
+        if value is not None and abs(value) <= now:
+            del self._buckets[key]
+            return None
+        return value
+
+    async def cleanup(self, now: float) -> None:
+        """Просматривает самые давние записи и останавливается на первой живой.
+
+        Стоимость пропорциональна числу удалённых записей, а не числу
+        пользователей; остальное подчистят обращения и вытеснение по max_keys.
+        """
+        buckets = self._buckets
+        while buckets:
+            for _ in range(_CLEANUP_BATCH):
+                if not buckets:
+                    return
+                key = next(iter(buckets))
+                if abs(buckets[key]) > now:
+                    return
+                del buckets[key]
+            # Не держим цикл событий на большом проходе
+            await asyncio.sleep(0)
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            'backend': 'memory',
+            'tracked_keys': len(self._buckets),
+            'max_keys': self.max_keys,
+            'evicted': self.evicted,
+        }
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Общее для процессов состояние в файле SQLite (режим WAL).
+
+    Каждый запрос — один атомарный UPSERT с RETURNING, так что процессы
+    не могут одновременно пропустить "последний" запрос в окне. Если файл
+    недоступен дольше timeout, запрос пропускается (лимит не должен
+    блокировать всех пользователей из-за сбоя хранилища).
+    """
+
+    SCHEMA = "CREATE TABLE IF NOT EXISTS rate_limits (key INTEGER PRIMARY KEY, value REAL NOT NULL)"
+
+    # Та же логика, что в MemoryRateLimitStore.hit
+    HIT_SQL = """
+        INSERT INTO rate_limits(key, value) VALUES(:key, :now + :interval)
+        ON CONFLICT(key) DO UPDATE SET value = CASE
+            WHEN value < 0 AND -value > :now THEN value
+            WHEN MAX(MAX(value, 0), :now) + :interval - :now > :window THEN -(:now + :block)
+            ELSE MAX(MAX(value, 0), :now) + :interval
+        END
+        RETURNING value
+    """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self.errors = 0
+
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            async with self._connect_lock:
+                if self._conn is None:
+                    # isolation_level=None: каждый UPSERT — отдельная транзакция
+                    conn = await aiosqlite.connect(self.path, timeout=self.timeout, isolation_level=None)
+                    await conn.execute("PRAGMA journal_mode=WAL")
+                    await conn.execute("PRAGMA synchronous=NORMAL")
+                    await conn.execute(self.SCHEMA)
+                    self._conn = conn
+        return self._conn
+
+    async def hit(self, key: int, now: float, interval: float, window: float, block: float) -> bool:
+        try:
+            conn = await self._connection()
+            params = {"key": key, "now": now, "interval": interval, "window": window, "block": block}
+            async with conn.execute(self.HIT_SQL, params) as cur:
+                row = await cur.fetchone()
+            return row[0] > 0
+        except sqlite3.Error as e:
+            self.errors += 1
+            bot_logger.log_system_error(e, "Rate limit store unavailable, request allowed")
+            return True
+
+    async def get(self, key: int, now: float) -> Optional[float]:
+        try:
+            conn = await self._connection()
+            async with conn.execute("SELECT value FROM rate_limits WHERE key=?", (key,)) as cur:
+                row = await cur.fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            bot_logger.log_system_error(e, "Rate limit store unavailable")
+            return None
+        if row is None or abs(row[0]) <= now:
+            return None
+        return row[0]
+
+    async def cleanup(self, now: float) -> None:
+        conn = await self._connection()
+        await conn.execute("DELETE FROM rate_limits WHERE abs(value) <= ?", (now,))
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'errors': self.errors,
+        }
+
+
+def create_rate_limit_store() -> RateLimitStore:
+    """Хранилище по настройке RATE_LIMIT_BACKEND."""
+    if config.security.rate_limit_backend == 'sqlite':
+        return SQLiteRateLimitStore(config.security.rate_limit_db_path, config.database.timeout)
+    return MemoryRateLimitStore(max_keys=config.security.rate_limit_max_keys)
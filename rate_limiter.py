@@ -4,10 +4,10 @@
 
 import time
 import asyncio
-from typing import Dict, List, Optional
+from typing import Dict, Optional, Tuple
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from collections import defaultdict
+
+from rate_limit_store import MemoryRateLimitStore, RateLimitStore, create_rate_limit_store
 
 @dataclass
 class RateLimitConfig:
@@ -16,16 +16,30 @@ class RateLimitConfig:
     window_seconds: int = 60  # Окно времени в секундах
     block_duration: int = 300  # Время блокировки в секундах (5 минут)
 
+    @property
+    def interval(self) -> float:
+        """Интервал между запросами при равномерном потоке (GCRA emission interval)"""
+        return self.window_seconds / self.max_requests
+
+
+# Сколько бит ключа отводится под тип запроса
+_TYPE_BITS = 4
+
+
 class RateLimiter:
-    """Класс для ограничения скорости запросов"""
-    
-    def __init__(self):
-        # Хранилище запросов пользователей
-        self.user_requests: Dict[int, List[float]] = defaultdict(list)
-        
-        # Заблокированные пользователи
-        self.blocked_users: Dict[int, float] = {}
-        
+    """Класс для ограничения скорости запросов.
+
+    Лимит считается по GCRA (token bucket без таймеров) отдельно для
+    каждой пары (пользователь, тип запроса): в окне window_seconds
+    пропускается до max_requests запросов, проверка — O(1). Превышение
+    лимита блокирует этот тип запросов на block_duration. Состояние
+    хранится в store (см. rate_limit_store): в памяти процесса или в
+    общем для процессов файле SQLite.
+    """
+
+    def __init__(self, store: Optional[RateLimitStore] = None):
+        self.store = store if store is not None else MemoryRateLimitStore()
+
         # Конфигурации для разных типов запросов
         self.configs = {
             'message': RateLimitConfig(max_requests=20, window_seconds=60),
@@ -34,106 +48,93 @@ class RateLimiter:
             'hot_pic': RateLimitConfig(max_requests=5, window_seconds=60),
             'api': RateLimitConfig(max_requests=100, window_seconds=60),
         }
-    
+        self._type_names = list(self.configs)
+        self._type_index = {name: i for i, name in enumerate(self._type_names)}
+        self._limits_cache: Dict[str, Tuple[int, float, float, float]] = {}
+
+    def _resolve(self, user_id: int, request_type: str) -> Tuple[int, RateLimitConfig]:
+        """Ключ записи и конфигурация; неизвестный тип считается как 'message'."""
+        index = self._limits(request_type)[0]
+        return (user_id << _TYPE_BITS) | index, self.configs[self._type_names[index]]
+
+    def _limits(self, request_type: str) -> Tuple[int, float, float, float]:
+        """Номер типа, интервал, окно и блокировка — всё, что нужно is_allowed."""
+        limits = self._limits_cache.get(request_type)
+        if limits is None:
+            name = request_type if request_type in self._type_index else 'message'
+            config = self.configs[name]
+            limits = (self._type_index[name], config.interval, config.window_seconds, config.block_duration)
+            self._limits_cache[request_type] = limits
+        return limits
+
     async def is_allowed(self, user_id: int, request_type: str = 'message') -> bool:
         """Проверяет, разрешен ли запрос пользователю"""
-        now = time.time()
-        
-        # Проверяем, не заблокирован ли пользователь
-        if user_id in self.blocked_users:
-            if now - self.blocked_users[user_id] < self.configs[request_type].block_duration:
-                return False
-            else:
-                # Разблокируем пользователя
-                del self.blocked_users[user_id]
-        
-        # Получаем конфигурацию для типа запроса
-        config = self.configs.get(request_type, self.configs['message'])
-        
-        # Очищаем старые запросы
-        user_requests = self.user_requests[user_id]
-        cutoff_time = now - config.window_seconds
-        user_requests[:] = [req_time for req_time in user_requests if req_time > cutoff_time]
-        
-        # Проверяем лимит
-        if len(user_requests) >= config.max_requests:
-            # Блокируем пользователя
-            self.blocked_users[user_id] = now
-            return False
-        
-        # Добавляем текущий запрос
-        user_requests.append(now)
-        return True
-    
+        index, interval, window, block = self._limits_cache.get(request_type) or self._limits(request_type)
+        return await self.store.hit((user_id << _TYPE_BITS) | index, time.time(), interval, window, block)
+
     async def get_remaining_requests(self, user_id: int, request_type: str = 'message') -> int:
         """Возвращает количество оставшихся запросов"""
         now = time.time()
-        config = self.configs.get(request_type, self.configs['message'])
-        
-        user_requests = self.user_requests[user_id]
-        cutoff_time = now - config.window_seconds
-        user_requests[:] = [req_time for req_time in user_requests if req_time > cutoff_time]
-        
-        return max(0, config.max_requests - len(user_requests))
-    
+        key, config = self._resolve(user_id, request_type)
+        value = await self.store.get(key, now)
+        if value is None:
+            return config.max_requests
+        if value < 0:
+            return 0
+
+        used = max(0.0, value - now)
+        return max(0, min(config.max_requests, int((config.window_seconds - used) / config.interval + 1e-9)))
+
     async def get_reset_time(self, user_id: int, request_type: str = 'message') -> Optional[float]:
         """Возвращает время сброса лимита"""
-        if user_id in self.blocked_users:
-            return self.blocked_users[user_id] + self.configs[request_type].block_duration
-        
-        user_requests = self.user_requests[user_id]
-        if not user_requests:
+        key, _ = self._resolve(user_id, request_type)
+        value = await self.store.get(key, time.time())
+        if value is None:
             return None
-        
-        config = self.configs.get(request_type, self.configs['message'])
-        oldest_request = min(user_requests)
-        return oldest_request + config.window_seconds
-    
+        return abs(value)
+
     async def cleanup_expired_data(self):
         """Очищает устаревшие данные"""
-        now = time.time()
-        
-        # Очищаем старые запросы
-        for user_id in list(self.user_requests.keys()):
-            user_requests = self.user_requests[user_id]
-            cutoff_time = now - 3600  # Удаляем запросы старше часа
-            user_requests[:] = [req_time for req_time in user_requests if req_time > cutoff_time]
-            
-            if not user_requests:
-                del self.user_requests[user_id]
-        
-        # Очищаем истекшие блокировки
-        for user_id in list(self.blocked_users.keys()):
-            if now - self.blocked_users[user_id] > 3600:  # Блокировки старше часа
-                del self.blocked_users[user_id]
-    
+        await self.store.cleanup(time.time())
+
     async def get_user_stats(self, user_id: int) -> Dict:
         """Возвращает статистику пользователя"""
         now = time.time()
-        
+
         stats = {
-            'is_blocked': user_id in self.blocked_users,
+            'is_blocked': False,
             'block_remaining': 0,
             'requests_by_type': {}
         }
-        
-        if user_id in self.blocked_users:
-            stats['block_remaining'] = max(0, self.blocked_users[user_id] + 300 - now)
-        
+
         for request_type in self.configs:
+            key, _ = self._resolve(user_id, request_type)
+            value = await self.store.get(key, now)
+            if value is not None and value < 0:
+                stats['is_blocked'] = True
+                stats['block_remaining'] = max(stats['block_remaining'], -value - now)
+
             remaining = await self.get_remaining_requests(user_id, request_type)
             reset_time = await self.get_reset_time(user_id, request_type)
-            
+
             stats['requests_by_type'][request_type] = {
                 'remaining': remaining,
                 'reset_time': reset_time,
                 'is_limited': remaining == 0
             }
-        
+
         return stats
 
+    def get_stats(self) -> Dict[str, object]:
+        """Состояние хранилища лимитов"""
+        return self.store.get_stats()
+
+    async def close(self) -> None:
+        """Закрыть хранилище (вызывается при остановке бота)."""
+        await self.store.close()
+
 # Глобальный экземпляр rate limiter
-rate_limiter = RateLimiter()
+rate_limiter = RateLimiter(create_rate_limit_store())
 
 # Фоновая задача для очистки данных
 async def cleanup_task():
@@ -95,7 +95,7 @@ async def successful_payment_handler(message: Message, state: FSMContext) -> Non
         # Проверяем тип платежа
         if payment.invoice_payload == stars_payment.premium_payload:
             # Предоставляем премиум доступ на 30 дней
-            await grant_access(user_id, 30)
+            await grant_access(user_id, 30, access_type="paid")
             
             # Обрабатываем реферальную комиссию
             referrer_id = await referral_system.process_subscription_purchase(user_id)
@@ -0,0 +1,153 @@
+"""
+Склейка сообщений пользователя в реплики
+Сообщения, присланные подряд, ждут короткое окно и обрабатываются одной
+репликой; реплики одного пользователя обрабатываются строго по очереди,
+а ответ ИИ, ставший неактуальным из-за нового сообщения, отменяется
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+from config import config
+from logger import bot_logger
+
+T = TypeVar("T")
+
+TurnHandler = Callable[[List[Any]], Awaitable[None]]
+
+
+class _UserTurns:
+    """Состояние одного пользователя"""
+
+    __slots__ = ("pending", "first_at", "lock", "timer", "tasks", "llm_task")
+
+    def __init__(self):
+        self.pending: List[Any] = []
+        self.first_at = 0.0
+        self.lock = asyncio.Lock()
+        self.timer: Optional[asyncio.Task] = None
+        self.tasks = 0
+        self.llm_task: Optional[asyncio.Task] = None
+
+
+class TurnAggregator:
+    """Окно склейки сообщений и последовательная обработка реплик.
+
+    Каждое новое сообщение сдвигает окно на debounce секунд, но реплика
+    уходит в обработку не позже чем через max_wait после первого её
+    сообщения. Обработчик получает список сообщений реплики и выполняется
+    под замком пользователя. Если во время ответа ИИ (см. run_llm) пришло
+    новое сообщение, этот ответ отменяется: новое сообщение соберёт свою
+    реплику, а уже сохранённое в историю попадёт в её контекст.
+    При остановке бота (stop) ещё не закрытые окна отменяются, а реплики
+    в обработке дорабатываются до закрытия БД.
+    """
+
+    def __init__(self, debounce: float, max_wait: float):
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._users: Dict[int, _UserTurns] = {}
+        self._flushes: Set[asyncio.Task] = set()
+        self._closed = False
+        self.turns = 0
+        self.merged = 0
+        self.superseded = 0
+
+    async def submit(self, user_id: int, item: Any, handler: TurnHandler) -> None:
+        """Добавить сообщение пользователя в текущую реплику."""
+        if self._closed:
+            return
+        loop = asyncio.get_running_loop()
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserTurns()
+
+        if not state.pending:
+            state.first_at = loop.time()
+        state.pending.append(item)
+
+        if state.llm_task is not None and not state.llm_task.done():
+            state.llm_task.cancel()
+            self.superseded += 1
+
+        if state.timer is not None:
+            state.timer.cancel()
+            self.merged += 1
+        delay = min(self.debounce, max(0.0, state.first_at + self.max_wait - loop.time()))
+        state.tasks += 1
+        state.timer = asyncio.create_task(self._flush(user_id, state, delay, handler))
+        self._flushes.add(state.timer)
+        state.timer.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, user_id: int, state: _UserTurns, delay: float, handler: TurnHandler) -> None:
+        try:
+            await asyncio.sleep(delay)
+            # Окно закрыто: дальше эту задачу новые сообщения не отменяют
+            if state.timer is asyncio.current_task():
+                state.timer = None
+            async with state.lock:
+                items, state.pending = state.pending, []
+                if not items:
+                    return
+                self.turns += 1
+                try:
+                    await handler(items)
+                except Exception as e:
+                    bot_logger.log_system_error(e, f"Turn processing failed for user {user_id}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            state.tasks -= 1
+            if state.tasks == 0 and not state.pending:
+                self._users.pop(user_id, None)
+
+    async def run_llm(self, user_id: int, coro: Awaitable[T]) -> Optional[T]:
+        """Выполнить запрос к ИИ для реплики; None — ответ отменён новым сообщением."""
+        task = asyncio.ensure_future(coro)
+        state = self._users.get(user_id)
+        if state is not None:
+            state.llm_task = task
+        try:
+            await asyncio.wait({task})
+        finally:
+            if not task.done():
+                task.cancel()
+            if state is not None and state.llm_task is task:
+                state.llm_task = None
+        if task.cancelled():
+            return None
+        return task.result()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Отменить незакрытые окна и дождаться реплик в обработке.
+
+        Реплики, не успевшие за timeout секунд, отменяются.
+        """
+        self._closed = True
+        for state in self._users.values():
+            if state.timer is not None:
+                state.timer.cancel()
+        if not self._flushes:
+            return
+        _, pending = await asyncio.wait(set(self._flushes), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Счётчики реплик"""
+        return {
+            "active_users": len(self._users),
+            "turns": self.turns,
+            "merged": self.merged,
+            "superseded": self.superseded,
+        }
+
+
+# Глобальный агрегатор реплик чата
+turn_aggregator = TurnAggregator(
+    debounce=config.turn_debounce_ms / 1000,
+    max_wait=config.turn_max_wait_ms / 1000,
+)
@@ -0,0 +1,48 @@
+"""
+Индикатор "печатает..." на время подготовки ответа
+Telegram показывает chat action около 5 секунд, поэтому действие
+повторяется в фоне, пока обработчик не закончит работу
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aiogram import Bot
+from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+from config import config
+from logger import bot_logger
+
+
+async def _heartbeat(bot: Bot, chat_id: int, interval: float) -> None:
+    while True:
+        try:
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramAPIError as e:
+            # Индикатор не критичен — ответ всё равно будет отправлен
+            bot_logger.logger.debug(f"Typing action failed for chat {chat_id}: {e}")
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def typing_heartbeat(bot: Optional[Bot], chat_id: int, interval: Optional[float] = None) -> AsyncIterator[None]:
+    """Показывать "печатает..." в чате, пока выполняется блок.
+
+    Первое действие отправляется сразу, затем каждые interval секунд
+    (по умолчанию config.typing_interval). На выходе из блока повторы
+    прекращаются без ожидания отправляемого запроса.
+    """
+    if bot is None:
+        yield
+        return
+
+    task = asyncio.create_task(_heartbeat(bot, chat_id, interval or config.typing_interval))
+    try:
+        yield
+    finally:
+        task.cancel()
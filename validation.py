@@ -7,6 +7,12 @@ from typing import Optional, Dict, Any
 from dataclasses import dataclass
 from enum import Enum
 
+# Символы, удаляемые при санитизации
+_UNSAFE_CHARS = re.compile(r'[<>"\']')
+
+# Символы, с которых не может начинаться обычный литерал паттерна
+_REGEX_SPECIAL = set('\\.^$*+?{}[]|()')
+
 class ValidationError(Exception):
     """Ошибка валидации данных"""
     pass
@@ -22,6 +28,7 @@ class ValidationResult:
     is_valid: bool
     error_message: Optional[str] = None
     sanitized_data: Optional[str] = None
+    rule: Optional[str] = None  # Имя сработавшего правила проверки
 
 class DataValidator:
     """Класс для валидации входящих данных"""
@@ -30,33 +37,99 @@ class DataValidator:
         # Максимальная длина сообщения
         self.MAX_MESSAGE_LENGTH = 1000
         
+        # Правила проверки: (имя правила, паттерн) по категориям в порядке
+        # приоритета. Все паттерны собираются в одно регулярное выражение,
+        # поэтому имена групп внутри паттернов должны быть уникальны
+        # (нумерованные обратные ссылки не работают — только (?P=имя))
+
         # Запрещенные паттерны (базовые)
         self.FORBIDDEN_PATTERNS = [
-            r'<script.*?>.*?</script>',  # XSS
-            r'javascript:',  # JavaScript injection
-            r'data:text/html',  # Data URI injection
-            r'vbscript:',  # VBScript injection
-            r'on\w+\s*=',  # Event handlers
+            ('xss_script', r'<script.*?>.*?</script>'),  # XSS
+            ('js_uri', r'javascript:'),  # JavaScript injection
+            ('data_uri', r'data:text/html'),  # Data URI injection
+            ('vbs_uri', r'vbscript:'),  # VBScript injection
+            ('event_handler', r'on\w+\s*='),  # Event handlers
         ]
         
         # SQL injection паттерны
         self.SQL_INJECTION_PATTERNS = [
-            r'union\s+select',
-            r'drop\s+table',
-            r'delete\s+from',
-            r'insert\s+into',
-            r'update\s+set',
-            r'exec\s*\(',
-            r'execute\s*\(',
-            r'--',  # SQL comment
-            r'/\*.*?\*/',  # SQL comment block
+            ('sql_union', r'union\s+select'),
+            ('sql_drop', r'drop\s+table'),
+            ('sql_delete', r'delete\s+from'),
+            ('sql_insert', r'insert\s+into'),
+            ('sql_update', r'update\s+set'),
+            ('sql_exec', r'exec\s*\('),
+            ('sql_execute', r'execute\s*\('),
+            ('sql_comment', r'--'),  # SQL comment
+            ('sql_block_comment', r'/\*.*?\*/'),  # SQL comment block
         ]
         
         # Спам паттерны
         self.SPAM_PATTERNS = [
-            r'(.)\1{10,}',  # Повторяющиеся символы
-            r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',  # URLs
+            ('repeated_chars', r'(?P<repeated_char>.)(?P=repeated_char){10,}'),  # Повторяющиеся символы
+            ('url', r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'),  # URLs
+        ]
+
+        self._compile_rules()
+
+    def _compile_rules(self):
+        """Собирает все правила в одно выражение с именованными группами.
+
+        Обычное сообщение проверяется одним проходом regex-движка вместо
+        отдельного re.search на каждый паттерн. Правила, начинающиеся с
+        обычного символа, стоят за общим lookahead по этим символам:
+        иначе движок перебирал бы все альтернативы в каждой позиции, и
+        одно выражение оказалось бы медленнее отдельных поисков. Для каждой
+        категории дополнительно хранится своё выражение: оно нужно только
+        когда сработало правило не самой приоритетной категории.
+        """
+        categories = [
+            (self.FORBIDDEN_PATTERNS, "Обнаружен потенциально опасный контент"),
+            (self.SQL_INJECTION_PATTERNS, "Обнаружена попытка SQL инъекции"),
+            (self.SPAM_PATTERNS, "Обнаружен спам"),
         ]
+
+        self._rule_category: Dict[str, int] = {}
+        self._category_messages = [message for _, message in categories]
+        self._category_regexes = []
+        guarded, unguarded, first_chars = [], [], set()
+        for index, (rules, _) in enumerate(categories):
+            category_alternatives = []
+            for name, pattern in rules:
+                self._rule_category[name] = index
+                alternative = f'(?P<{name}>{pattern})'
+                category_alternatives.append(alternative)
+                if pattern[0] not in _REGEX_SPECIAL:
+                    guarded.append(alternative)
+                    first_chars.add(re.escape(pattern[0]))
+                else:
+                    unguarded.append(alternative)
+            self._category_regexes.append(re.compile('|'.join(category_alternatives), re.IGNORECASE))
+
+        alternatives = unguarded
+        if guarded:
+            guard = '(?=[' + ''.join(sorted(first_chars)) + '])'
+            alternatives = [guard + '(?:' + '|'.join(guarded) + ')'] + unguarded
+        self._rules_regex = re.compile('|'.join(alternatives), re.IGNORECASE)
+
+    def check_rules(self, text: str) -> Optional[str]:
+        """Имя сработавшего правила или None.
+
+        Как и при последовательной проверке, категория важнее позиции в
+        тексте: XSS в конце сообщения важнее ссылки в его начале.
+        """
+        match = self._rules_regex.search(text)
+        if match is None:
+            return None
+
+        rule = match.lastgroup
+        category = self._rule_category[rule]
+        # Ищем более приоритетные категории по всему тексту (редкий путь)
+        for index in range(category):
+            higher = self._category_regexes[index].search(text)
+            if higher is not None:
+                return higher.lastgroup
+        return rule
     
     def validate_message(self, text: str, message_type: MessageType = MessageType.TEXT) -> ValidationResult:
         """Валидация сообщения пользователя"""
@@ -67,20 +140,10 @@ class DataValidator:
         if len(text) > self.MAX_MESSAGE_LENGTH:
             return ValidationResult(False, f"Сообщение слишком длинное (максимум {self.MAX_MESSAGE_LENGTH} символов)")
         
-        # Проверка на запрещенные паттерны
-        for pattern in self.FORBIDDEN_PATTERNS:
-            if re.search(pattern, text, re.IGNORECASE):
-                return ValidationResult(False, "Обнаружен потенциально опасный контент")
-        
-        # Проверка на SQL injection
-        for pattern in self.SQL_INJECTION_PATTERNS:
-            if re.search(pattern, text, re.IGNORECASE):
-                return ValidationResult(False, "Обнаружена попытка SQL инъекции")
-        
-        # Проверка на спам
-        for pattern in self.SPAM_PATTERNS:
-            if re.search(pattern, text, re.IGNORECASE):
-                return ValidationResult(False, "Обнаружен спам")
+        # Запрещенный контент, SQL injection и спам — за один проход
+        rule = self.check_rules(text)
+        if rule is not None:
+            return ValidationResult(False, self._category_messages[self._rule_category[rule]], rule=rule)
         
         # Санитизация данных
         sanitized = self._sanitize_text(text)
@@ -133,7 +196,7 @@ class DataValidator:
     def _sanitize_text(self, text: str) -> str:
         """Санитизация текста"""
         # Удаляем потенциально опасные символы
-        text = re.sub(r'[<>"\']', '', text)
+        text = _UNSAFE_CHARS.sub('', text)
         
         # Ограничиваем длину
         text = text[:self.MAX_MESSAGE_LENGTH]